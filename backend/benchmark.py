@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# benchmark.py
+# Load and micro benchmarks: API endpoints against the fake LLM backend, plus the numeric hot paths.
+#
+# Endpoints are driven in-process through httpx's ASGI transport, so the numbers measure
+# the FastAPI app and services (validation, prompt building, parsing, NumPy work) with
+# the LLM replaced by services/fake_llm.py at a configurable latency.
+#
+#   python benchmark.py --llm-latency 0.05 --concurrency 1 8 32
+#   python benchmark.py --compare benchmark_results/<old>.json
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+
+DEFAULT_RESULTS_DIR = 'benchmark_results'
+ENDPOINTS = ("generate-plan", "simulate-scenarios", "chat", "evaluate-plan")
+
+SAMPLE_PROFILE = {
+    "name": "Benchmark User",
+    "age": 32,
+    "monthly_income": 150000,
+    "monthly_expenses": 70000,
+    "assets": {"cash_equivalents": 200000, "equity_investments": 500000, "other_investments": 100000},
+    "liabilities": {"high_interest_debt": 50000, "loans_emi": 15000},
+    "goals": [
+        {"name": "Buy a House", "target_amount": 5000000, "timeline_years": 8},
+        {"name": "Retirement", "target_amount": 30000000, "timeline_years": 25}
+    ],
+    "risk_profile_answers": [2, 2, 1]
+}
+
+SAMPLE_PLAN = {
+    "sentinel_plan": {
+        "summary": "Clear debt and build a cushion first.",
+        "asset_allocation": {"equities": "30%", "bonds": "50%", "commodities": "10%", "cash": "10%"},
+        "projected_goal_timeline_years": {"Buy a House": "9.1", "Retirement": "21.4"},
+        "recommendations": ["Pay off high-interest debt.", "Build a six-month emergency fund.", "Invest monthly in index funds."]
+    },
+    "voyager_plan": {
+        "summary": "Invest for growth while paying down debt.",
+        "asset_allocation": {"equities": "70%", "bonds": "15%", "crypto": "5%", "cash": "10%"},
+        "projected_goal_timeline_years": {"Buy a House": "7.4", "Retirement": "17.9"},
+        "recommendations": ["Split savings between debt and equity funds.", "Keep three months of expenses in cash."]
+    }
+}
+
+
+def git_commit() -> str:
+    try:
+        sha = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return f"{sha}-dirty" if dirty else sha
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def latency_stats(latencies: list, wall_seconds: float, errors: int) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "rps": round((len(latencies) + errors) / wall_seconds, 1) if wall_seconds > 0 else None,
+        "mean_ms": round(float(ms.mean()), 3) if ms.size else None,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3) if ms.size else None,
+        "p95_ms": round(float(np.percentile(ms, 95)), 3) if ms.size else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 3) if ms.size else None,
+    }
+
+
+# --- Endpoint load benchmarks ---
+def endpoint_requests() -> dict:
+    chat_history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Question or answer number {i} about the plan."}
+        for i in range(10)
+    ]
+    return {
+        "generate-plan": ("/generate-plan", SAMPLE_PROFILE),
+        "simulate-scenarios": ("/simulate-scenarios", {"userProfile": SAMPLE_PROFILE}),
+        "chat": ("/chat", {
+            "userProfile": SAMPLE_PROFILE, "generatedPlan": SAMPLE_PLAN,
+            "chatHistory": chat_history, "newQuestion": "Why is the sentinel plan so heavy in bonds?"
+        }),
+        "evaluate-plan": ("/evaluate-plan", {"userProfile": SAMPLE_PROFILE, "generatedPlan": SAMPLE_PLAN}),
+    }
+
+
+async def run_load(client, path: str, body: dict, n_requests: int, concurrency: int) -> dict:
+    """
+    Sends `n_requests` POSTs with `concurrency` workers, each issuing its next request
+    as soon as the previous one returns (closed-loop load).
+    """
+    latencies, errors = [], 0
+    remaining = n_requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await client.post(path, json=body)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latency_stats(latencies, time.perf_counter() - started, errors)
+
+
+async def run_endpoint_benchmarks(endpoints: list, concurrency_levels: list, n_requests: int) -> dict:
+    import httpx
+    import main
+    from services.market_data_store import market_data_store
+
+    # ASGITransport does not run the app's lifespan
+    market_data_store.reload()
+    requests = endpoint_requests()
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for name in endpoints:
+            path, body = requests[name]
+            # One warm-up request so imports, prompt caches and client setup aren't measured
+            await client.post(path, json=body)
+            results[name] = {}
+            for concurrency in concurrency_levels:
+                results[name][str(concurrency)] = await run_load(client, path, body, n_requests, concurrency)
+                stats = results[name][str(concurrency)]
+                print(f"  {name:<20} c={concurrency:<4} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                      f"p99={stats['p99_ms']}ms rps={stats['rps']} errors={stats['errors']}", file=sys.__stdout__)
+    return results
+
+
+# --- Micro benchmarks ---
+def time_call(fn, min_seconds: float = 0.2, repeats: int = 5) -> dict:
+    """
+    Calls fn in batches until each of `repeats` rounds takes at least min_seconds / repeats,
+    and reports per-call times in microseconds.
+    """
+    fn()
+    per_round = min_seconds / repeats
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= per_round:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(per_round / elapsed * 1.2))
+    rounds = [elapsed / number]
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - started) / number)
+    return {
+        "calls_per_round": number,
+        "best_us": round(min(rounds) * 1e6, 3),
+        "median_us": round(statistics.median(rounds) * 1e6, 3),
+    }
+
+
+def run_micro_benchmarks(min_seconds: float) -> dict:
+    from data_preprocessor import load_series_map, analyze_series, build_correlations, build_multi_horizon, default_infile
+    from generate_market_data import generate_gbm_with_events
+    from services.plan_engine import project_goal_timeline, project_goal_timelines
+    from services.evaluation_service import check_golden_principles
+    from services.market_data_store import market_data_store
+    from services.monte_carlo import simulate_plan_goal_probabilities
+    from services.scenario_grid import compute_scenario_grid
+
+    # analyze_series' resample('Y') warns on every call with newer pandas
+    warnings.simplefilter('ignore', FutureWarning)
+    market_stats = market_data_store.reload().stats
+    series_map = load_series_map(Path(default_infile()))
+    first_series = next(iter(series_map.values()))
+    aligned = __import__('pandas').concat(series_map, axis=1).sort_index()
+    rng = np.random.default_rng(0)
+    targets = rng.uniform(1e5, 1e7, 10000)
+
+    cases = {
+        "project_goal_timeline": lambda: project_goal_timeline(5_000_000, 500_000, 60_000, 0.09),
+        "project_goal_timelines_10k": lambda: project_goal_timelines(targets, 500_000, 60_000, 0.09),
+        "check_golden_principles": lambda: check_golden_principles(SAMPLE_PROFILE, SAMPLE_PLAN, market_stats),
+        "analyze_series": lambda: analyze_series(first_series),
+        "build_correlations": lambda: build_correlations(series_map),
+        "build_multi_horizon": lambda: build_multi_horizon(
+            aligned.index.values.astype('datetime64[D]'), list(aligned.columns), aligned.to_numpy(dtype=float)
+        ),
+        "generate_gbm_with_events_10y": lambda: generate_gbm_with_events(
+            start_date="2015-01-01", end_date="2025-01-01", initial_value=100, mu=0.1, sigma=0.2,
+            crash_date="2020-03-01", volatility_event_date="2024-01-01", rng=np.random.default_rng(1)
+        ),
+        "monte_carlo_2k_paths": lambda: simulate_plan_goal_probabilities(
+            SAMPLE_PROFILE, SAMPLE_PLAN, market_stats, n_paths=2000, seed=1
+        ),
+        **serialization_cases(market_stats, compute_scenario_grid(SAMPLE_PROFILE)),
+    }
+    results = {}
+    for name, fn in cases.items():
+        results[name] = time_call(fn, min_seconds)
+        print(f"  {name:<30} median={results[name]['median_us']}us best={results[name]['best_us']}us",
+              file=sys.__stdout__)
+    for name in cases:
+        if name.startswith("json_stdlib_"):
+            stdlib, fast = results[name], results.get(name.replace("json_stdlib_", "json_orjson_"))
+            if fast:
+                print(f"  {name[len('json_stdlib_'):]:<30} orjson saves {stdlib['median_us'] - fast['median_us']:.1f}us "
+                      f"per call ({stdlib['median_us'] / fast['median_us']:.1f}x)", file=sys.__stdout__)
+    return results
+
+
+def serialization_cases(market_stats: dict, grid: dict) -> dict:
+    """
+    The stdlib path each serialization point used before services/serialization.py
+    (json_stdlib_*) next to the orjson path it uses now (json_orjson_*).
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from services.prompt_budget import _compact, compact_json
+    from services.response_cache import cache_key, normalize_profile
+    from services.serialization import ORJSONResponse, dumps, loads
+
+    # What /plan-bundle returns, with the evaluation report roughly the size of the plan
+    bundle = {"plan": SAMPLE_PLAN, "scenarios": {"scenarios": [SAMPLE_PLAN] * 3}, "evaluation": SAMPLE_PLAN}
+    market_raw = dumps(market_stats)
+    cache_parts = {"profile": normalize_profile(SAMPLE_PROFILE), "market_version": "0" * 12}
+
+    def stdlib_prompt(data):
+        return json.dumps(_compact(data, 2), separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+
+    return {
+        # FastAPI's default path for a returned dict: jsonable_encoder, then json.dumps
+        "json_stdlib_bundle_response": lambda: JSONResponse(jsonable_encoder(bundle)),
+        "json_orjson_bundle_response": lambda: ORJSONResponse(bundle),
+        "json_stdlib_grid_response": lambda: JSONResponse(grid),
+        "json_orjson_grid_response": lambda: ORJSONResponse(grid),
+        "json_stdlib_plan_prompt": lambda: (stdlib_prompt(SAMPLE_PROFILE), stdlib_prompt(SAMPLE_PLAN)),
+        "json_orjson_plan_prompt": lambda: (compact_json(SAMPLE_PROFILE), compact_json(SAMPLE_PLAN)),
+        "json_stdlib_cache_key": lambda: hashlib.sha256(json.dumps(
+            {"stage": "analyst", **cache_parts}, sort_keys=True, separators=(',', ':')
+        ).encode('utf-8')).hexdigest(),
+        "json_orjson_cache_key": lambda: cache_key("analyst", cache_parts),
+        "json_stdlib_market_stats_load": lambda: json.loads(market_raw),
+        "json_orjson_market_stats_load": lambda: loads(market_raw),
+    }
+
+
+# --- Comparison ---
+def compare(current: dict, baseline: dict, threshold_percent: float) -> list:
+    """
+    Lines describing how each metric moved relative to `baseline`; changes beyond
+    `threshold_percent` are flagged.
+    """
+    lines = []
+
+    def line(label, old, new, higher_is_better=False):
+        if not old or new is None:
+            return
+        change = (new - old) / old * 100
+        worse = change < -threshold_percent if higher_is_better else change > threshold_percent
+        better = change > threshold_percent if higher_is_better else change < -threshold_percent
+        flag = "REGRESSION" if worse else ("improved" if better else "")
+        lines.append(f"{label:<48} {old:>12.3f} -> {new:>12.3f} ({change:+.1f}%) {flag}".rstrip())
+
+    for name, levels in current.get("endpoints", {}).items():
+        for concurrency, stats in levels.items():
+            old = baseline.get("endpoints", {}).get(name, {}).get(concurrency)
+            if not old:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                line(f"{name} c={concurrency} {metric}", old.get(metric), stats.get(metric))
+            line(f"{name} c={concurrency} rps", old.get("rps"), stats.get("rps"), higher_is_better=True)
+    for name, stats in current.get("micro", {}).items():
+        old = baseline.get("micro", {}).get(name)
+        if old:
+            line(f"{name} median_us", old.get("median_us"), stats.get("median_us"))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the FinPilot API and numeric hot paths')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Fake LLM latency per call in seconds')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Concurrency levels to test')
+    parser.add_argument('--requests', '-n', type=int, default=100, help='Requests per endpoint and concurrency level')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--micro-seconds', type=float, default=0.5, help='Minimum measuring time per micro benchmark')
+    parser.add_argument('--skip-endpoints', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--cache', action='store_true', help='Keep the plan response cache on (off by default)')
+    parser.add_argument('--outfile', '-o', default=None, help=f'Results JSON (default: {DEFAULT_RESULTS_DIR}/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change flagged by --compare')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own log output")
+    args = parser.parse_args(argv)
+
+    # Must be in place before the services are imported
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+    if not args.cache:
+        os.environ["PLAN_CACHE_BACKEND"] = "off"
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "llm_latency_seconds": args.llm_latency,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "cache": args.cache,
+        },
+    }
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        if not args.skip_endpoints:
+            print("Endpoint benchmarks (fake LLM):", file=sys.__stdout__)
+            results["endpoints"] = asyncio.run(
+                run_endpoint_benchmarks(args.endpoints, args.concurrency, args.requests)
+            )
+        if not args.skip_micro:
+            print("Micro benchmarks:", file=sys.__stdout__)
+            results["micro"] = run_micro_benchmarks(args.micro_seconds)
+
+    from services.serialization import loads, write_json_file
+
+    outfile = Path(args.outfile or Path(DEFAULT_RESULTS_DIR) / f"{commit[:12]}.json")
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    with open(outfile, 'wb') as f:
+        write_json_file(f, results)
+    print(f"Wrote {outfile}.")
+
+    if args.compare:
+        with open(args.compare, 'rb') as f:
+            baseline = loads(f.read())
+        print(f"\nCompared with {args.compare} (commit {baseline.get('commit', 'unknown')}):")
+        for line in compare(results, baseline, args.threshold):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 # Reads market_trends.json and produces market_stats.json with per-asset metrics and correlation matrix
 
 import argparse
-import json
 import os
 from pathlib import Path
 import sys
@@ -12,6 +11,8 @@ import numpy as np
 import pandas as pd
 import math
 from datetime import datetime
+from market_data_io import load_columnar, columnar_to_series_map, trends_json_to_columnar, DEFAULT_COLUMNAR_FILE
+from services.serialization import loads, write_json_file
 
 BUSINESS_DAYS_PER_YEAR = 252
 
@@ -25,6 +26,24 @@ def safe_series_from_list(list_of_dicts):
     df = df.dropna(subset=['value'])
     return df['value']
 
+def load_series_map(infile: Path) -> dict:
+    """
+    asset -> price series, from either the columnar market_trends.npy (memory-mapped)
+    or the original market_trends.json.
+    """
+    if infile.suffix == '.npy':
+        return columnar_to_series_map(*load_columnar(infile))
+    with open(infile, 'rb') as f:
+        raw = loads(f.read())
+    return {
+        asset: safe_series_from_list(series)
+        for asset, series in raw.get('market_trends', {}).items()
+    }
+
+def default_infile() -> str:
+    # Prefer the columnar file when generate_market_data.py has written one
+    return DEFAULT_COLUMNAR_FILE if os.path.exists(DEFAULT_COLUMNAR_FILE) else 'market_trends.json'
+
 def max_drawdown(series):
     if series.empty:
         return None, None
@@ -79,52 +98,398 @@ def build_correlations(series_map):
     corr = daily_returns.corr()
     return corr.round(4).to_dict()
 
+# --- Multi-horizon analytics ---
+# Trailing CAGRs, rolling volatility/Sharpe/correlations and drawdown durations for every
+# asset at once, computed on the (days x assets) price matrix with cumulative sums and
+# strided window views instead of a Python loop per window.
+MULTI_HORIZON_SCHEMA_VERSION = 1
+CAGR_HORIZON_YEARS = (1, 3, 5, 10)
+ROLLING_WINDOW_DAYS = BUSINESS_DAYS_PER_YEAR
+# Rolling correlations are sampled roughly monthly to keep them O(days / step)
+ROLLING_CORRELATION_STEP_DAYS = 21
+
+def _round_or_none(value, digits):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+def _summary(series, digits):
+    """
+    latest/min/median/max of a rolling series, ignoring windows that could not be computed.
+    """
+    valid = series[np.isfinite(series)]
+    if valid.size == 0:
+        return {"latest": None, "min": None, "median": None, "max": None}
+    return {
+        "latest": _round_or_none(series[-1], digits),
+        "min": _round_or_none(valid.min(), digits),
+        "median": _round_or_none(np.median(valid), digits),
+        "max": _round_or_none(valid.max(), digits),
+    }
+
+def _window_sums(x, window):
+    # Sum over every trailing `window` rows via one cumulative sum: S[t] - S[t - window]
+    csum = np.cumsum(np.vstack([np.zeros((1, x.shape[1])), x]), axis=0)
+    return csum[window:] - csum[:-window]
+
+def build_multi_horizon(dates, assets, values, window=ROLLING_WINDOW_DAYS, rf=0.035):
+    """
+    dates: datetime64[D] index, values: (days x assets) prices on that index (NaN = no price).
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    prices = pd.DataFrame(np.asarray(values, dtype=float)).ffill().to_numpy()
+    n_days = prices.shape[0]
+    result = {
+        "schema_version": MULTI_HORIZON_SCHEMA_VERSION,
+        "as_of": str(np.datetime_as_string(dates[-1], unit='D')) if n_days else None,
+        "rolling_window_days": window,
+        "assets": {asset: {} for asset in assets},
+        "rolling_correlations": {},
+    }
+    if n_days < 2:
+        return result
+
+    # Trailing CAGR over each horizon, measured in business days back from the last row
+    cagr = {}
+    for horizon in CAGR_HORIZON_YEARS:
+        start = n_days - 1 - horizon * BUSINESS_DAYS_PER_YEAR
+        if start < 0:
+            cagr[f"{horizon}y"] = np.full(len(assets), np.nan)
+            continue
+        years = max((dates[-1] - dates[start]).astype(int) / 365.25, 1/365.25)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cagr[f"{horizon}y"] = (prices[-1] / prices[start]) ** (1.0 / years) - 1.0
+
+    # Rolling volatility and Sharpe from windowed sums of returns and squared returns
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = prices[1:] / prices[:-1] - 1.0
+    present = np.isfinite(returns)
+    filled = np.where(present, returns, 0.0)
+    if returns.shape[0] >= window:
+        count = _window_sums(present.astype(float), window)
+        sum_r = _window_sums(filled, window)
+        sum_r2 = _window_sums(filled ** 2, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sum_r / count
+            variance = (sum_r2 - count * mean ** 2) / (count - 1)
+            rolling_vol = np.sqrt(np.maximum(variance, 0.0)) * math.sqrt(BUSINESS_DAYS_PER_YEAR)
+            rolling_sharpe = ((1 + mean) ** BUSINESS_DAYS_PER_YEAR - 1 - rf) / rolling_vol
+        incomplete = count < window
+        rolling_vol[incomplete] = np.nan
+        rolling_sharpe[incomplete | (rolling_vol == 0)] = np.nan
+    else:
+        rolling_vol = rolling_sharpe = np.full((1, len(assets)), np.nan)
+
+    # Drawdown durations: days since the last running-max for every row
+    running_max = np.fmax.accumulate(prices, axis=0)
+    at_peak = prices >= running_max
+    row_index = np.arange(n_days)[:, None]
+    last_peak = np.maximum.accumulate(np.where(at_peak, row_index, 0), axis=0)
+    duration = (dates[:, None] - dates[last_peak]).astype(int)
+    longest = duration.argmax(axis=0)
+
+    for j, asset in enumerate(assets):
+        result["assets"][asset] = {
+            "cagr_percent": {h: _round_or_none(v[j] * 100, 2) for h, v in cagr.items()},
+            "rolling_volatility_percent": _summary(rolling_vol[:, j] * 100, 2),
+            "rolling_sharpe_ratio": _summary(rolling_sharpe[:, j], 3),
+            "drawdown": {
+                "current_percent": _round_or_none((prices[-1, j] / running_max[-1, j] - 1.0) * 100, 2),
+                "current_duration_days": int(duration[-1, j]),
+                "max_duration_days": int(duration[longest[j], j]),
+                "max_duration_start_date": str(np.datetime_as_string(dates[last_peak[longest[j], j]], unit='D')),
+            },
+        }
+
+    # Rolling correlations on strided windows: (samples x window x assets) view, no copies
+    if returns.shape[0] >= window and len(assets) > 1:
+        windows = np.lib.stride_tricks.sliding_window_view(filled, window, axis=0)
+        # Always include the latest window, then step back through history
+        windows = windows[::-1][::ROLLING_CORRELATION_STEP_DAYS][::-1]
+        demeaned = windows - windows.mean(axis=2, keepdims=True)
+        cov = np.einsum('kiw,kjw->kij', demeaned, demeaned)
+        scale = np.sqrt(np.einsum('kii->ki', cov))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / (scale[:, :, None] * scale[:, None, :])
+        for i, a in enumerate(assets):
+            for j, b in enumerate(assets):
+                if i < j:
+                    result["rolling_correlations"][f"{a}|{b}"] = _summary(corr[:, i, j], 4)
+    return result
+
+# --- Incremental mode ---
+# Running state persisted next to market_stats.json so that appending a few days of
+# prices only costs O(new rows). Every statistic above can be rebuilt from it exactly:
+# return sums and sums of squares, first/last prices, running max and max drawdown,
+# last price per calendar year, and pairwise co-moments of daily returns.
+STATE_VERSION = 1
+
+def default_state_file(outfile) -> str:
+    return str(Path(outfile).with_suffix('.state.json'))
+
+def load_market_matrix(infile: Path):
+    """
+    (dates, assets, values) for either input format; for .npy these are memory-mapped views.
+    """
+    if infile.suffix == '.npy':
+        return load_columnar(infile)
+    with open(infile, 'rb') as f:
+        raw = loads(f.read())
+    dates, asset_values = trends_json_to_columnar(raw.get('market_trends', {}))
+    assets = list(asset_values.keys())
+    values = np.column_stack([asset_values[a] for a in assets]) if assets else np.empty((len(dates), 0))
+    return dates, assets, values
+
+def new_state(assets, first_date) -> dict:
+    n = len(assets)
+    return {
+        "version": STATE_VERSION,
+        "assets": list(assets),
+        "source_first_date": str(first_date),
+        "last_date": None,
+        "asset_state": {
+            asset: {
+                "first_date": None, "first_price": None,
+                "last_date": None, "last_price": None,
+                "num_observations": 0,
+                "n_returns": 0, "sum_returns": 0.0, "sum_sq_returns": 0.0,
+                "running_max": None, "max_drawdown": 0.0, "max_drawdown_date": None,
+                "year_last_price": {}
+            }
+            for asset in assets
+        },
+        # Pairwise sums over days where both assets have a return (what DataFrame.corr uses)
+        "co_moments": {
+            "n": [[0] * n for _ in range(n)],
+            "sum_x": [[0.0] * n for _ in range(n)],
+            "sum_xx": [[0.0] * n for _ in range(n)],
+            "sum_xy": [[0.0] * n for _ in range(n)],
+        }
+    }
+
+def _update_asset_state(st: dict, dates, prices):
+    mask = ~np.isnan(prices)
+    dates, prices = dates[mask], prices[mask]
+    if len(prices) == 0:
+        return
+    date_strings = np.datetime_as_string(dates, unit='D')
+    if st["num_observations"] == 0:
+        st["first_date"], st["first_price"] = str(date_strings[0]), float(prices[0])
+        st["running_max"], st["max_drawdown_date"] = float(prices[0]), str(date_strings[0])
+        chain = prices
+    else:
+        chain = np.concatenate(([st["last_price"]], prices))
+
+    returns = chain[1:] / chain[:-1] - 1.0
+    st["n_returns"] += int(len(returns))
+    st["sum_returns"] += float(returns.sum())
+    st["sum_sq_returns"] += float(np.square(returns).sum())
+
+    running_max = np.maximum.accumulate(np.concatenate(([st["running_max"]], prices)))[1:]
+    drawdown = prices / running_max - 1.0
+    worst = int(drawdown.argmin())
+    # Strictly lower only, so ties keep the earliest date like Series.idxmin
+    if drawdown[worst] < st["max_drawdown"]:
+        st["max_drawdown"], st["max_drawdown_date"] = float(drawdown[worst]), str(date_strings[worst])
+    st["running_max"] = float(running_max[-1])
+
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    last_in_year = np.r_[years[1:] != years[:-1], True]
+    for year, price in zip(years[last_in_year], prices[last_in_year]):
+        st["year_last_price"][str(year)] = float(price)
+
+    st["num_observations"] += int(len(prices))
+    st["last_date"], st["last_price"] = str(date_strings[-1]), float(prices[-1])
+
+def _update_co_moments(state: dict, values):
+    assets = state["assets"]
+    # Forward-fill from the previous run's last prices, as DataFrame.pct_change does
+    previous = [state["asset_state"][a]["last_price"] for a in assets]
+    block = pd.DataFrame(np.vstack([np.array(previous, dtype=float), values]))
+    block = block.ffill().to_numpy()
+    returns = block[1:] / block[:-1] - 1.0
+
+    present = ~np.isnan(returns)
+    x = np.where(present, returns, 0.0)
+    m = present.astype(float)
+    cm = state["co_moments"]
+    cm["n"] = (np.array(cm["n"]) + (m.T @ m)).astype(int).tolist()
+    cm["sum_x"] = (np.array(cm["sum_x"]) + x.T @ m).tolist()
+    cm["sum_xx"] = (np.array(cm["sum_xx"]) + np.square(x).T @ m).tolist()
+    cm["sum_xy"] = (np.array(cm["sum_xy"]) + x.T @ x).tolist()
+
+def update_state(state: dict, dates, values):
+    """
+    Folds rows newer than state["last_date"] into the running state. Returns the number of rows added.
+    """
+    start = 0
+    if state["last_date"] is not None:
+        start = int(np.searchsorted(dates, np.datetime64(state["last_date"], 'D'), side='right'))
+    new_dates = np.asarray(dates[start:], dtype='datetime64[D]')
+    new_values = np.asarray(values[start:], dtype=float)
+    if len(new_dates) == 0:
+        return 0
+
+    _update_co_moments(state, new_values)
+    for j, asset in enumerate(state["assets"]):
+        _update_asset_state(state["asset_state"][asset], new_dates, new_values[:, j])
+    state["last_date"] = str(np.datetime_as_string(new_dates[-1], unit='D'))
+    return len(new_dates)
+
+def stats_from_state(st: dict) -> dict:
+    """
+    Same output as analyze_series, computed from an asset's running state.
+    """
+    if st["num_observations"] < 2:
+        return {}
+    n = st["n_returns"]
+    mean_daily = st["sum_returns"] / n
+    variance = (st["sum_sq_returns"] - n * mean_daily ** 2) / (n - 1) if n > 1 else float('nan')
+    vol_daily = math.sqrt(max(variance, 0.0))
+    annualized_return = (1 + mean_daily) ** BUSINESS_DAYS_PER_YEAR - 1
+    annual_vol = vol_daily * math.sqrt(BUSINESS_DAYS_PER_YEAR)
+    days = (np.datetime64(st["last_date"]) - np.datetime64(st["first_date"])).astype(int)
+    years = max(days / 365.25, 1/365.25)
+    cagr = (st["last_price"] / st["first_price"]) ** (1.0 / years) - 1.0
+    rf = 0.035
+    sharpe = (annualized_return - rf) / annual_vol if annual_vol > 0 else None
+    year_prices = [st["year_last_price"][y] for y in sorted(st["year_last_price"], key=int)]
+    yearly = [b / a - 1.0 for a, b in zip(year_prices[:-1], year_prices[1:])]
+    best_year = float(round(max(yearly), 4)) if yearly else None
+    worst_year = float(round(min(yearly), 4)) if yearly else None
+    max_dd = float(round(st["max_drawdown"], 4))
+    return {
+        "first_date": st["first_date"],
+        "last_date": st["last_date"],
+        "last_price": float(round(st["last_price"], 2)),
+        "num_observations": int(st["num_observations"]),
+        "cagr_percent": round(cagr * 100, 2),
+        "avg_annual_return_percent": round(annualized_return * 100, 2),
+        "annual_volatility_percent": round(annual_vol * 100, 2),
+        "sharpe_ratio": round(sharpe, 3) if sharpe is not None else None,
+        "max_drawdown_percent": round(max_dd * 100, 2),
+        "max_drawdown_date": st["max_drawdown_date"],
+        "best_year_return_percent": round(best_year * 100, 2) if best_year is not None else None,
+        "worst_year_return_percent": round(worst_year * 100, 2) if worst_year is not None else None
+    }
+
+def correlations_from_state(state: dict) -> dict:
+    """
+    Same output as build_correlations, computed from the pairwise co-moments.
+    """
+    assets = state["assets"]
+    cm = state["co_moments"]
+    n = np.array(cm["n"], dtype=float)
+    sx = np.array(cm["sum_x"])
+    sxx = np.array(cm["sum_xx"])
+    sxy = np.array(cm["sum_xy"])
+    # sx[i, j] is the sum of asset i's returns over days where j also has one
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sxy - sx * sx.T
+        var_x = n * sxx - sx ** 2
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < 2] = np.nan
+    np.fill_diagonal(corr, np.where(np.diag(n) >= 2, 1.0, np.nan))
+    return {
+        col: {row: (None if np.isnan(corr[i, j]) else round(float(corr[i, j]), 4)) for i, row in enumerate(assets)}
+        for j, col in enumerate(assets)
+    }
+
+def load_or_rebuild_state(state_file: str, dates, assets, values):
+    """
+    Loads the saved state if it still describes the input file: same assets, same first
+    day and the same price on the last processed day. Otherwise (first run, regenerated
+    data) a fresh state is returned and the full history will be folded in.
+    """
+    first_date = str(np.datetime_as_string(dates[0], unit='D')) if len(dates) else None
+    try:
+        with open(state_file, 'rb') as f:
+            state = loads(f.read())
+    except (OSError, ValueError):
+        return new_state(assets, first_date), "no usable state file"
+
+    if state.get("version") != STATE_VERSION or state.get("assets") != list(assets) \
+            or state.get("source_first_date") != first_date:
+        return new_state(assets, first_date), "state does not match the input file"
+    if state["last_date"] is not None:
+        idx = int(np.searchsorted(dates, np.datetime64(state["last_date"], 'D')))
+        if idx >= len(dates) or dates[idx] != np.datetime64(state["last_date"], 'D'):
+            return new_state(assets, first_date), "last processed day is missing from the input"
+        for j, asset in enumerate(assets):
+            saved = state["asset_state"][asset]
+            if saved["last_date"] == state["last_date"] and saved["last_price"] != float(values[idx, j]):
+                return new_state(assets, first_date), "history was rewritten"
+    return state, None
+
+def write_json_atomic(path, data, indent=True):
+    # Write to a temp file and rename it over the target, so a running API server
+    # polling market_stats.json never sees a half-written file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write_json_file(f, data, indent=indent)
+        f.flush()
+        try:
+            os.fsync(f.fileno())
+        except Exception:
+            pass
+    os.replace(tmp_path, path)
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Preprocess market_trends.json into market_stats.json')
-    parser.add_argument('--infile', '-i', default='market_trends.json', help='Input JSON file (market_trends.json)')
+    parser.add_argument('--infile', '-i', default=None, help='Input file: market_trends.npy or market_trends.json (default: whichever exists, preferring .npy)')
     parser.add_argument('--outfile', '-o', default='market_stats.json', help='Output JSON file (market_stats.json)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fold in days newer than the last run, using the saved running state')
+    parser.add_argument('--state-file', default=None,
+                        help='Running state for --incremental (default: <outfile>.state.json)')
     parser.add_argument('--verbose', action='store_true')
     args = parser.parse_args(argv)
 
     try:
-        infile = Path(args.infile)
+        infile = Path(args.infile or default_infile())
         if not infile.exists():
             print(f"Error: input file {infile} not found. Run generate_market_data.py first.")
             return
 
-        with open(infile, 'r', encoding='utf-8') as f:
-            raw = json.load(f)
-
-        market_trends = raw.get('market_trends', {})
-        if args.verbose:
-            print("Loaded assets:", list(market_trends.keys()))
-
-        series_map = {}
-        stats_map = {}
-        for asset, series in market_trends.items():
-            s = safe_series_from_list(series)
-            series_map[asset] = s
-            stats_map[asset] = analyze_series(s)
+        if args.incremental:
+            state_file = args.state_file or default_state_file(args.outfile)
+            dates, assets, values = load_market_matrix(infile)
+            state, rebuild_reason = load_or_rebuild_state(state_file, dates, assets, values)
+            if rebuild_reason:
+                print(f"Rebuilding running state from the full history ({rebuild_reason}).")
+            added = update_state(state, dates, values)
+            print(f"Folded {added} new day(s) into {state_file}.")
+            stats_map = {asset: stats_from_state(state["asset_state"][asset]) for asset in assets}
+            correlations = correlations_from_state(state)
+            write_json_atomic(state_file, state, indent=False)
+            # Window analytics only look at the (memory-mapped) matrix, never at the JSON rows
+            multi_horizon = build_multi_horizon(dates, assets, values)
+        else:
+            series_map = load_series_map(infile)
             if args.verbose:
-                print(f"Analyzed {asset}: {stats_map[asset]}")
+                print("Loaded assets:", list(series_map.keys()))
+
+            stats_map = {}
+            for asset, s in series_map.items():
+                stats_map[asset] = analyze_series(s)
+                if args.verbose:
+                    print(f"Analyzed {asset}: {stats_map[asset]}")
+
+            correlations = build_correlations(series_map)
+            aligned = pd.concat(series_map, axis=1).sort_index() if series_map else pd.DataFrame()
+            multi_horizon = build_multi_horizon(
+                aligned.index.values.astype('datetime64[D]'), list(aligned.columns), aligned.to_numpy(dtype=float)
+            )
 
-        correlations = build_correlations(series_map)
         output = {
             "metadata": {
                 "generated_on": datetime.utcnow().isoformat() + "Z",
                 "source_file": str(infile)
             },
             "asset_stats": stats_map,
-            "correlations": correlations
+            "correlations": correlations,
+            "multi_horizon": multi_horizon
         }
 
-        with open(args.outfile, 'w', encoding='utf-8') as f:
-            json.dump(output, f, indent=2)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
+        write_json_atomic(args.outfile, output)
 
         print(f"Wrote {args.outfile} (assets: {len(stats_map)}).")
         if args.verbose:
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# evaluate_batch.py
+# Offline batch evaluation: golden-principle checks and the LLM judge over a JSONL file of profile/plan pairs.
+#
+# Each input line is {"userProfile": {...}, "generatedPlan": {...}} (the /evaluate-plan
+# payload), optionally with an "id". Results are written one JSON line per record, and
+# pass rates and score distributions go to a separate summary file.
+#
+#   python evaluate_batch.py -i plans.jsonl --backend fake --concurrency 32
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+import numpy as np
+from services.serialization import dumps, loads, write_json_file
+
+QUALITY_CRITERIA = ("personalization", "actionability", "clarity_and_tone")
+
+
+def read_records(infile: Path) -> list:
+    records = []
+    with open(infile, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = loads(line)
+            if 'userProfile' not in record or 'generatedPlan' not in record:
+                raise ValueError(f"{infile}:{line_number}: expected userProfile and generatedPlan.")
+            records.append(record)
+    return records
+
+
+def load_market_stats(path: Path):
+    if not path.exists():
+        print(f"Warning: {path} not found; timeline checks will use the cash rate only.")
+        return None
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def _score(value):
+    # The judge returns scores as numbers or strings like "8" or "8/10"
+    try:
+        return float(str(value).split('/')[0].strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_scores(ai_evaluation: dict) -> dict:
+    quality = ai_evaluation.get('quality_scores', {}) if isinstance(ai_evaluation, dict) else {}
+    scores = {name: _score((quality.get(name) or {}).get('score')) for name in QUALITY_CRITERIA}
+    scores['overall'] = _score((ai_evaluation.get('final_verdict') or {}).get('overall_score')) \
+        if isinstance(ai_evaluation, dict) else None
+    return scores
+
+
+def distribution(values: list) -> dict:
+    values = np.array([v for v in values if v is not None], dtype=float)
+    if values.size == 0:
+        return {"count": 0}
+    histogram = np.bincount(np.clip(np.round(values), 0, 10).astype(int), minlength=11)
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 3),
+        "std": round(float(values.std()), 3),
+        "min": float(values.min()),
+        "p10": float(np.percentile(values, 10)),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "max": float(values.max()),
+        "histogram": {str(score): int(n) for score, n in enumerate(histogram) if n},
+    }
+
+
+async def judge_all(records: list, concurrency: int, run_llm_judge) -> list:
+    """
+    Runs the LLM judge for every record with at most `concurrency` calls in flight.
+    Returns (ai_evaluation or None, error or None, latency_seconds) per record, in order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def judge(record):
+        nonlocal done
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await run_llm_judge(record['userProfile'], record['generatedPlan'])
+                outcome = (result, None)
+            except Exception as e:
+                outcome = (None, f"{type(e).__name__}: {e}")
+            done += 1
+            if done % 100 == 0:
+                print(f"  -> judged {done}/{len(records)}")
+            return (*outcome, round(time.perf_counter() - started, 4))
+
+    return await asyncio.gather(*(judge(record) for record in records))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a JSONL file of profile/plan pairs offline')
+    parser.add_argument('--infile', '-i', required=True, help='JSONL input: one {"userProfile", "generatedPlan"} per line')
+    parser.add_argument('--outfile', '-o', default='evaluation_results.jsonl', help='Per-record results (JSONL)')
+    parser.add_argument('--summary', '-s', default=None, help='Aggregate summary JSON (default: <outfile>.summary.json)')
+    parser.add_argument('--market-stats', default='market_stats.json', help='market_stats.json used by the timeline check')
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='Maximum LLM judge calls in flight')
+    parser.add_argument('--backend', choices=('gemini', 'fake'), default=None,
+                        help='LLM backend (default: LLM_BACKEND or gemini); "fake" needs no network or keys')
+    parser.add_argument('--skip-judge', action='store_true', help='Only run the golden-principle checks')
+    args = parser.parse_args(argv)
+
+    # The backend is chosen when the gateway is imported, so set it first
+    if args.backend:
+        os.environ["LLM_BACKEND"] = args.backend
+    from services.golden_rules import evaluate_rules_batch
+    from services.evaluation_service import run_llm_judge
+
+    try:
+        records = read_records(Path(args.infile))
+    except (OSError, ValueError) as e:
+        print(f"Error: could not read {args.infile}: {e}")
+        sys.exit(1)
+    print(f"Evaluating {len(records)} record(s)...")
+
+    try:
+        started = time.perf_counter()
+        checks = evaluate_rules_batch(
+            ((r['userProfile'], r['generatedPlan']) for r in records),
+            load_market_stats(Path(args.market_stats))
+        )
+        rules_seconds = time.perf_counter() - started
+
+        judged = [(None, None, None)] * len(records)
+        judge_seconds = 0.0
+        if not args.skip_judge and records:
+            started = time.perf_counter()
+            judged = asyncio.run(judge_all(records, max(1, args.concurrency), run_llm_judge))
+            judge_seconds = time.perf_counter() - started
+
+        scores = {name: [] for name in (*QUALITY_CRITERIA, 'overall')}
+        with open(args.outfile, 'wb') as f:
+            for index, (record, check, (ai_evaluation, error, latency)) in enumerate(zip(records, checks, judged)):
+                result = {"index": index, "id": record.get('id'), "golden_principle_checks": check}
+                if ai_evaluation is not None:
+                    result["ai_evaluation"] = ai_evaluation
+                    result["scores"] = extract_scores(ai_evaluation)
+                    for name, value in result["scores"].items():
+                        scores[name].append(value)
+                if error is not None:
+                    result["error"] = error
+                if latency is not None:
+                    result["judge_latency_seconds"] = latency
+                f.write(dumps(result) + b"\n")
+
+        latencies = [latency for _, _, latency in judged if latency is not None]
+        rule_ids = list(checks[0]) if checks else []
+        summary = {
+            "records": len(records),
+            "backend": os.getenv("LLM_BACKEND", "gemini"),
+            "golden_principle_pass_rate": {
+                rule: round(sum(check[rule] for check in checks) / len(checks), 4) for rule in rule_ids
+            },
+            "score_distributions": {name: distribution(values) for name, values in scores.items()},
+            "judge_errors": sum(1 for _, error, _ in judged if error is not None),
+            "throughput": {
+                "rules_records_per_second": round(len(records) / rules_seconds, 1) if rules_seconds > 0 else None,
+                "judge_records_per_second": round(len(records) / judge_seconds, 1) if judge_seconds > 0 else None,
+                "judge_concurrency": args.concurrency,
+                "judge_latency_seconds": distribution(latencies) if latencies else None,
+            },
+        }
+        # Latencies are not scores; the 0-10 histogram means nothing for them
+        if summary["throughput"]["judge_latency_seconds"]:
+            summary["throughput"]["judge_latency_seconds"].pop("histogram", None)
+
+        summary_path = args.summary or f"{Path(args.outfile).with_suffix('')}.summary.json"
+        with open(summary_path, 'wb') as f:
+            write_json_file(f, summary)
+        print(f"Wrote {args.outfile} and {summary_path}.")
+        print(dumps(summary["golden_principle_pass_rate"]).decode())
+    except Exception as e:
+        print(f"Error during batch evaluation: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
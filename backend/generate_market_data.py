@@ -1,9 +1,26 @@
+import argparse
+import os
+import sys
+import time
 import numpy as np
 import pandas as pd
-import json
 import datetime
+from concurrent.futures import ProcessPoolExecutor
+from market_data_io import write_columnar, DEFAULT_COLUMNAR_FILE
+from services.serialization import loads, write_json_file
 
-def generate_gbm_with_events(
+# Universe used when no --config is given. A config file has the same shape under
+# "assets" and may also set "years", "start_date", "end_date", "seed", "events" and,
+# for the correlated mode, "correlations", "default_correlation" and "regimes".
+DEFAULT_ASSET_UNIVERSE = {
+    "equities": {"mu": 0.12, "sigma": 0.22, "initial": 100, "crash_beta": 1.0},
+    "bonds": {"mu": 0.07, "sigma": 0.08, "initial": 100, "crash_beta": 0.1},
+    "crypto": {"mu": 0.35, "sigma": 0.80, "initial": 100, "crash_beta": 1.5},
+    "commodities": {"mu": 0.05, "sigma": 0.15, "initial": 100, "crash_beta": 0.6}
+}
+DEFAULT_EVENTS = {"crash_date": "2020-03-01", "volatility_event_date": "2025-01-01"}
+
+def simulate_gbm_with_events(
     start_date,
     end_date,
     initial_value,
@@ -15,15 +32,22 @@ def generate_gbm_with_events(
     volatility_event_date=None,
     volatility_increase=0.5,
     volatility_duration_days=90,
+    rng=None,
+    dates=None,
 ):
     """
     Generates a Geometric Brownian Motion series with optional crash and volatility events.
+    Returns (dates, prices) with prices rounded to 2 decimals. Draws come from `rng`
+    (a np.random.Generator) when given, otherwise from the global np.random state.
+    A precomputed business-day `dates` index can be passed to skip rebuilding it.
     """
-    dates = pd.date_range(start_date, end_date, freq='B')
+    random = rng if rng is not None else np.random
+    if dates is None:
+        dates = pd.date_range(start_date, end_date, freq='B')
     n_days = len(dates)
     dt = 1 / 252
 
-    returns = np.random.normal(loc=(mu * dt), scale=(sigma * np.sqrt(dt)), size=n_days)
+    returns = random.normal(loc=(mu * dt), scale=(sigma * np.sqrt(dt)), size=n_days)
     
     if crash_date:
         # CORRECTED: Use index.get_indexer for modern pandas versions
@@ -32,7 +56,7 @@ def generate_gbm_with_events(
         crash_end_idx = min(crash_start_idx + crash_duration_days, n_days)
         
         crash_returns = np.linspace(0, crash_severity, crash_duration_days)
-        crash_noise = np.random.normal(0, sigma * 0.5, crash_duration_days)
+        crash_noise = random.normal(0, sigma * 0.5, crash_duration_days)
         
         if crash_end_idx - crash_start_idx == crash_duration_days:
             returns[crash_start_idx:crash_end_idx] = (crash_returns / crash_duration_days) + crash_noise
@@ -43,51 +67,269 @@ def generate_gbm_with_events(
         vol_start_idx = dates.get_indexer([vol_datetime], method='nearest')[0]
         vol_end_idx = min(vol_start_idx + volatility_duration_days, n_days)
         
-        high_vol_returns = np.random.normal(
+        high_vol_returns = random.normal(
             loc=(mu * dt),
             scale=(sigma * (1 + volatility_increase) * np.sqrt(dt)),
             size=(vol_end_idx - vol_start_idx)
         )
         returns[vol_start_idx:vol_end_idx] = high_vol_returns
 
-    price_path = initial_value * np.exp(np.cumsum(returns))
-    series = pd.Series(price_path, index=dates)
-    return [{"date": date.strftime('%Y-%m-%d'), "value": round(val, 2)} for date, val in series.items()]
+    price_path = np.round(initial_value * np.exp(np.cumsum(returns)), 2)
+    return dates, price_path
+
+def generate_gbm_with_events(*args, **kwargs):
+    """
+    Same as simulate_gbm_with_events, but returns the market_trends.json layout:
+    a list of {"date": "YYYY-MM-DD", "value": price} dicts.
+    """
+    dates, price_path = simulate_gbm_with_events(*args, **kwargs)
+    return [{"date": date.strftime('%Y-%m-%d'), "value": float(val)} for date, val in zip(dates, price_path)]
+
+def load_universe(config_path=None) -> dict:
+    """
+    Reads the asset universe config (JSON). Without a path the built-in four-asset
+    universe is returned.
+    """
+    if not config_path:
+        return {"assets": DEFAULT_ASSET_UNIVERSE, "correlations": DEFAULT_CORRELATIONS}
+    with open(config_path, 'rb') as f:
+        config = loads(f.read())
+    if not config.get("assets"):
+        raise ValueError(f"{config_path} defines no assets.")
+    return config
+
+def _simulate_asset(task):
+    # Runs in a worker process; every asset owns its own SeedSequence child, so the
+    # result does not depend on which worker picks it up or in what order.
+    name, params, events, dates, seed_seq = task
+    _, prices = simulate_gbm_with_events(
+        start_date=dates[0],
+        end_date=dates[-1],
+        initial_value=params["initial"],
+        mu=params["mu"],
+        sigma=params["sigma"],
+        crash_date=params.get("crash_date", events.get("crash_date")),
+        volatility_event_date=params.get("volatility_event_date", events.get("volatility_event_date")),
+        rng=np.random.default_rng(seed_seq),
+        dates=dates
+    )
+    return name, prices
+
+def simulate_universe(assets: dict, start_date, end_date, seed=None, workers=None, events=None):
+    """
+    Simulates every asset in `assets` (name -> {"mu", "sigma", "initial", ...}) and returns
+    (dates, {name: prices}). Asset i is driven by SeedSequence(seed).spawn(n)[i], so the
+    output is bit-identical for a given seed and asset order with any number of workers.
+    """
+    events = DEFAULT_EVENTS if events is None else events
+    # Building a business-day range is slow in pandas; do it once for the whole universe
+    dates = pd.date_range(start_date, end_date, freq='B')
+    children = np.random.SeedSequence(seed).spawn(len(assets))
+    tasks = [
+        (name, params, events, dates, child)
+        for (name, params), child in zip(assets.items(), children)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = map(_simulate_asset, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = list(pool.map(_simulate_asset, tasks, chunksize=chunksize))
+    asset_values = dict(results)
+    return dates, asset_values
+
+# --- Correlated mode ---
+# All assets are drawn jointly: one (days x assets) block of standard normals is
+# correlated through a Cholesky factor, and a two-state Markov chain (calm/stressed)
+# switches volatility, drift and correlation for every asset on the same days.
+GENERATOR_MODES = ("independent", "correlated")
+
+# Pairwise correlations of daily returns for the default universe; pairs that are not
+# listed use "default_correlation" (0 unless the config sets it).
+DEFAULT_CORRELATIONS = {
+    "equities": {"bonds": -0.2, "crypto": 0.4, "commodities": 0.3},
+    "bonds": {"crypto": -0.05, "commodities": 0.0},
+    "crypto": {"commodities": 0.15}
+}
+
+DEFAULT_REGIMES = {
+    # Daily transition probabilities: calm spells last ~100 business days, stressed ~20
+    "p_calm_to_stressed": 0.01,
+    "p_stressed_to_calm": 0.05,
+    "stressed_vol_multiplier": 2.0,
+    # Added to each asset's annual drift while stressed, scaled by its "crash_beta"
+    "stressed_drift_shift": -0.25,
+    # Stressed correlation = (1 - blend) * calm correlation + blend (everything moves together)
+    "stressed_correlation_blend": 0.5
+}
+
+def correlation_matrix(names: list, correlations: dict, default_correlation: float = 0.0) -> np.ndarray:
+    """
+    Symmetric correlation matrix for `names` from a nested {"a": {"b": rho}} mapping.
+    Matrices that are not positive definite have their negative eigenvalues clipped.
+    """
+    index = {name: i for i, name in enumerate(names)}
+    corr = np.full((len(names), len(names)), float(default_correlation))
+    for a, row in (correlations or {}).items():
+        for b, rho in row.items():
+            if a in index and b in index:
+                corr[index[a], index[b]] = corr[index[b], index[a]] = rho
+    np.fill_diagonal(corr, 1.0)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(corr)
+    if eigenvalues.min() <= 1e-10:
+        corr = eigenvectors @ np.diag(np.clip(eigenvalues, 1e-6, None)) @ eigenvectors.T
+        scale = np.sqrt(np.diag(corr))
+        corr = corr / np.outer(scale, scale)
+    return corr
+
+def simulate_regimes(n_days: int, p_calm_to_stressed: float, p_stressed_to_calm: float, rng) -> np.ndarray:
+    """
+    Boolean array, True on stressed days. Spell lengths of a two-state Markov chain are
+    geometric, so they are drawn directly and expanded with np.repeat instead of
+    stepping the chain day by day.
+    """
+    if n_days == 0 or p_calm_to_stressed <= 0:
+        return np.zeros(n_days, dtype=bool)
+    stationary_stressed = p_calm_to_stressed / (p_calm_to_stressed + p_stressed_to_calm)
+    start_stressed = rng.random() < stationary_stressed
+    mean_cycle = 1 / p_calm_to_stressed + 1 / max(p_stressed_to_calm, 1e-9)
+    n_cycles = int(np.ceil(1.5 * n_days / mean_cycle)) + 2
+
+    lengths = np.empty(0, dtype=np.int64)
+    while lengths.sum() < n_days:
+        calm = rng.geometric(p_calm_to_stressed, n_cycles)
+        stressed = rng.geometric(max(p_stressed_to_calm, 1e-9), n_cycles)
+        pairs = np.column_stack([stressed, calm] if start_stressed else [calm, stressed])
+        lengths = np.concatenate([lengths, pairs.ravel()])
+    states = np.arange(len(lengths)) % 2 == (0 if start_stressed else 1)
+    return np.repeat(states, lengths)[:n_days]
+
+def simulate_correlated_universe(assets: dict, start_date, end_date, seed=None, events=None,
+                                 correlations=None, default_correlation=0.0, regimes=None):
+    """
+    Correlated counterpart of simulate_universe, returning the same (dates, {name: prices}).
+    Daily log-returns are mu*dt + sigma*sqrt(dt)*(L z) with L the Cholesky factor of the
+    calm or stressed correlation matrix. The crash and volatility events are applied to
+    all assets on the same days: both force the stressed regime, and the crash adds its
+    drift scaled by each asset's "crash_beta" (default 1), which also scales the
+    stressed drift shift.
+    """
+    events = DEFAULT_EVENTS if events is None else events
+    regimes = {**DEFAULT_REGIMES, **(regimes or {})}
+    names = list(assets)
+    dates = pd.date_range(start_date, end_date, freq='B')
+    n_days, dt = len(dates), 1 / 252
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+
+    mu = np.array([assets[n]["mu"] for n in names], dtype=float)
+    sigma = np.array([assets[n]["sigma"] for n in names], dtype=float)
+    initial = np.array([assets[n]["initial"] for n in names], dtype=float)
+    crash_beta = np.array([assets[n].get("crash_beta", 1.0) for n in names], dtype=float)
 
-def main():
+    calm_corr = correlation_matrix(names, correlations, default_correlation)
+    blend = regimes["stressed_correlation_blend"]
+    stressed_corr = (1 - blend) * calm_corr + blend * np.ones_like(calm_corr)
+    np.fill_diagonal(stressed_corr, 1.0)
+    calm_chol = np.linalg.cholesky(calm_corr)
+    # The all-ones blend is only semi-definite; a tiny ridge keeps Cholesky happy at blend=1
+    stressed_chol = np.linalg.cholesky(stressed_corr + np.eye(len(names)) * 1e-9)
+
+    stressed = simulate_regimes(n_days, regimes["p_calm_to_stressed"], regimes["p_stressed_to_calm"], rng)
+
+    crash_drift = np.zeros(n_days)
+    crash_date = events.get("crash_date")
+    if crash_date:
+        crash_duration_days = events.get("crash_duration_days", 30)
+        start = dates.get_indexer([pd.to_datetime(crash_date)], method='nearest')[0]
+        if start + crash_duration_days <= n_days:
+            crash_drift[start:start + crash_duration_days] = (
+                np.linspace(0, events.get("crash_severity", -0.35), crash_duration_days) / crash_duration_days
+            )
+            stressed[start:start + crash_duration_days] = True
+    vol_date = events.get("volatility_event_date")
+    if vol_date:
+        start = dates.get_indexer([pd.to_datetime(vol_date)], method='nearest')[0]
+        stressed[start:start + events.get("volatility_duration_days", 90)] = True
+
+    z = rng.standard_normal((n_days, len(names)))
+    shocks = np.where(stressed[:, None], z @ stressed_chol.T, z @ calm_chol.T)
+    vol = sigma * np.where(stressed[:, None], regimes["stressed_vol_multiplier"], 1.0)
+    drift = mu + np.where(stressed[:, None], regimes["stressed_drift_shift"] * crash_beta, 0.0)
+    returns = drift * dt + vol * np.sqrt(dt) * shocks + crash_drift[:, None] * crash_beta
+
+    prices = np.round(initial * np.exp(np.cumsum(returns, axis=0)), 2)
+    return dates, {name: prices[:, j] for j, name in enumerate(names)}
+
+def write_trends_json(path, dates, asset_values: dict):
+    """
+    Writes the market_trends.json layout with orjson. Dates are formatted once for the
+    whole index instead of per row.
+    """
+    date_strings = pd.DatetimeIndex(dates).strftime('%Y-%m-%d').tolist()
+    market_trends = {
+        asset: [{"date": d, "value": v} for d, v in zip(date_strings, np.asarray(values, dtype=float).tolist())]
+        for asset, values in asset_values.items()
+    }
+    with open(path, "wb") as f:
+        write_json_file(f, {"market_trends": market_trends})
+
+def main(argv=None):
     """
     Main function to define asset classes and generate the final JSON file.
     """
+    parser = argparse.ArgumentParser(description='Generate synthetic market trend data')
+    parser.add_argument('--config', '-c', default=None, help='Asset universe config (JSON); defaults to the built-in four assets')
+    parser.add_argument('--seed', type=int, default=None, help='Root seed; the same seed reproduces the same data')
+    parser.add_argument('--mode', choices=GENERATOR_MODES, default=None,
+                        help='independent: one GBM per asset (default); correlated: joint draw with regime switching')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--skip-json', action='store_true', help=f'Only write {DEFAULT_COLUMNAR_FILE}, not market_trends.json')
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_universe(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not load asset universe: {e}")
+        sys.exit(1)
+
     print("Generating sophisticated market trend data...")
-    start_date = datetime.date.today() - datetime.timedelta(days=10 * 365)
-    end_date = datetime.date.today()
-    
-    asset_params = {
-        "equities": {"mu": 0.12, "sigma": 0.22, "initial": 100},
-        "bonds": {"mu": 0.07, "sigma": 0.08, "initial": 100},
-        "crypto": {"mu": 0.35, "sigma": 0.80, "initial": 100},
-        "commodities": {"mu": 0.05, "sigma": 0.15, "initial": 100}
-    }
-    
-    market_trends = {}
-    for asset, params in asset_params.items():
-        print(f"  -> Simulating for {asset}...")
-        market_trends[asset] = generate_gbm_with_events(
-            start_date=start_date,
-            end_date=end_date,
-            initial_value=params["initial"],
-            mu=params["mu"],
-            sigma=params["sigma"],
-            crash_date="2020-03-01",
-            volatility_event_date="2025-01-01"
+    years = config.get("years", 10)
+    end_date = config.get("end_date") or datetime.date.today()
+    start_date = config.get("start_date") or pd.Timestamp(end_date).date() - datetime.timedelta(days=years * 365)
+    seed = args.seed if args.seed is not None else config.get("seed")
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"  -> No seed given; using {seed} (pass --seed {seed} to reproduce this run)")
+
+    started = time.perf_counter()
+    mode = args.mode or config.get("mode", "independent")
+    print(f"  -> Simulating {len(config['assets'])} asset(s) ({mode})...")
+    if mode == "correlated":
+        dates, asset_values = simulate_correlated_universe(
+            config["assets"], start_date, end_date,
+            seed=seed, events=config.get("events", DEFAULT_EVENTS),
+            correlations=config.get("correlations"),
+            default_correlation=config.get("default_correlation", 0.0),
+            regimes=config.get("regimes")
+        )
+    else:
+        dates, asset_values = simulate_universe(
+            config["assets"], start_date, end_date,
+            seed=seed, workers=args.workers, events=config.get("events", DEFAULT_EVENTS)
         )
 
-    output = {"market_trends": market_trends}
-    
-    with open("market_trends.json", "w") as f:
-        json.dump(output, f, indent=2)
-        
-    print("\nSuccessfully created market_trends.json with realistic events.")
+    written = []
+    if not args.skip_json:
+        write_trends_json("market_trends.json", dates, asset_values)
+        written.append("market_trends.json")
+
+    # Columnar copy for fast, memory-mapped loading (see market_data_io.py)
+    write_columnar(DEFAULT_COLUMNAR_FILE, dates, asset_values)
+    written.append(DEFAULT_COLUMNAR_FILE)
+
+    print(f"\nSuccessfully created {' and '.join(written)} with realistic events in {time.perf_counter() - started:.1f}s.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
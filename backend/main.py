@@ -1,16 +1,30 @@
-import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # --- Import ALL services, including our new evaluation_service ---
 from services.langchain_service import (
     generate_plan_with_assembly_line,
+    stream_plan_with_assembly_line,
+    finalize_plan,
     run_economic_forecaster,
-    run_qa_agent
+    run_qa_agent,
+    scenario_library
 )
 from services.evaluation_service import evaluate_plan
+from services.llm_gateway import LLMOverloaded, OVERLOADED_RETRY_AFTER_SECONDS
+from services.market_data_store import market_data_store
+from services.bundle_service import run_plan_bundle
+from services.monte_carlo import simulate_plan_goal_probabilities, MONTE_CARLO_PATHS, MONTE_CARLO_MAX_PATHS
+from services.chat_sessions import chat_sessions, stream_session_turn
+from services.scenario_grid import compute_scenario_grid, GRID_AXES, SCENARIO_GRID_MAX_STEPS
+from services.plan_jobs import plan_jobs, public_job, JobQueueFull, FINISHED_STATUSES
+from services.serialization import ORJSONResponse, dumps
+from services.instrumentation import registry, RequestMetricsMiddleware, trace_span
 
 # --- Pydantic Models (Data Contracts) ---
 
@@ -56,10 +70,58 @@ class EvaluationPayload(BaseModel):
     userProfile: UserProfile
     generatedPlan: Dict
 
+class GoalProbabilityPayload(BaseModel):
+    userProfile: UserProfile
+    generatedPlan: Dict
+    n_paths: int = Field(MONTE_CARLO_PATHS, ge=100, le=MONTE_CARLO_MAX_PATHS)
+    seed: Optional[int] = None
+
+class GridRange(BaseModel):
+    # Annual percentages, except monthly_contribution (currency per month)
+    min: float
+    max: Optional[float] = None
+    steps: int = Field(1, ge=1, le=SCENARIO_GRID_MAX_STEPS)
+
+class ScenarioGridPayload(BaseModel):
+    userProfile: UserProfile
+    # Any axis left out uses the defaults in services/scenario_grid.py
+    equity_return: Optional[GridRange] = None
+    bond_return: Optional[GridRange] = None
+    inflation: Optional[GridRange] = None
+    equity_weight: Optional[GridRange] = None
+    monthly_contribution: Optional[GridRange] = None
+
+class ChatSessionPayload(BaseModel):
+    userProfile: UserProfile
+    generatedPlan: Dict
+    # Lets a client that already has a conversation carry it over
+    chatHistory: List[ChatMessage] = Field(default_factory=list)
+
+class ChatTurnPayload(BaseModel):
+    question: str = Field(..., min_length=1)
+
+class PlanBundlePayload(BaseModel):
+    userProfile: UserProfile
+    # Optional per-stage limits in seconds: {"plan": 90, "scenarios": 30, "evaluation": 30}
+    timeouts: Dict[str, float] = Field(default_factory=dict)
+
 # --- FastAPI Application Setup ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load market_stats.json once up front so the first request doesn't pay for it
+    market_data_store.reload()
+    await plan_jobs.start()
+    scenario_library.start()
+    yield
+    await scenario_library.stop()
+    await plan_jobs.stop()
+
+# Endpoints with large payloads return ORJSONResponse themselves, skipping FastAPI's jsonable_encoder pass
 app = FastAPI(
     title="FinPilot API",
-    description="The AI-powered backend for FinPilot, featuring a multi-agent financial planning system."
+    description="The AI-powered backend for FinPilot, featuring a multi-agent financial planning system.",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -70,52 +132,356 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the latency includes CORS handling
+app.add_middleware(RequestMetricsMiddleware)
+
 # --- API Endpoints ---
 
 @app.get("/", tags=["Root"])
 async def read_root():
     return {"status": "FinPilot API is running!"}
 
+# --- LLM overload ---
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    # Retryable, unlike the 500s: every Gemini key stayed at its limit past the queueing deadline
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(OVERLOADED_RETRY_AFTER_SECONDS)}
+    )
+
+def _error_event(detail: str, error: Exception) -> dict:
+    data = {"detail": f"{detail}: {error}"}
+    if isinstance(error, LLMOverloaded):
+        data["retry_after"] = OVERLOADED_RETRY_AFTER_SECONDS
+    return data
+
 @app.post("/generate-plan", tags=["Planning"])
 async def generate_plan_endpoint(user_profile: UserProfile):
     print("Received profile, triggering AI Assembly Line...")
+    plan_str = None
     try:
         plan_str = await generate_plan_with_assembly_line(user_profile.dict())
-        start_index = plan_str.find('{')
-        end_index = plan_str.rfind('}') + 1
-        if start_index == -1 or end_index == 0:
-            raise ValueError("No JSON object found in the AI's response.")
-        json_str = plan_str[start_index:end_index]
-        plan_json = json.loads(json_str)
+        plan_json = finalize_plan(plan_str, user_profile.dict())
         print("Successfully generated and parsed plan.")
-        return plan_json
-    except (json.JSONDecodeError, ValueError) as e:
+        return ORJSONResponse(plan_json)
+    except ValueError as e:
         print(f"Error parsing JSON from AI response: {e}\nRaw AI Output was:\n---\n{plan_str}\n---")
         raise HTTPException(status_code=500, detail="AI returned an invalid JSON format.")
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"An error occurred: {e}")
         raise HTTPException(status_code=500, detail=f"An error occurred while generating the plan: {e}")
 
+# --- Server-Sent Events helpers ---
+SSE_KEEPALIVE_SECONDS = 15
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+async def _sse_stream(events, error_detail: str = "An error occurred while generating the plan"):
+    """
+    Formats an async iterator of (event, data) tuples as SSE. While the next event is
+    pending (e.g. an LLM call is running) a comment line is sent every
+    SSE_KEEPALIVE_SECONDS so proxies don't drop the idle connection. If the client
+    disconnects, Starlette cancels this generator and the pending work is cancelled with it.
+    """
+    iterator = events.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=SSE_KEEPALIVE_SECONDS)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event, data = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            yield _sse_event(event, data)
+    except Exception as e:
+        print(f"An error occurred while streaming: {e}")
+        yield _sse_event("error", _error_event(error_detail, e))
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        await iterator.aclose()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.post("/generate-plan/stream", tags=["Planning"])
+async def generate_plan_stream_endpoint(user_profile: UserProfile):
+    """
+    Streaming variant of /generate-plan. Emits `stage` events as the analyst, strategist
+    and writer finish, `token` events with the writer's output as it is generated, and a
+    final `plan` event with the parsed plan (or an `error` event).
+    """
+    print("Received profile, streaming AI Assembly Line...")
+    events = stream_plan_with_assembly_line(user_profile.dict())
+    return StreamingResponse(_sse_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# --- Plan jobs: submit, then poll or subscribe ---
+# Re-read the job at least this often while streaming, in case another process updated it
+JOB_EVENTS_POLL_SECONDS = 2.0
+
+async def _get_tenant_job(job_id: str, tenant: str):
+    job = await plan_jobs.get(job_id)
+    # Another tenant's job is reported as missing rather than forbidden
+    if job is None or job["tenant"] != tenant:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.post("/jobs/generate-plan", tags=["Jobs"], status_code=202)
+async def submit_plan_job_endpoint(
+    user_profile: UserProfile,
+    x_tenant_id: str = Header("anonymous"),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Queues the analyst -> strategist -> writer pipeline and returns a job id right away.
+    Resubmitting with the same Idempotency-Key (or, without one, the same profile)
+    returns the existing job instead of starting another run; failed jobs can be retried.
+    """
+    print("Received request for /jobs/generate-plan")
+    try:
+        job, deduplicated = await plan_jobs.submit(user_profile.dict(), x_tenant_id, idempotency_key)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"The plan queue is full, try again later. {e}")
+    except Exception as e:
+        print(f"An error occurred while queueing the plan job: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue the plan job: {e}")
+    return {
+        **public_job(job),
+        "deduplicated": deduplicated,
+        "status_url": f"/jobs/{job['job_id']}",
+        "events_url": f"/jobs/{job['job_id']}/events",
+    }
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_plan_job_endpoint(job_id: str, x_tenant_id: str = Header("anonymous")):
+    """
+    Current status of a job, with the finalized plan once it has succeeded.
+    """
+    return ORJSONResponse(public_job(await _get_tenant_job(job_id, x_tenant_id)))
+
+@app.get("/jobs/{job_id}/events", tags=["Jobs"])
+async def plan_job_events_endpoint(job_id: str, x_tenant_id: str = Header("anonymous")):
+    """
+    SSE alternative to polling: a `status` event on every change, then a final `result`
+    event (or `error` event) and the stream closes.
+    """
+    job = await _get_tenant_job(job_id, x_tenant_id)
+
+    async def events():
+        current, last_status = job, None
+        while True:
+            if current is None:
+                raise ValueError("The job no longer exists.")
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield "status", {"job_id": job_id, "status": last_status}
+            if current["status"] in FINISHED_STATUSES:
+                view = public_job(current)
+                if "result" in view:
+                    yield "result", view
+                else:
+                    yield "error", {"detail": view["error"]}
+                return
+            await plan_jobs.wait_for_change(job_id, JOB_EVENTS_POLL_SECONDS)
+            current = await plan_jobs.get(job_id)
+
+    return StreamingResponse(
+        _sse_stream(events(), error_detail="An error occurred while following the job"),
+        media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+DISCONNECT_POLL_SECONDS = 1.0
+
+async def _run_unless_disconnected(request: Request, coro):
+    """
+    Awaits `coro` as a task, cancelling it if the client goes away in the meantime so
+    abandoned requests stop spending LLM quota.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("Client disconnected; cancelling remaining work.")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed the request.")
+    finally:
+        task.cancel()
+
+@app.post("/plan-bundle", tags=["Planning"])
+async def plan_bundle_endpoint(payload: PlanBundlePayload, request: Request):
+    """
+    Generates the plan, the economic scenarios and the plan evaluation in one request.
+    The forecaster runs concurrently with the assembly line and the evaluation starts as
+    soon as the plan is ready.
+    """
+    print("Received request for /plan-bundle")
+    try:
+        bundle = await _run_unless_disconnected(
+            request, run_plan_bundle(payload.userProfile.dict(), payload.timeouts)
+        )
+        return ORJSONResponse(bundle)
+    except (HTTPException, LLMOverloaded):
+        raise
+    except Exception as e:
+        print(f"An error occurred while building the plan bundle: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while generating the plan: {e}")
+
 @app.post("/simulate-scenarios", tags=["Simulation"])
 async def simulate_scenarios_endpoint(payload: SimulationPayload):
     print("Received request for /simulate-scenarios")
     try:
         scenarios = await run_economic_forecaster(payload.userProfile.dict())
-        return scenarios
+        return ORJSONResponse(scenarios)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"An error occurred during simulation: {e}")
         raise HTTPException(status_code=500, detail="Failed to run simulation.")
 
+@app.post("/goal-probabilities", tags=["Simulation"])
+async def goal_probabilities_endpoint(payload: GoalProbabilityPayload):
+    """
+    Monte Carlo odds of reaching each goal within its timeline under each plan's
+    asset allocation. Computed locally from market_stats.json; no LLM call.
+    """
+    print("Received request for /goal-probabilities")
+    try:
+        # The simulation is CPU-bound NumPy work; keep it off the event loop
+        with trace_span("monte-carlo"):
+            probabilities = await asyncio.to_thread(
+                simulate_plan_goal_probabilities,
+                payload.userProfile.dict(),
+                payload.generatedPlan,
+                market_data_store.get().stats,
+                payload.n_paths,
+                payload.seed
+            )
+        return ORJSONResponse(probabilities)
+    except Exception as e:
+        print(f"An error occurred during goal probability simulation: {e}")
+        raise HTTPException(status_code=500, detail="Failed to simulate goal probabilities.")
+
+@app.post("/scenario-grid", tags=["Simulation"])
+async def scenario_grid_endpoint(payload: ScenarioGridPayload):
+    """
+    Real (inflation-adjusted) goal timelines over the full grid of equity return, bond
+    return, inflation, equity weight and monthly contribution, for heatmaps. Computed
+    locally in one vectorized pass; no LLM call. Each goal's `years` is a flat list in
+    `axis_order` (C order) with null where the goal isn't reached within 100 years.
+    """
+    print("Received request for /scenario-grid")
+    ranges = {name: getattr(payload, name).dict() for name in GRID_AXES if getattr(payload, name) is not None}
+    try:
+        with trace_span("scenario-grid"):
+            grid = await asyncio.to_thread(compute_scenario_grid, payload.userProfile.dict(), ranges)
+        return ORJSONResponse(grid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"An error occurred while computing the scenario grid: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute the scenario grid.")
+
 @app.post("/chat", tags=["Q&A"])
 async def chat_with_plan_endpoint(payload: ChatPayload):
     print("Received request for /chat")
     try:
         response = await run_qa_agent(payload.dict())
         return response
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"An error occurred during chat: {e}")
         raise HTTPException(status_code=500, detail="Failed to get chat response.")
 
+# --- Session chat: register the profile and plan once, then send only questions ---
+def _get_chat_session(session_id: str):
+    session = chat_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired.")
+    return session
+
+@app.post("/chat/sessions", tags=["Q&A"])
+async def create_chat_session_endpoint(payload: ChatSessionPayload):
+    print("Received request for /chat/sessions")
+    session = chat_sessions.create(
+        payload.userProfile.dict(),
+        payload.generatedPlan,
+        [message.dict() for message in payload.chatHistory]
+    )
+    return {"session_id": session.session_id, "idle_timeout_seconds": chat_sessions.idle_seconds}
+
+@app.delete("/chat/sessions/{session_id}", tags=["Q&A"])
+async def delete_chat_session_endpoint(session_id: str):
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found or expired.")
+    return {"deleted": session_id}
+
+@app.post("/chat/sessions/{session_id}/messages", tags=["Q&A"])
+async def chat_session_message_endpoint(session_id: str, payload: ChatTurnPayload):
+    """
+    Answers one question in a session as SSE: `token` events as the answer streams,
+    then a `done` event with the full response (or an `error` event).
+    """
+    print("Received request for /chat/sessions/{id}/messages")
+    session = _get_chat_session(session_id)
+    events = stream_session_turn(session, payload.question)
+    return StreamingResponse(
+        _sse_stream(events, error_detail="Failed to get chat response"),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@app.websocket("/chat/sessions/{session_id}/ws")
+async def chat_session_websocket(websocket: WebSocket, session_id: str):
+    """
+    WebSocket variant of the session chat. Each client message is {"question": "..."}
+    and is answered with {"event": "token", "text": ...} frames followed by
+    {"event": "done", "response": ...} (or {"event": "error", "detail": ...}).
+    """
+    await websocket.accept()
+    if chat_sessions.get(session_id) is None:
+        await websocket.send_json({"event": "error", "detail": "Chat session not found or expired."})
+        await websocket.close(code=4404)
+        return
+    try:
+        while True:
+            message = await websocket.receive_json()
+            question = str(message.get("question", "")).strip() if isinstance(message, dict) else ""
+            if not question:
+                await websocket.send_json({"event": "error", "detail": "Expected {\"question\": \"...\"}."})
+                continue
+            session = chat_sessions.get(session_id)
+            if session is None:
+                await websocket.send_json({"event": "error", "detail": "Chat session not found or expired."})
+                await websocket.close(code=4404)
+                return
+            try:
+                async for event, data in stream_session_turn(session, question):
+                    await websocket.send_json({"event": event, **data})
+            except Exception as e:
+                print(f"An error occurred during chat: {e}")
+                await websocket.send_json({"event": "error", **_error_event("Failed to get chat response", e)})
+    except WebSocketDisconnect:
+        print("Chat WebSocket closed by client.")
+
 # --- NEW: API Endpoint for Plan Evaluation ---
 @app.post("/evaluate-plan", tags=["Evaluation"])
 async def evaluate_plan_endpoint(payload: EvaluationPayload):
@@ -128,7 +494,32 @@ async def evaluate_plan_endpoint(payload: EvaluationPayload):
             user_profile=payload.userProfile.dict(),
             generated_plan=payload.generatedPlan
         )
-        return evaluation_report
+        return ORJSONResponse(evaluation_report)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"An error occurred during evaluation: {e}")
-        raise HTTPException(status_code=500, detail="Failed to evaluate plan.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to evaluate plan.")
+
+@app.get("/metrics", tags=["Admin"], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-agent call latency, estimated tokens, key attempts, retries,
+    JSON parse failures, cache hits, HTTP latency per route and the current sizes of the
+    plan job queue and the scenario library.
+    """
+    plan_jobs.publish_metrics()
+    scenario_library.publish_metrics()
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/reload-market-data", tags=["Admin"])
+async def reload_market_data_endpoint():
+    """
+    Forces a re-read of market_stats.json (it is otherwise picked up automatically by mtime polling).
+    """
+    try:
+        snapshot = market_data_store.reload()
+        return snapshot.describe()
+    except Exception as e:
+        print(f"An error occurred while reloading market data: {e}")
+        raise HTTPException(status_code=500, detail="Failed to reload market data.")
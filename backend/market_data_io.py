@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# market_data_io.py
+# Columnar, memory-mappable storage for market trend data (market_trends.npy).
+#
+# The file is a single .npy holding a structured array with one row per business day:
+# a shared `date` column (datetime64[D]) followed by one float64 column per asset.
+# np.load(mmap_mode='r') maps it without reading it, and the asset columns can be viewed
+# as a (days x assets) float64 matrix without copying.
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from numpy.lib import recfunctions
+from services.serialization import loads
+
+DEFAULT_COLUMNAR_FILE = 'market_trends.npy'
+
+
+def write_columnar(path, dates, asset_values: dict):
+    """
+    Writes aligned series to `path`. `dates` is anything np.datetime64 understands and
+    `asset_values` maps asset name -> 1-D array of the same length (NaN for missing days).
+    The file is written to a temp name and renamed, so readers never map a partial file.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    dtype = [('date', '<M8[D]')] + [(name, '<f8') for name in asset_values]
+    table = np.empty(len(dates), dtype=dtype)
+    table['date'] = dates
+    for name, values in asset_values.items():
+        table[name] = values
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, table)
+    os.replace(tmp_path, path)
+
+
+def load_columnar(path, mmap=True):
+    """
+    Returns (dates, assets, values): the datetime64[D] date index, the list of asset
+    names and a read-only (days x assets) float64 matrix. With mmap=True both arrays are
+    views into the mapped file, so load time and memory don't grow with history length.
+    """
+    table = np.load(path, mmap_mode='r' if mmap else None)
+    assets = list(table.dtype.names[1:])
+    values = recfunctions.structured_to_unstructured(table[assets], copy=False)
+    return table['date'], assets, values
+
+
+def columnar_to_series_map(dates, assets, values) -> dict:
+    """
+    asset name -> pd.Series of prices indexed by date, with missing days dropped.
+    """
+    index = pd.DatetimeIndex(dates)
+    return {
+        asset: pd.Series(values[:, j], index=index).dropna()
+        for j, asset in enumerate(assets)
+    }
+
+
+def trends_json_to_columnar(market_trends: dict):
+    """
+    Converts the {"asset": [{"date": ..., "value": ...}, ...]} layout of
+    market_trends.json into (dates, asset_values) on a shared, sorted date index.
+    """
+    frames = {
+        asset: pd.Series(
+            [row['value'] for row in rows],
+            index=pd.to_datetime([row['date'] for row in rows]),
+            dtype=float
+        )
+        for asset, rows in market_trends.items()
+    }
+    df = pd.concat(frames, axis=1).sort_index() if frames else pd.DataFrame()
+    dates = df.index.values.astype('datetime64[D]')
+    return dates, {asset: df[asset].to_numpy(dtype=float) for asset in df.columns}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert market_trends.json into the columnar market_trends.npy format')
+    parser.add_argument('--infile', '-i', default='market_trends.json', help='Input JSON file (market_trends.json)')
+    parser.add_argument('--outfile', '-o', default=DEFAULT_COLUMNAR_FILE, help='Output columnar file (market_trends.npy)')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.infile):
+        print(f"Error: input file {args.infile} not found. Run generate_market_data.py first.")
+        sys.exit(1)
+    with open(args.infile, 'rb') as f:
+        raw = loads(f.read())
+    dates, asset_values = trends_json_to_columnar(raw.get('market_trends', {}))
+    write_columnar(args.outfile, dates, asset_values)
+    print(f"Wrote {args.outfile} ({len(dates)} days x {len(asset_values)} assets).")
+
+
+if __name__ == "__main__":
+    main()
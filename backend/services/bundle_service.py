@@ -0,0 +1,75 @@
+# backend/services/bundle_service.py
+# Runs the whole dashboard (plan, scenarios, evaluation) as one concurrent job.
+
+import os
+import asyncio
+from services.langchain_service import (
+    generate_plan_with_assembly_line,
+    finalize_plan,
+    run_economic_forecaster
+)
+from services.evaluation_service import evaluate_plan
+from services.instrumentation import trace_span
+
+# Per-stage time limits in seconds; a request can override any of them
+PLAN_BUNDLE_TIMEOUTS = {
+    "plan": float(os.getenv("PLAN_BUNDLE_PLAN_TIMEOUT_SECONDS", "120")),
+    "scenarios": float(os.getenv("PLAN_BUNDLE_SCENARIOS_TIMEOUT_SECONDS", "60")),
+    "evaluation": float(os.getenv("PLAN_BUNDLE_EVALUATION_TIMEOUT_SECONDS", "60")),
+}
+
+
+def _describe_failure(stage: str, error: Exception, timeout: float) -> str:
+    if isinstance(error, TimeoutError):
+        return f"The {stage} stage timed out after {timeout:g}s."
+    return f"The {stage} stage failed: {error}"
+
+
+async def run_plan_bundle(user_profile: dict, timeouts: dict = None) -> dict:
+    """
+    Starts the economic forecaster alongside the analyst -> strategist -> writer chain
+    (the forecaster only needs the profile) and chains the evaluation onto the writer's
+    result, so the wall-clock time is the longer of the two branches instead of the sum
+    of every call.
+
+    The plan is required: if it fails or times out the whole bundle fails and the other
+    branch is cancelled. Scenario and evaluation failures are reported under "errors".
+    """
+    timeouts = {**PLAN_BUNDLE_TIMEOUTS, **(timeouts or {})}
+    bundle = {"plan": None, "scenarios": None, "evaluation": None, "errors": {}}
+
+    async def plan_then_evaluate():
+        try:
+            async with asyncio.timeout(timeouts["plan"]):
+                plan_str = await generate_plan_with_assembly_line(user_profile)
+        except TimeoutError as e:
+            raise TimeoutError(_describe_failure("plan", e, timeouts["plan"])) from e
+        plan = finalize_plan(plan_str, user_profile)
+        bundle["plan"] = plan
+
+        try:
+            # The whole stage, i.e. the golden-principle checks plus the llm-evaluator call
+            with trace_span("evaluation"):
+                async with asyncio.timeout(timeouts["evaluation"]):
+                    bundle["evaluation"] = await evaluate_plan(user_profile=user_profile, generated_plan=plan)
+        except Exception as e:
+            print(f"Plan bundle: evaluation failed: {e!r}")
+            bundle["errors"]["evaluation"] = _describe_failure("evaluation", e, timeouts["evaluation"])
+
+    async def forecast():
+        try:
+            async with asyncio.timeout(timeouts["scenarios"]):
+                bundle["scenarios"] = await run_economic_forecaster(user_profile)
+        except Exception as e:
+            print(f"Plan bundle: scenarios failed: {e!r}")
+            bundle["errors"]["scenarios"] = _describe_failure("scenarios", e, timeouts["scenarios"])
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(plan_then_evaluate())
+            tg.create_task(forecast())
+    except ExceptionGroup as eg:
+        # Only the plan branch lets exceptions escape; surface it as a plain exception
+        raise eg.exceptions[0]
+
+    return bundle
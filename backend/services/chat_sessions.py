@@ -0,0 +1,99 @@
+# backend/services/chat_sessions.py
+# Server-side chat sessions: the profile and plan are registered once and each turn only sends the question.
+
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from services.prompt_budget import compact_json
+from services.langchain_service import stream_qa_agent
+
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", "1000"))
+CHAT_SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "1800"))
+# Turns kept per session; the QA prompt only ever sees a window plus a summary anyway
+CHAT_SESSION_MAX_TURNS = int(os.getenv("CHAT_SESSION_MAX_TURNS", "200"))
+
+
+class ChatSession:
+    """
+    One conversation. The profile and plan are compacted once at registration, and
+    `lock` serializes turns so answers are appended to the history in order.
+    """
+
+    def __init__(self, session_id: str, user_profile: dict, generated_plan: dict, history: list):
+        self.session_id = session_id
+        self.user_profile_json = compact_json(user_profile)
+        self.generated_plan_json = compact_json(generated_plan)
+        self.history = list(history)[-CHAT_SESSION_MAX_TURNS:]
+        self.last_active = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def record_turn(self, question: str, answer: str):
+        self.history.append({"role": "user", "content": question})
+        self.history.append({"role": "assistant", "content": answer})
+        del self.history[:-CHAT_SESSION_MAX_TURNS]
+
+
+class ChatSessionStore:
+    """
+    Bounded in-memory session store. Sessions idle for longer than `idle_seconds` are
+    dropped, and when the store is full the least recently active session is evicted.
+    """
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX_SESSIONS, idle_seconds: float = CHAT_SESSION_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # Least recently active first, so stop at the first session that is still fresh
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_active >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, user_profile: dict, generated_plan: dict, history: list = ()) -> ChatSession:
+        session = ChatSession(uuid.uuid4().hex, user_profile, generated_plan, history)
+        self._sessions[session.session_id] = session
+        self._evict()
+        return session
+
+    def get(self, session_id: str):
+        self._evict()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+chat_sessions = ChatSessionStore()
+
+
+async def stream_session_turn(session: ChatSession, question: str):
+    """
+    Answers `question` in the context of `session`, yielding ("token", {"text"}) events
+    and a final ("done", {"response"}) event. The turn is only added to the history once
+    the answer is complete, so a failed or abandoned turn leaves no half answer behind.
+    """
+    async with session.lock:
+        chunks = []
+        history = session.history + [{"role": "user", "content": question}]
+        async for chunk in stream_qa_agent(
+            session.user_profile_json, session.generated_plan_json, history, question
+        ):
+            chunks.append(chunk)
+            yield "token", {"text": chunk}
+        answer = ''.join(chunks)
+        session.record_turn(question, answer)
+        session.last_active = time.monotonic()
+    yield "done", {"response": answer}
@@ -1,88 +1,23 @@
 # Stage 1: backend/services/evaluation_service.py
 
-import os
-import json
-from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
-from google.api_core.exceptions import ResourceExhausted
+from services.llm_gateway import invoke_llm_with_retry
+from services.prompt_budget import compact_json, fit_prompt
+from services.golden_rules import evaluate_rules
+from services.market_data_store import market_data_store
+from services.structured_output import EvaluationOutput, parse_with_reask
 
-# Load environment variables
-load_dotenv()
+# Recommendation length kept when the evaluator's prompt is over budget
+EVALUATOR_RECOMMENDATION_CHARS = 200
 
-# --- API Keys Loader ---
-API_KEYS = os.getenv("GOOGLE_API_KEYS", "").split(',')
-if not all(API_KEYS) or API_KEYS == ['']:
-    raise ValueError("GOOGLE_API_KEYS environment variable not set or is empty. Please check your .env file.")
 
-
-# --- NEW: Resilient LLM Invoker with Key Cycling ---
-async def invoke_llm_with_retry(prompt_template, input_data, temperature: float = 0.7):
+# --- 1. Golden Principles: Programmatic, Objective Checks ---
+def check_golden_principles(user_profile: dict, generated_plan: dict, market_stats: dict = None) -> dict:
     """
-    Tries to invoke a LangChain chain with a list of API keys.
-    If a key is rate-limited (ResourceExhausted), it automatically retries with the next key.
+    Runs the declarative rule set in services/golden_rules.py. The result keeps the
+    debt_priority_check / risk_profile_alignment_check keys the dashboard reads.
     """
-    for i, key in enumerate(API_KEYS):
-        try:
-            # Initialize a new LLM instance with the current key
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-flash-latest",
-                temperature=temperature,
-                google_api_key=key
-            )
-
-            # Build the full chain using the prompt and the LLM
-            chain = prompt_template | llm | StrOutputParser()
-
-            print(f"--- Attempting API call with Key #{i + 1} ---")
-            response = await chain.ainvoke(input_data)
-            print(f"--- Key #{i + 1} succeeded. ---")
-            return response  # Success, return response
-
-        except ResourceExhausted:
-            print(f"Warning: API Key #{i + 1} is rate-limited or exhausted. Trying next key...")
-            if i == len(API_KEYS) - 1:  # If this was the last key
-                print("Error: All API keys are exhausted.")
-                raise
-        except Exception as e:
-            print(f"An unexpected error occurred with Key #{i + 1}: {e}")
-            if i == len(API_KEYS) - 1:
-                raise
-
-    raise Exception("All API keys failed to generate a response.")
-
-
-# --- 1. Golden Principles: Programmatic, Objective Checks ---
-def check_golden_principles(user_profile: dict, generated_plan: dict) -> dict:
-    results = {}
-
-    # Principle 1: Debt Management
-    if user_profile.get('liabilities', {}).get('high_interest_debt', 0) > 1000:
-        sentinel_rec_lower = ' '.join(generated_plan.get('sentinel_plan', {}).get('recommendations', [])).lower()
-        voyager_rec_lower = ' '.join(generated_plan.get('voyager_plan', {}).get('recommendations', [])).lower()
-        results['debt_priority_check'] = 'debt' in sentinel_rec_lower and 'debt' in voyager_rec_lower
-    else:
-        results['debt_priority_check'] = True
-
-    # Principle 2: Risk Profile Alignment
-    try:
-        risk_score = sum(user_profile.get('risk_profile_answers', []))
-
-        if risk_score > 4:  # Aggressive
-            voyager_equity_str = generated_plan.get('voyager_plan', {}).get('asset_allocation', {}).get('equities', '0%')
-            voyager_equity_pct = float(voyager_equity_str.replace('%', ''))
-            results['risk_profile_alignment_check'] = voyager_equity_pct >= 60.0
-        elif risk_score <= 3:  # Conservative
-            sentinel_equity_str = generated_plan.get('sentinel_plan', {}).get('asset_allocation', {}).get('equities', '0%')
-            sentinel_equity_pct = float(sentinel_equity_str.replace('%', ''))
-            results['risk_profile_alignment_check'] = sentinel_equity_pct <= 40.0
-        else:  # Balanced
-            results['risk_profile_alignment_check'] = True
-    except (ValueError, TypeError):
-        results['risk_profile_alignment_check'] = False
-
-    return results
+    return evaluate_rules(user_profile, generated_plan, market_stats)
 
 
 # --- 2. LLM-as-Judge: The Evaluator Agent ---
@@ -136,33 +71,54 @@ evaluator_prompt = PromptTemplate(
 )
 
 
-# --- 3. The Main Orchestrator Function ---
-async def evaluate_plan(user_profile: dict, generated_plan: dict) -> dict:
-    print("--- Starting Hybrid Evaluation Process ---")
+def _clip_recommendations(generated_plan: dict) -> dict:
+    clipped = {}
+    for name, sub_plan in generated_plan.items():
+        if isinstance(sub_plan, dict) and isinstance(sub_plan.get('recommendations'), list):
+            sub_plan = {**sub_plan, 'recommendations': [
+                str(rec)[:EVALUATOR_RECOMMENDATION_CHARS] for rec in sub_plan['recommendations']
+            ]}
+        clipped[name] = sub_plan
+    return clipped
 
-    # Layer 1: Objective checks
-    golden_principle_results = check_golden_principles(user_profile, generated_plan)
-    print(f"Golden Principles Check Results: {golden_principle_results}")
 
-    # Layer 2: Subjective evaluation with key-cycling
-    evaluator_input = {
-        "user_profile": json.dumps(user_profile),
-        "generated_plan": json.dumps(generated_plan)
-    }
+async def run_llm_judge(user_profile: dict, generated_plan: dict) -> dict:
+    """
+    The evaluator agent on its own: scores the plan and returns the parsed JSON verdict.
+    """
+    user_profile_json = compact_json(user_profile)
+    evaluator_input = fit_prompt("evaluator", evaluator_prompt, [
+        {"user_profile": user_profile_json, "generated_plan": compact_json(generated_plan)},
+        {"user_profile": user_profile_json, "generated_plan": compact_json(_clip_recommendations(generated_plan))},
+    ])
 
     evaluation_str = await invoke_llm_with_retry(
         prompt_template=evaluator_prompt,
         input_data=evaluator_input,
-        temperature=0.1  # deterministic for evaluator
+        temperature=0.1,  # deterministic for evaluator
+        agent="evaluator"
     )
 
-    # Parse JSON from LLM
-    start_index = evaluation_str.find('{')
-    end_index = evaluation_str.rfind('}') + 1
-    if start_index == -1 or end_index == 0:
-        raise ValueError("Evaluator agent returned invalid data (no JSON object found).")
-    json_str = evaluation_str[start_index:end_index]
-    ai_evaluation_results = json.loads(json_str)
+    # Scores come back as numbers; an unusable verdict re-asks the evaluator only
+    evaluation, _ = await parse_with_reask(
+        "evaluator", evaluator_prompt, evaluator_input, evaluation_str, EvaluationOutput,
+        source="Evaluator agent", temperature=0.1
+    )
+    return evaluation
+
+
+# --- 3. The Main Orchestrator Function ---
+async def evaluate_plan(user_profile: dict, generated_plan: dict) -> dict:
+    print("--- Starting Hybrid Evaluation Process ---")
+
+    # Layer 1: Objective checks
+    golden_principle_results = check_golden_principles(
+        user_profile, generated_plan, market_data_store.get().stats
+    )
+    print(f"Golden Principles Check Results: {golden_principle_results}")
+
+    # Layer 2: Subjective evaluation with key-cycling
+    ai_evaluation_results = await run_llm_judge(user_profile, generated_plan)
 
     print("AI Judge Evaluation Complete.")
 
@@ -170,4 +126,4 @@ async def evaluate_plan(user_profile: dict, generated_plan: dict) -> dict:
     return {
         "golden_principle_checks": golden_principle_results,
         "ai_evaluation": ai_evaluation_results
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,113 @@
+# backend/services/fake_llm.py
+# Deterministic stand-in for Gemini (LLM_BACKEND=fake): offline runs, CI and load tests without network access.
+
+import os
+import asyncio
+import hashlib
+from services.serialization import dumps, dumps_canonical, loads
+
+# Simulated response time per call, and per streamed chunk
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0"))
+FAKE_LLM_CHUNK_CHARS = 40
+
+
+def _digest(*parts) -> int:
+    text = dumps_canonical(parts)
+    return int(hashlib.sha256(text.encode('utf-8')).hexdigest(), 16)
+
+
+def _goal_names(user_data: str) -> list:
+    try:
+        return [goal['name'] for goal in loads(user_data).get('goals', [])]
+    except (ValueError, AttributeError, TypeError, KeyError):
+        return []
+
+
+def _writer_response(input_data: dict) -> str:
+    goals = _goal_names(input_data.get('user_data', ''))
+    tbd = {name: "TBD" for name in goals}
+    return dumps({
+        "sentinel_plan": {
+            "summary": "A steady plan that clears high-interest debt and builds a safety net first.",
+            "asset_allocation": {"equities": "30%", "bonds": "50%", "commodities": "10%", "cash": "10%"},
+            "projected_goal_timeline_years": tbd,
+            "recommendations": [
+                "Pay down high-interest debt before increasing investments.",
+                "Build an emergency fund covering six months of expenses.",
+                "Invest the remaining savings monthly in low-cost bond and equity index funds."
+            ]
+        },
+        "voyager_plan": {
+            "summary": "A growth plan that invests most of the monthly savings while still paying off debt.",
+            "asset_allocation": {"equities": "70%", "bonds": "15%", "crypto": "5%", "cash": "10%"},
+            "projected_goal_timeline_years": tbd,
+            "recommendations": [
+                "Split savings between debt repayment and diversified equity funds.",
+                "Keep a three-month emergency fund in cash.",
+                "Review the allocation once a year and rebalance."
+            ]
+        }
+    }).decode()
+
+
+def _forecaster_response(input_data: dict) -> str:
+    goal = input_data.get('user_goal', 'your goal')
+    return dumps({"scenarios": [
+        {"name": "The Optimistic Scenario", "narrative": f"Strong growth brings {goal} closer.",
+         "parameters": {"avg_equity_return": 18.0, "avg_bond_return": 7.5, "avg_inflation": 4.5}},
+        {"name": "The Pessimistic Scenario", "narrative": f"A sluggish economy delays {goal}.",
+         "parameters": {"avg_equity_return": 2.0, "avg_bond_return": 6.0, "avg_inflation": 8.0}},
+        {"name": "The Neutral Scenario", "narrative": f"A mixed economy keeps {goal} on track.",
+         "parameters": {"avg_equity_return": 9.0, "avg_bond_return": 6.5, "avg_inflation": 6.0}}
+    ]}).decode()
+
+
+def _evaluator_response(input_data: dict) -> str:
+    # Scores depend only on the plan, so reruns of the same dataset score identically
+    h = _digest(input_data.get('generated_plan'))
+    scores = [4 + (h >> shift) % 7 for shift in (0, 8, 16)]
+    criteria = ["personalization", "actionability", "clarity_and_tone"]
+    return dumps({
+        "golden_principle_reasoning": {
+            "debt_priority_check": "Checked by the deterministic test backend.",
+            "risk_profile_alignment_check": "Checked by the deterministic test backend."
+        },
+        "quality_scores": {
+            name: {"score": score, "reasoning": "Deterministic test score."}
+            for name, score in zip(criteria, scores)
+        },
+        "final_verdict": {"overall_score": round(sum(scores) / 3, 1), "summary": "Deterministic test evaluation."}
+    }).decode()
+
+
+def fake_response(prompt_template, input_data: dict) -> str:
+    """
+    Picks a canned response by the prompt's input variables, which identify the agent.
+    """
+    variables = set(getattr(prompt_template, 'input_variables', []) or input_data)
+    if {"user_data", "strategies"} <= variables:
+        return _writer_response(input_data)
+    if "user_goal" in variables:
+        return _forecaster_response(input_data)
+    if {"user_profile", "generated_plan"} <= variables and "new_question" not in variables:
+        return _evaluator_response(input_data)
+    if "new_question" in variables:
+        return f"Here is how your plan handles that: {input_data.get('new_question', '')}".strip()
+    if "analyst_summary" in variables:
+        return "Sentinel: clear debt, build the emergency fund, then invest conservatively. Voyager: invest for growth while paying down debt."
+    return "Analyst report: savings rate, debt load and emergency cover reviewed; goals are achievable with discipline."
+
+
+async def ainvoke(prompt_template, input_data: dict, temperature: float = 0.7) -> str:
+    if FAKE_LLM_LATENCY_SECONDS > 0:
+        await asyncio.sleep(FAKE_LLM_LATENCY_SECONDS)
+    return fake_response(prompt_template, input_data)
+
+
+async def astream(prompt_template, input_data: dict, temperature: float = 0.7):
+    text = fake_response(prompt_template, input_data)
+    chunks = [text[i:i + FAKE_LLM_CHUNK_CHARS] for i in range(0, len(text), FAKE_LLM_CHUNK_CHARS)] or [""]
+    for chunk in chunks:
+        if FAKE_LLM_LATENCY_SECONDS > 0:
+            await asyncio.sleep(FAKE_LLM_LATENCY_SECONDS / len(chunks))
+        yield chunk
@@ -0,0 +1,243 @@
+# backend/services/golden_rules.py
+# Golden principles as data: rules are compiled once into predicates and run against per-plan facts.
+
+import operator
+import numpy as np
+from services.plan_engine import compute_financial_metrics, blended_return, project_goal_timelines, asset_class_returns
+
+# Allowed rounding slack when checking that an allocation sums to 100%
+ALLOCATION_TOLERANCE_PERCENT = 1.0
+
+# --- Rule definitions ---
+# Each rule is a list of cases; the first case whose "when" conditions all hold decides
+# the result, and a rule with no matching case passes. A case's "require" conditions
+# must hold for every plan in "plans" ("all" = every sub-plan with an asset_allocation).
+#
+# Conditions are {"fact": name, "op": op, "value": v}. Profile facts (high_interest_debt,
+# risk_score, metrics from compute_financial_metrics) are used in "when"; plan facts
+# (equities_percent, allocation_total_percent, recommendation_text, ...) in "require".
+GOLDEN_RULES = [
+    {
+        "id": "debt_priority_check",
+        "description": "High-interest debt must be addressed in every plan's recommendations.",
+        "cases": [
+            {
+                "when": [{"fact": "high_interest_debt", "op": ">", "value": 1000}],
+                "plans": ["sentinel_plan", "voyager_plan"],
+                "require": [{"fact": "recommendation_text", "op": "contains", "value": "debt"}],
+            },
+        ],
+    },
+    {
+        "id": "risk_profile_alignment_check",
+        "description": "Equity exposure must match the user's risk profile.",
+        "cases": [
+            {   # Aggressive
+                "when": [{"fact": "risk_score", "op": ">", "value": 4}],
+                "plans": ["voyager_plan"],
+                "require": [{"fact": "equities_percent", "op": ">=", "value": 60.0}],
+            },
+            {   # Conservative
+                "when": [{"fact": "risk_score", "op": "<=", "value": 3}],
+                "plans": ["sentinel_plan"],
+                "require": [{"fact": "equities_percent", "op": "<=", "value": 40.0}],
+            },
+        ],
+    },
+    {
+        "id": "emergency_fund_check",
+        "description": "With less than 3 months of expenses in cash, the safe plan must build an emergency fund.",
+        "cases": [
+            {
+                "when": [{"fact": "emergency_fund_coverage_months", "op": "<", "value": 3}],
+                "plans": ["sentinel_plan"],
+                "require": [{"fact": "recommendation_text", "op": "contains", "value": "emergency"}],
+            },
+        ],
+    },
+    {
+        "id": "allocation_sum_check",
+        "description": "Every asset allocation must add up to 100%.",
+        "cases": [
+            {
+                "when": [],
+                "plans": "all",
+                "require": [{"fact": "allocation_error_percent", "op": "<=", "value": ALLOCATION_TOLERANCE_PERCENT}],
+            },
+        ],
+    },
+    {
+        "id": "timeline_feasibility_check",
+        "description": "Every goal must be reachable within twice its target timeline under each plan's allocation.",
+        "cases": [
+            {
+                "when": [],
+                "plans": "all",
+                "require": [{"fact": "worst_timeline_stretch", "op": "<=", "value": 2.0}],
+            },
+        ],
+    },
+]
+
+
+# --- Compilation ---
+def _contains(text, needle):
+    return text is not None and needle in text
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "contains": _contains,
+}
+
+
+def compile_condition(spec: dict):
+    """
+    {"fact": ..., "op": ..., "value": ...} -> predicate(facts). A missing or
+    unparseable fact (None) makes any comparison false.
+    """
+    fact, value = spec["fact"], spec["value"]
+    try:
+        op = OPERATORS[spec["op"]]
+    except KeyError:
+        raise ValueError(f"Unknown operator {spec['op']!r} in rule condition on {fact!r}.")
+    if isinstance(value, str):
+        value = value.lower()
+
+    def predicate(facts):
+        actual = facts.get(fact)
+        return actual is not None and op(actual, value)
+    return predicate
+
+
+def compile_rule(rule: dict):
+    """
+    Turns a rule definition into check(profile_facts, plan_facts) -> bool.
+    """
+    cases = [
+        (
+            [compile_condition(c) for c in case.get("when", [])],
+            case.get("plans", "all"),
+            [compile_condition(c) for c in case.get("require", [])],
+        )
+        for case in rule["cases"]
+    ]
+
+    def check(profile_facts, plan_facts):
+        for when, plans, require in cases:
+            if not all(cond(profile_facts) for cond in when):
+                continue
+            names = [n for n, f in plan_facts.items() if f["has_allocation"]] if plans == "all" else plans
+            # A plan the rule needs but that is missing can't satisfy it
+            return all(
+                name in plan_facts and all(cond(plan_facts[name]) for cond in require)
+                for name in names
+            )
+        return True
+    return check
+
+
+def compile_rules(rules: list) -> list:
+    return [(rule["id"], compile_rule(rule)) for rule in rules]
+
+
+COMPILED_GOLDEN_RULES = compile_rules(GOLDEN_RULES)
+
+
+# --- Facts ---
+def _parse_allocation_percent(value):
+    # Like parse_percent, but unparseable values stay None so rules can fail on them
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace('%', '').strip())
+    except ValueError:
+        return None
+
+
+def profile_facts(user_profile: dict) -> dict:
+    facts = {
+        "high_interest_debt": user_profile.get('liabilities', {}).get('high_interest_debt', 0),
+        "risk_score": None,
+    }
+    try:
+        facts["risk_score"] = sum(user_profile.get('risk_profile_answers', []))
+    except TypeError:
+        pass
+    try:
+        facts.update(compute_financial_metrics(user_profile))
+    except (KeyError, TypeError, ValueError):
+        # Partial profiles (e.g. in regression fixtures) only get the facts above
+        pass
+    return facts
+
+
+def plan_facts(user_profile: dict, generated_plan: dict, profile: dict, returns: dict) -> dict:
+    """
+    Facts for every sub-plan: allocation percentages (parsed once), their total, the
+    lower-cased recommendation text and how far the projected goal timelines overshoot
+    the user's own timelines.
+    """
+    goals = user_profile.get('goals') or []
+    targets = np.array([float(g.get('target_amount', 0)) for g in goals])
+    wanted_years = np.array([float(g.get('timeline_years', 0)) for g in goals])
+    facts = {}
+    for name, sub_plan in generated_plan.items():
+        if not isinstance(sub_plan, dict):
+            continue
+        allocation = sub_plan.get('asset_allocation')
+        allocation = allocation if isinstance(allocation, dict) else {}
+        percents = {asset: _parse_allocation_percent(v) for asset, v in allocation.items()}
+        valid = bool(percents) and None not in percents.values()
+        total = sum(percents.values()) if valid else None
+        recommendations = sub_plan.get('recommendations') or []
+
+        stretch = 0.0 if not goals else None
+        if valid and len(goals) and profile.get('monthly_savings_potential') is not None:
+            years = project_goal_timelines(
+                targets,
+                profile['investable_assets'],
+                profile['monthly_savings_potential'],
+                blended_return(percents, returns)
+            )
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stretch = float(np.max(np.where(wanted_years > 0, years / wanted_years, np.inf)))
+
+        facts[name] = {
+            "has_allocation": bool(allocation),
+            # No equities key means 0%; an unparseable value stays None and fails the rule
+            "equities_percent": percents.get('equities', 0.0),
+            "allocation_total_percent": total,
+            "allocation_error_percent": abs(total - 100.0) if total is not None else None,
+            "recommendation_text": ' '.join(str(r) for r in recommendations).lower(),
+            "worst_timeline_stretch": stretch,
+        }
+    return facts
+
+
+# --- Evaluation ---
+def _evaluate(user_profile: dict, generated_plan: dict, returns: dict, rules: list) -> dict:
+    profile = profile_facts(user_profile)
+    plans = plan_facts(user_profile, generated_plan, profile, returns)
+    return {rule_id: check(profile, plans) for rule_id, check in rules}
+
+
+def evaluate_rules(user_profile: dict, generated_plan: dict, market_stats: dict = None,
+                   rules: list = COMPILED_GOLDEN_RULES) -> dict:
+    """
+    rule id -> passed, for one profile/plan pair.
+    """
+    return _evaluate(user_profile, generated_plan, asset_class_returns(market_stats or {}), rules)
+
+
+def evaluate_rules_batch(pairs, market_stats: dict = None, rules: list = COMPILED_GOLDEN_RULES) -> list:
+    """
+    Evaluates an iterable of (user_profile, generated_plan) pairs, e.g. for offline
+    regression runs. Market returns are resolved once for the whole batch.
+    """
+    returns = asset_class_returns(market_stats or {})
+    return [_evaluate(user_profile, generated_plan, returns, rules) for user_profile, generated_plan in pairs]
@@ -0,0 +1,313 @@
+# backend/services/instrumentation.py
+# Prometheus-format metrics for the agents (latency, tokens, keys, retries, parse failures, cache) and per-request trace spans.
+
+import os
+import time
+import math
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Requests are traced when this is on or when the client sends "X-Trace: 1"
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra: dict = None) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key -> [per-bucket counts (non-cumulative), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Agent metrics ---
+LLM_CALL_SECONDS = registry.histogram(
+    "finpilot_llm_call_seconds", "Wall time of one agent call, including key retries.", ("agent", "outcome"))
+LLM_PROMPT_TOKENS = registry.counter(
+    "finpilot_llm_prompt_tokens_total", "Estimated prompt tokens sent, by agent.", ("agent",))
+LLM_COMPLETION_TOKENS = registry.counter(
+    "finpilot_llm_completion_tokens_total", "Estimated completion tokens received, by agent.", ("agent",))
+LLM_KEY_ATTEMPTS = registry.counter(
+    "finpilot_llm_key_attempts_total", "Attempts per API key (1-based index) and outcome.", ("agent", "key", "outcome"))
+LLM_RETRIES = registry.counter(
+    "finpilot_llm_retries_total", "Extra key attempts after the first one failed.", ("agent",))
+LLM_PARSE_FAILURES = registry.counter(
+    "finpilot_llm_parse_failures_total", "Agent responses that did not contain valid JSON.", ("agent",))
+LLM_REASKS = registry.counter(
+    "finpilot_llm_reasks_total", "Agents asked again after their output failed schema validation.", ("agent",))
+LLM_COALESCED = registry.counter(
+    "finpilot_llm_coalesced_total", "Calls that shared an identical in-flight call instead of going upstream.", ("agent",))
+LLM_ADMISSION_WAIT_SECONDS = registry.histogram(
+    "finpilot_llm_admission_wait_seconds", "Time a call waited for a key with spare capacity.", ("agent",),
+    buckets=HTTP_LATENCY_BUCKETS)
+LLM_ADMISSION_TIMEOUTS = registry.counter(
+    "finpilot_llm_admission_timeouts_total", "Calls that gave up waiting for key capacity.", ("agent",))
+LLM_KEY_CONCURRENCY_LIMIT = registry.gauge(
+    "finpilot_llm_key_concurrency_limit", "Current adaptive concurrency limit per API key.", ("key",))
+LLM_KEY_IN_FLIGHT = registry.gauge(
+    "finpilot_llm_key_in_flight", "Calls currently running on each API key.", ("key",))
+CACHE_REQUESTS = registry.counter(
+    "finpilot_cache_requests_total", "Response cache lookups by stage and result (hit/miss).", ("stage", "result"))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "finpilot_http_request_seconds", "HTTP request latency by route.", ("method", "route", "status"),
+    buckets=HTTP_LATENCY_BUCKETS)
+
+
+def record_llm_call(agent: str, seconds: float, outcome: str, prompt_tokens: int = 0,
+                    completion_tokens: int = 0, attempts: int = 1):
+    LLM_CALL_SECONDS.observe(seconds, agent=agent, outcome=outcome)
+    if prompt_tokens:
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, agent=agent)
+    if completion_tokens:
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, agent=agent)
+    if attempts > 1:
+        LLM_RETRIES.inc(attempts - 1, agent=agent)
+
+
+def record_key_attempt(agent: str, key_index: int, outcome: str):
+    LLM_KEY_ATTEMPTS.inc(agent=agent, key=key_index + 1, outcome=outcome)
+
+
+def record_parse_failure(agent: str):
+    LLM_PARSE_FAILURES.inc(agent=agent)
+
+
+def record_reask(agent: str):
+    LLM_REASKS.inc(agent=agent)
+
+
+def record_cache(stage: str, hit: bool):
+    CACHE_REQUESTS.inc(stage=stage, result="hit" if hit else "miss")
+
+
+# --- Per-request trace spans ---
+# Holds the span list of the request being served, or None when it isn't traced
+_current_trace = contextvars.ContextVar("finpilot_trace", default=None)
+
+
+def start_trace():
+    """
+    Starts collecting spans for the current request; returns a token for end_trace.
+    """
+    return _current_trace.set([])
+
+
+def end_trace(token) -> list:
+    spans = _current_trace.get() or []
+    _current_trace.reset(token)
+    return spans
+
+
+def add_span(name: str, seconds: float):
+    """
+    Records an already-measured span on the current request's trace, if any.
+    """
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def trace_span(name: str):
+    """
+    Times the enclosed block as a span of the current request's trace (no-op when the
+    request isn't traced). Spans may overlap, e.g. concurrent stages of /plan-bundle.
+    """
+    spans = _current_trace.get()
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - started))
+
+
+def server_timing_header(spans: list) -> str:
+    """
+    Server-Timing header value, e.g. 'analyst;dur=812.4, strategist;dur=640.1'. Repeated
+    span names get a numeric suffix so browsers show each one.
+    """
+    seen = {}
+    parts = []
+    for name, seconds in spans:
+        seen[name] = seen.get(name, 0) + 1
+        metric = name if seen[name] == 1 else f"{name}-{seen[name]}"
+        metric = "".join(c if c.isalnum() or c in "-_" else "_" for c in metric)
+        parts.append(f"{metric};dur={seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- HTTP middleware ---
+class RequestMetricsMiddleware:
+    """
+    Records request latency per route and, for traced requests (TRACE_REQUESTS or an
+    "X-Trace: 1" header), returns the agent spans as a Server-Timing header.
+
+    Plain ASGI rather than @app.middleware("http"): `receive` is passed through untouched,
+    so endpoints still see client disconnects. Latency is measured up to the response
+    headers; streaming responses send those before the agents run, so their
+    Server-Timing only carries what ran before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traced = TRACE_REQUESTS or (b"x-trace", b"1") in scope.get("headers", [])
+        token = start_trace() if traced else None
+        spans = _current_trace.get()
+        started = time.perf_counter()
+        status, elapsed = 500, None
+
+        async def send_with_timing(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status, elapsed = message["status"], time.perf_counter() - started
+                if traced:
+                    header = server_timing_header(spans + [("total", elapsed)])
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if token is not None:
+                end_trace(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                elapsed if elapsed is not None else time.perf_counter() - started,
+                method=scope["method"],
+                # The route template keeps ids out of the labels
+                route=getattr(route, "path", "unmatched"),
+                status=status
+            )
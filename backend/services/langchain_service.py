@@ -1,57 +1,32 @@
-import os
-import json
-import math
-from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
+import hashlib
+import numpy as np
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from google.api_core.exceptions import ResourceExhausted
-
-# Load environment variables from .env file
-load_dotenv()
-
-# --- NEW: API Key Management ---
-# Load all keys from the .env file and split them into a list
-API_KEYS = os.getenv("GOOGLE_API_KEYS", "").split(',')
-if not all(API_KEYS) or API_KEYS == ['']:
-    raise ValueError("GOOGLE_API_KEYS environment variable not set or is empty. Please check your .env file.")
-
-# --- NEW: Resilient LLM Invoker with Key Cycling ---
-async def invoke_llm_with_retry(prompt_template, input_data):
-    """
-    Tries to invoke a LangChain chain with a list of API keys.
-    If a key is rate-limited (ResourceExhausted), it automatically retries with the next key.
-    """
-    for i, key in enumerate(API_KEYS):
-        try:
-            # Initialize a new LLM instance with the current key for this specific call
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-flash-latest",
-                temperature=0.7,
-                google_api_key=key
-            )
-            
-            # Build the full chain using the prompt and the new LLM instance
-            chain = prompt_template | llm | StrOutputParser()
-            
-            print(f"--- Attempting API call with Key #{i + 1} ---")
-            response = await chain.ainvoke(input_data)
-            print(f"--- Key #{i + 1} succeeded. ---")
-            return response # Success, so we return the response
-
-        except ResourceExhausted:
-            print(f"Warning: API Key #{i + 1} is rate-limited or exhausted. Trying next key...")
-            if i == len(API_KEYS) - 1: # If this was the last key in the list
-                print("Error: All API keys are exhausted.")
-                raise # Re-raise the final exception if all keys have failed
-        except Exception as e:
-            # Handle other potential errors (e.g., an invalid key format)
-            print(f"An unexpected error occurred with Key #{i + 1}: {e}")
-            if i == len(API_KEYS) - 1:
-                raise
-    
-    # This line should ideally not be reached, but is a fallback.
-    raise Exception("All API keys failed to generate a response.")
+from services.llm_gateway import invoke_llm_with_retry, stream_llm_with_retry, LLM_BACKEND
+from services.market_data_store import market_data_store
+from services.response_cache import plan_cache, cache_key, normalize_profile
+from services.instrumentation import record_cache
+from services.scenario_library import ScenarioLibrary
+from services.structured_output import (
+    PlanOutput,
+    ScenariosOutput,
+    parse_structured,
+    parse_with_reask,
+    is_valid_output
+)
+from services.prompt_budget import (
+    compact_json,
+    compact_market_stats,
+    chat_history_candidates,
+    fit_prompt
+)
+from services.plan_engine import (
+    project_goal_timelines,
+    format_timeline_years,
+    compute_financial_metrics,
+    asset_class_returns,
+    apply_projected_timelines,
+    format_metrics_for_prompt
+)
 
 
 # --- Agent 1: The Analyst ---
@@ -59,7 +34,7 @@ analyst_template = """
 You are a meticulous and data-driven financial analyst. Your primary role is to perform a rigorous, quantitative analysis of a user's financial situation and provide a structured, objective report. You must act as a "realist," grounding the user's ambitions in their current financial reality.
 
 Your task is threefold:
-Calculate Key Financial Ratios: Based on the raw user data, calculate the essential metrics that define their financial health.
+Report Key Financial Ratios: The essential metrics that define their financial health have already been calculated exactly; report them as given.
 Perform a Goal Sanity Check: Critically assess the feasibility of the user's stated goals against their calculated savings potential.
 Synthesize Findings: Present all your calculations and observations in a clean, structured format for the next AI agent, The Strategist, to use.
 
@@ -71,13 +46,13 @@ USER DATA:
 MARKET CONTEXT (For contextual understanding of risk and return):
 {market_stats}
 
+PRECOMPUTED FINANCIAL METRICS (exact; use these values, do not recalculate them):
+{financial_metrics}
+
 BEGIN ANALYSIS
 
 PART 1: QUANTITATIVE FINANCIAL HEALTH ASSESSMENT
-Monthly Savings Potential: (Calculate: Monthly Income - Monthly Expenses - Monthly Loan EMIs)
-Savings Rate: (Calculate: [Monthly Savings Potential / Monthly Income] * 100)%
-Debt-to-Income (DTI) Ratio: (Calculate: [Monthly Loan EMIs / Monthly Income] * 100)%
-Emergency Fund Coverage: (Calculate: [Cash & Equivalents / Monthly Expenses]) months
+[Restate the precomputed Monthly Savings Potential, Savings Rate, Debt-to-Income (DTI) Ratio and Emergency Fund Coverage.]
 
 PART 2: GOAL FEASIBILITY ANALYSIS (REALIST CHECK)
 Overall Goal Assessment: [Provide a one-sentence summary of the goals' achievability. Use terms like "Highly Realistic," "Achievable with Discipline," "Ambitious," or "Requires Significant Re-evaluation."]
@@ -98,7 +73,7 @@ Asset Composition Insights:
 """
 analyst_prompt = PromptTemplate(
     template=analyst_template,
-    input_variables=['market_stats', 'user_data']
+    input_variables=['market_stats', 'user_data', 'financial_metrics']
 )
 
 # --- Agent 2: The Strategist ---
@@ -147,32 +122,28 @@ strategist_prompt = PromptTemplate(
 
 # --- Agent 3: The Writer ---
 writer_template = """
-You are an expert financial writer and quantitative analyst. You have been given a user's complete financial profile and two high-level strategies from a master strategist. Your sole task is to translate these strategies into a detailed, user-friendly financial plan, performing specific calculations as instructed.
+You are an expert financial writer. You have been given a user's complete financial profile, precomputed financial metrics and two high-level strategies from a master strategist. Your sole task is to translate these strategies into a detailed, user-friendly financial plan.
 
 CRITICAL INSTRUCTIONS:
 1. You MUST adhere strictly to the philosophy and action steps outlined in the provided strategies.
-2. You MUST calculate the projected goal timelines using the provided financial projection functions. Show your work.
+2. Do NOT calculate goal timelines. They are computed by the system from each plan's asset_allocation after you respond; put "TBD" for every goal in projected_goal_timeline_years.
 3. Your entire response MUST be a single, valid JSON object, with no other text, comments, or explanations before or after it.
 
 USER DATA:
 {user_data}
 
+PRECOMPUTED FINANCIAL METRICS:
+{financial_metrics}
+
 HIGH-LEVEL STRATEGIES FROM THE STRATEGIST:
 {strategies}
 
-FINANCIAL CALCULATION FUNCTIONS (for your internal use):
-def project_goal_timeline(target_amount, initial_investment, monthly_contribution, annual_return_rate):
-    # This function calculates the number of years to reach a financial goal.
-    # Use the avg_annual_return_percent from the user's market_stats.json for the annual_return_rate.
-    pass
-    
 BEGIN FINAL PLAN GENERATION
 
 Based on all the provided information, create the complete financial plan.
 
-For the projected_goal_timeline_years:
-1. Use the project_goal_timeline function.
-2. For the annual_return_rate, use the appropriate blended rate based on the asset allocation for each plan. For example, for the Sentinel plan, you might use a blended rate of (30% * equity_return) + (50% * bond_return) + (10% * commodities_return) + (10% * cash_return).
+For the asset_allocation:
+Choose percentages that add up to 100% and reflect each strategy, using the expected annual returns by asset class above.
 
 For the recommendations:
 Translate the "Key Priorities" from the Strategist's report into 3-4 clear, actionable, and encouraging steps for the user.
@@ -182,37 +153,185 @@ OUTPUT FORMAT (Strictly adhere to this JSON Structure):
   "sentinel_plan": {{
     "summary": "A brief, encouraging summary of this safe plan, directly reflecting the Strategist's philosophy.",
     "asset_allocation": {{ "equities": "X%", "bonds": "Y%", "commodities": "Z%", "cash": "A%" }},
-    "projected_goal_timeline_years": {{ "User's Goal Name 1": "X", "User's Goal Name 2": "Y" }},
+    "projected_goal_timeline_years": {{ "User's Goal Name 1": "TBD", "User's Goal Name 2": "TBD" }},
     "recommendations": ["Detailed recommendation 1", "Detailed recommendation 2", "Detailed recommendation 3"]
   }},
   "voyager_plan": {{
     "summary": "A brief, encouraging summary of this growth-oriented plan, directly reflecting the Strategist's philosophy.",
     "asset_allocation": {{ "equities": "X%", "bonds": "Y%", "crypto": "Z%", "cash": "A%" }},
-    "projected_goal_timeline_years": {{ "User's Goal Name 1": "X", "User's Goal Name 2": "Y" }},
+    "projected_goal_timeline_years": {{ "User's Goal Name 1": "TBD", "User's Goal Name 2": "TBD" }},
     "recommendations": ["Detailed recommendation 1", "Detailed recommendation 2", "Detailed recommendation 3"]
   }}
 }}
 """
 writer_prompt = PromptTemplate(
     template=writer_template,
-    input_variables=["user_data", "strategies"]
+    input_variables=["user_data", "strategies", "financial_metrics"]
 )
 
 # --- The AI Assembly Line Chain ---
-async def generate_plan_with_assembly_line(user_profile: dict):
-    with open("market_stats.json", "r") as f:
-        market_stats = json.load(f)
+def _is_valid_plan(text: str) -> bool:
+    return is_valid_output(text, PlanOutput)
 
-    analyst_input = {"user_data": json.dumps(user_profile), "market_stats": json.dumps(market_stats)}
-    analyst_summary = await invoke_llm_with_retry(analyst_prompt, analyst_input)
+def _prompt_fingerprint(prompt_template) -> str:
+    # Editing a prompt must not serve answers cached for the old wording
+    return hashlib.sha256(prompt_template.template.encode('utf-8')).hexdigest()[:12]
 
+def _stage_cache_key(stage: str, prompt_template, key_parts: dict) -> str:
+    # The backend is part of the key so fake-backend runs never fill a shared cache with canned plans
+    return cache_key(stage, {"backend": LLM_BACKEND, "prompt": _prompt_fingerprint(prompt_template), **key_parts})
+
+async def run_cached_stage(stage: str, prompt_template, input_data: dict, key_parts: dict, validate=None):
+    """
+    Runs one agent of the assembly line through the response cache.
+    `key_parts` is everything the stage's output depends on; `validate` can veto caching a bad output.
+    """
+    key = _stage_cache_key(stage, prompt_template, key_parts)
+    cached = plan_cache.get(key)
+    record_cache(stage, cached is not None)
+    if cached is not None:
+        print(f"--- {stage} cache hit ---")
+        return cached
+    response = await invoke_llm_with_retry(prompt_template, input_data, agent=stage)
+    if validate is None or validate(response):
+        plan_cache.set(key, response)
+    return response
+
+async def stream_cached_stage(stage: str, prompt_template, input_data: dict, key_parts: dict, validate=None):
+    """
+    Streaming counterpart of run_cached_stage. A cache hit is yielded as a single chunk.
+    """
+    key = _stage_cache_key(stage, prompt_template, key_parts)
+    cached = plan_cache.get(key)
+    record_cache(stage, cached is not None)
+    if cached is not None:
+        print(f"--- {stage} cache hit ---")
+        yield cached
+        return
+    chunks = []
+    async for chunk in stream_llm_with_retry(prompt_template, input_data, agent=stage):
+        chunks.append(chunk)
+        yield chunk
+    response = ''.join(chunks)
+    if validate is None or validate(response):
+        plan_cache.set(key, response)
+
+async def repair_stage_output(stage: str, prompt_template, input_data: dict, key_parts: dict,
+                              response: str, schema, source: str, **_) -> str:
+    """
+    Makes sure a stage's response fits `schema`. A response that fails even after local
+    fixes is re-asked from this stage alone (the earlier stages' outputs are already in
+    `input_data`), and the corrected response replaces it in the cache.
+    """
+    _, fixed = await parse_with_reask(stage, prompt_template, input_data, response, schema, source)
+    if fixed is not response:
+        plan_cache.set(_stage_cache_key(stage, prompt_template, key_parts), fixed)
+    return fixed
+
+# (market version, detail) -> compact market stats for the analyst prompt
+_market_prompt_cache = {}
+MARKET_PROMPT_DETAILS = ("full", "summary", "core")
+
+def _market_stats_for_prompt(market, detail: str) -> str:
+    key = (market.version, detail)
+    text = _market_prompt_cache.get(key)
+    if text is None:
+        if len(_market_prompt_cache) >= 4 * len(MARKET_PROMPT_DETAILS):
+            _market_prompt_cache.clear()
+        text = _market_prompt_cache[key] = compact_market_stats(market.stats, detail)
+    return text
+
+def _prepare_assembly_line(user_profile: dict):
+    # Market stats are loaded once per file version, not once per request
+    market = market_data_store.get()
+    profile = normalize_profile(user_profile)
+    user_data = compact_json(profile)
+    # Ratios and returns are plain arithmetic, so they are computed here rather than by the LLM
+    financial_metrics = format_metrics_for_prompt(
+        compute_financial_metrics(profile), asset_class_returns(market.stats)
+    )
+    return market, profile, user_data, financial_metrics
+
+async def _run_analyst(market, profile: dict, user_data: str, financial_metrics: str) -> str:
+    # Drop market detail (rolling history first) until the prompt fits the analyst's budget
+    analyst_input = fit_prompt("analyst", analyst_prompt, (
+        {"user_data": user_data, "market_stats": _market_stats_for_prompt(market, detail), "financial_metrics": financial_metrics}
+        for detail in MARKET_PROMPT_DETAILS
+    ))
+    return await run_cached_stage(
+        "analyst", analyst_prompt, analyst_input,
+        key_parts={"user_data": profile, "market_version": market.version, "market_stats": analyst_input["market_stats"]}
+    )
+
+async def _run_strategist(analyst_summary: str) -> str:
     strategist_input = {"analyst_summary": analyst_summary}
-    strategies = await invoke_llm_with_retry(strategist_prompt, strategist_input)
+    return await run_cached_stage(
+        "strategist", strategist_prompt, strategist_input,
+        key_parts=strategist_input
+    )
+
+def _writer_stage_args(market, profile: dict, user_data: str, financial_metrics: str, strategies: str) -> dict:
+    # Nothing in the writer's input can be dropped; fit_prompt only measures and warns
+    writer_input = fit_prompt("writer", writer_prompt, [
+        {"user_data": user_data, "strategies": strategies, "financial_metrics": financial_metrics}
+    ])
+    return {
+        "stage": "writer",
+        "prompt_template": writer_prompt,
+        "input_data": writer_input,
+        "key_parts": {"user_data": profile, "strategies": strategies, "market_version": market.version},
+        "validate": _is_valid_plan,
+    }
 
-    writer_input = {"user_data": json.dumps(user_profile), "strategies": strategies}
-    final_plan_str = await invoke_llm_with_retry(writer_prompt, writer_input)
-    
-    return final_plan_str
+def finalize_plan(plan_str: str, user_profile: dict) -> dict:
+    """
+    Parses the writer's output and fills in projected_goal_timeline_years with
+    timelines computed from each plan's asset allocation.
+    """
+    plan = parse_structured(plan_str, PlanOutput, source="Writer agent")
+    return apply_projected_timelines(plan, user_profile, market_data_store.get().stats)
+
+async def generate_plan_with_assembly_line(user_profile: dict):
+    market, profile, user_data, financial_metrics = _prepare_assembly_line(user_profile)
+    analyst_summary = await _run_analyst(market, profile, user_data, financial_metrics)
+    strategies = await _run_strategist(analyst_summary)
+    writer_args = _writer_stage_args(market, profile, user_data, financial_metrics, strategies)
+    final_plan_str = await run_cached_stage(**writer_args)
+    return await repair_stage_output(
+        response=final_plan_str, schema=PlanOutput, source="Writer agent", **writer_args
+    )
+
+async def stream_plan_with_assembly_line(user_profile: dict):
+    """
+    Runs the same assembly line as generate_plan_with_assembly_line but yields
+    (event, data) tuples as it goes: a "stage" event when each agent finishes,
+    "token" events with the writer's output as it streams, and finally a "plan"
+    event with the finalized plan. If the streamed output had to be re-asked, a
+    "stage" event with status "repaired" precedes the plan, and the plan event (not
+    the earlier tokens) is authoritative.
+    """
+    market, profile, user_data, financial_metrics = _prepare_assembly_line(user_profile)
+
+    analyst_summary = await _run_analyst(market, profile, user_data, financial_metrics)
+    yield "stage", {"stage": "analyst", "status": "complete"}
+
+    strategies = await _run_strategist(analyst_summary)
+    yield "stage", {"stage": "strategist", "status": "complete"}
+
+    writer_args = _writer_stage_args(market, profile, user_data, financial_metrics, strategies)
+    chunks = []
+    async for chunk in stream_cached_stage(**writer_args):
+        chunks.append(chunk)
+        yield "token", {"text": chunk}
+    streamed = ''.join(chunks)
+    plan_str = await repair_stage_output(
+        response=streamed, schema=PlanOutput, source="Writer agent", **writer_args
+    )
+    if plan_str is not streamed:
+        yield "stage", {"stage": "writer", "status": "repaired"}
+    yield "stage", {"stage": "writer", "status": "complete"}
+
+    yield "plan", finalize_plan(plan_str, user_profile)
 
 # --- Agent 4: The Economic Forecaster (Personalized Storyteller) ---
 
@@ -256,99 +375,66 @@ forecaster_prompt = PromptTemplate(
     input_variables=["user_goal"]
 )
 
-def project_goal_timeline(target_amount, initial_investment, monthly_contribution, annual_return_rate):
+async def generate_scenarios(goal_name: str) -> dict:
     """
-    Calculates the number of years to reach a financial goal.
-    (This function is unchanged)
+    The forecaster's LLM call: three scenarios (narrative plus parameters) for a goal.
+    Nothing here depends on the user's finances, so results are shared through
+    scenario_library.
     """
-    if monthly_contribution <= 0 and initial_investment < target_amount:
-        return float('inf')
-
-    if annual_return_rate <= 0:
-        if monthly_contribution <= 0:
-            return float('inf')
-        # Avoid division by zero if target is already met
-        if (target_amount - initial_investment) <= 0:
-            return 0.0
-        return (target_amount - initial_investment) / (monthly_contribution * 12)
-
-    monthly_rate = (1 + annual_return_rate) ** (1/12) - 1
-    
-    if abs(monthly_rate) < 1e-9: # Handles cases where annual_return_rate is extremely small
-        if monthly_contribution <= 0:
-            return float('inf')
-        if (target_amount - initial_investment) <= 0:
-            return 0.0
-        return (target_amount - initial_investment) / (monthly_contribution * 12)
-
-    # Formula for number of periods (months) in an annuity
-    # n = log( (FV*r + PMT) / (P*r + PMT) ) / log(1+r)
-    try:
-        # We add a small epsilon to avoid log(0) if PMT is 0 and FV equals P
-        numerator = math.log((target_amount * monthly_rate + monthly_contribution + 1e-9))
-        denominator = math.log((initial_investment * monthly_rate + monthly_contribution + 1e-9))
-        log_1_plus_r = math.log(1 + monthly_rate)
-        
-        if log_1_plus_r == 0: # Should be caught by earlier check, but as a safeguard
-             return float('inf')
-
-        months = (numerator - denominator) / log_1_plus_r
-    except (ValueError, ZeroDivisionError):
-        # Fallback to iteration if formula fails (e.g., due to negative logs)
-        current_value = float(initial_investment)
-        months = 0
-        while current_value < target_amount:
-            interest = current_value * monthly_rate
-            current_value += interest + monthly_contribution
-            months += 1
-            if months > 1200: # 100 years
-                return float('inf')
-        return round(months / 12, 1)
-
-    return round(months / 12, 1)
+    forecaster_input = {"user_goal": goal_name}
+    scenarios_str = await invoke_llm_with_retry(forecaster_prompt, forecaster_input, agent="forecaster")
+
+    # Validated against the scenario schema; only the forecaster is re-asked on failure
+    scenarios_data, _ = await parse_with_reask(
+        "forecaster", forecaster_prompt, forecaster_input, scenarios_str, ScenariosOutput, source="Forecaster agent"
+    )
+    return scenarios_data
 
+scenario_library = ScenarioLibrary(generate_scenarios)
+
+def project_scenarios(user_profile: dict, scenarios_data: dict) -> dict:
+    """
+    Adds the user's projected goal timelines to each scenario. Returns new dicts, so
+    the shared library entry is left untouched.
+    """
+    # Calculate the user's available monthly savings for investment
+    metrics = compute_financial_metrics(user_profile)
+    monthly_savings = metrics['monthly_savings_potential']
+    initial_investment = metrics['investable_assets']
+
+    # Solve every scenario x goal timeline in one vectorized call
+    scenarios = scenarios_data['scenarios']
+    goals = user_profile['goals']
+    # Create a blended return rate based on a moderate (60/40) portfolio for simulation
+    blended_returns = np.array([
+        (scenario['parameters']['avg_equity_return'] * 0.60 + scenario['parameters']['avg_bond_return'] * 0.40) / 100
+        for scenario in scenarios
+    ], dtype=float)
+    targets = np.array([goal['target_amount'] for goal in goals], dtype=float)
+    timelines = project_goal_timelines(
+        targets=targets[np.newaxis, :],
+        initials=initial_investment,
+        contributions=monthly_savings,
+        rates=blended_returns[:, np.newaxis]
+    )
+
+    return {**scenarios_data, "scenarios": [
+        {**scenario, "projected_timelines": {
+            goal['name']: f"{format_timeline_years(float(timeline))} years"
+            for goal, timeline in zip(goals, scenario_timelines)
+        }}
+        for scenario, scenario_timelines in zip(scenarios, timelines)
+    ]}
 
 async def run_economic_forecaster(user_profile: dict):
     """
-    Runs the personalized economic forecaster agent.
+    Runs the personalized economic forecaster: scenarios for the primary goal come from
+    the scenario library (an LLM call only on a miss), timelines are computed locally.
     """
     # Extract the user's primary goal (we'll assume the first one listed)
     primary_goal = user_profile['goals'][0]['name'] if user_profile['goals'] else "achieving their financial targets"
-
-    # Invoke the LLM with the user's goal for personalization
-    scenarios_str = await invoke_llm_with_retry(forecaster_prompt, {"user_goal": primary_goal})
-    
-    # Robust JSON parsing
-    start_index = scenarios_str.find('{')
-    end_index = scenarios_str.rfind('}') + 1
-    if start_index == -1 or end_index == 0:
-        raise ValueError("Forecaster agent returned invalid data (no JSON object found).")
-    json_str = scenarios_str[start_index:end_index]
-    scenarios_data = json.loads(json_str)
-
-    # Calculate the user's available monthly savings for investment
-    monthly_savings = user_profile['monthly_income'] - user_profile['monthly_expenses'] - user_profile['liabilities']['loans_emi']
-    initial_investment = user_profile['assets']['equity_investments'] + user_profile['assets']['other_investments']
-
-    # Loop through each AI-generated scenario and calculate the new goal timelines
-    for scenario in scenarios_data['scenarios']:
-        params = scenario['parameters']
-        # Create a blended return rate based on a moderate (60/40) portfolio for simulation
-        blended_return = (params['avg_equity_return'] * 0.60 + params['avg_bond_return'] * 0.40) / 100
-
-        projected_timelines = {}
-        for goal in user_profile['goals']:
-            timeline = project_goal_timeline(
-                target_amount=float(goal['target_amount']),
-                initial_investment=float(initial_investment),
-                monthly_contribution=float(monthly_savings),
-                annual_return_rate=float(blended_return)
-            )
-            projected_timelines[goal['name']] = "More than 100 years" if math.isinf(timeline) else f"{timeline} years"
-        
-        scenario['projected_timelines'] = projected_timelines
-        
-    return scenarios_data
+    scenarios_data = await scenario_library.get(primary_goal)
+    return project_scenarios(user_profile, scenarios_data)
 
 
 # --- Agent 5: The Context-Aware Q&A Agent ---
@@ -382,12 +468,33 @@ YOUR ANSWER:
 """
 qa_prompt = PromptTemplate.from_template(qa_template)
 
+def _qa_input(user_profile: str, generated_plan: str, chat_history: list, new_question: str) -> dict:
+    # Recent turns verbatim plus a summary of older ones, shrinking the window to fit the budget
+    return fit_prompt("qa", qa_prompt, (
+        {
+            "user_profile": user_profile,
+            "generated_plan": generated_plan,
+            "chat_history": history,
+            "new_question": new_question
+        }
+        for history in chat_history_candidates(chat_history)
+    ))
+
 async def run_qa_agent(payload: dict):
-    qa_input = {
-        "user_profile": json.dumps(payload['userProfile']),
-        "generated_plan": json.dumps(payload['generatedPlan']),
-        "chat_history": json.dumps(payload['chatHistory']),
-        "new_question": payload['newQuestion']
-    }
-    answer = await invoke_llm_with_retry(qa_prompt, qa_input)
-    return {"response": answer}
\ No newline at end of file
+    qa_input = _qa_input(
+        compact_json(payload['userProfile']),
+        compact_json(payload['generatedPlan']),
+        payload['chatHistory'],
+        payload['newQuestion']
+    )
+    answer = await invoke_llm_with_retry(qa_prompt, qa_input, agent="qa")
+    return {"response": answer}
+
+async def stream_qa_agent(user_profile: str, generated_plan: str, chat_history: list, new_question: str):
+    """
+    Streaming Q&A for chat sessions: the profile and plan arrive already compacted
+    (once per session) and the answer is yielded chunk by chunk.
+    """
+    qa_input = _qa_input(user_profile, generated_plan, chat_history, new_question)
+    async for chunk in stream_llm_with_retry(qa_prompt, qa_input, agent="qa"):
+        yield chunk
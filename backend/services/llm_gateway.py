@@ -0,0 +1,421 @@
+# backend/services/llm_gateway.py
+# Shared access to Gemini for every agent: long-lived clients per key and health-aware key scheduling.
+
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.output_parsers import StrOutputParser
+from google.api_core.exceptions import ResourceExhausted
+from services import fake_llm
+from services.prompt_budget import estimate_tokens, CHARS_PER_TOKEN
+from services.serialization import dumps_canonical
+from services.instrumentation import (
+    add_span,
+    record_llm_call,
+    record_key_attempt,
+    LLM_COALESCED,
+    LLM_ADMISSION_WAIT_SECONDS,
+    LLM_ADMISSION_TIMEOUTS,
+    LLM_KEY_CONCURRENCY_LIMIT,
+    LLM_KEY_IN_FLIGHT
+)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "gemini" (default) or "fake": the deterministic offline backend in services/fake_llm.py
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+
+# --- API Key Management ---
+# Load all keys from the .env file and split them into a list
+API_KEYS = os.getenv("GOOGLE_API_KEYS", "").split(',')
+if LLM_BACKEND != "fake" and (not all(API_KEYS) or API_KEYS == ['']):
+    raise ValueError("GOOGLE_API_KEYS environment variable not set or is empty. Please check your .env file.")
+
+LLM_MODEL = "gemini-1.5-flash-latest"
+# How long a key that hit ResourceExhausted is kept at the back of the queue.
+KEY_COOLDOWN_SECONDS = float(os.getenv("LLM_KEY_COOLDOWN_SECONDS", "60"))
+
+# --- Admission control ---
+# Each key gets an AIMD concurrency limit: +1 per limit's worth of fast successes,
+# halved on ResourceExhausted, trimmed by 10% when latency climbs above
+# LLM_LATENCY_TOLERANCE x its recent floor (the key is queueing upstream).
+KEY_INITIAL_CONCURRENCY = float(os.getenv("LLM_KEY_INITIAL_CONCURRENCY", "4"))
+KEY_MAX_CONCURRENCY = float(os.getenv("LLM_KEY_MAX_CONCURRENCY", "16"))
+LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+LATENCY_EWMA_ALPHA = 0.2
+# How long a call may wait for a key with spare capacity before failing
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+# Retry-After sent with the 503 for calls that hit that deadline
+OVERLOADED_RETRY_AFTER_SECONDS = int(os.getenv("LLM_OVERLOADED_RETRY_AFTER_SECONDS", "5"))
+
+
+class LLMOverloaded(Exception):
+    """
+    No key had spare capacity before the call's queueing deadline.
+    """
+    pass
+
+
+class KeyPool:
+    """
+    Owns one ChatGoogleGenerativeAI client per (key, temperature) and one chain per
+    (prompt, key, temperature), and decides which key each call should try first.
+
+    Keys are handed out least-recently-used first, which spreads traffic round-robin
+    across healthy keys. A key that was rate-limited goes into a cool-down and is only
+    tried again before it has recovered if every other key has already failed.
+
+    Calls are admitted through acquire()/release(): a key only takes calls while it is
+    under its adaptive concurrency limit (a cooling key takes a single probe call), and
+    callers that find every key full wait in line until a slot frees up or their
+    deadline passes.
+    """
+
+    def __init__(self, keys, cooldown_seconds: float = KEY_COOLDOWN_SECONDS):
+        self.keys = keys
+        self.cooldown_seconds = cooldown_seconds
+        self._last_used = [0.0] * len(keys)
+        self._cooldown_until = [0.0] * len(keys)
+        self._limit = [KEY_INITIAL_CONCURRENCY] * len(keys)
+        self._in_flight = [0] * len(keys)
+        self._latency_ewma = [None] * len(keys)
+        self._latency_floor = [None] * len(keys)
+        self._waiters = deque()
+        self._clients = {}
+        self._chains = {}
+        for i in range(len(keys)):
+            self._publish(i)
+
+    def client(self, index: int, temperature: float):
+        cache_key = (index, temperature)
+        llm = self._clients.get(cache_key)
+        if llm is None:
+            llm = ChatGoogleGenerativeAI(
+                model=LLM_MODEL,
+                temperature=temperature,
+                google_api_key=self.keys[index]
+            )
+            self._clients[cache_key] = llm
+        return llm
+
+    def chain(self, prompt_template, index: int, temperature: float):
+        # The prompt object is stored alongside its chain so its id() can't be reused.
+        cache_key = (id(prompt_template), index, temperature)
+        entry = self._chains.get(cache_key)
+        if entry is None:
+            chain = prompt_template | self.client(index, temperature) | StrOutputParser()
+            entry = (prompt_template, chain)
+            self._chains[cache_key] = entry
+        return entry[1]
+
+    def schedule(self) -> list:
+        """
+        Returns key indexes in the order they should be tried for the next call:
+        healthy keys least-recently-used first, then cooling keys soonest-to-recover first.
+        """
+        now = time.monotonic()
+        ready = [i for i in range(len(self.keys)) if self._cooldown_until[i] <= now]
+        cooling = [i for i in range(len(self.keys)) if self._cooldown_until[i] > now]
+        ready.sort(key=lambda i: self._last_used[i])
+        cooling.sort(key=lambda i: self._cooldown_until[i])
+        return ready + cooling
+
+    def mark_used(self, index: int):
+        self._last_used[index] = time.monotonic()
+
+    def mark_throttled(self, index: int):
+        self._cooldown_until[index] = time.monotonic() + self.cooldown_seconds
+
+    def mark_healthy(self, index: int):
+        self._cooldown_until[index] = 0.0
+
+    def _publish(self, index: int):
+        LLM_KEY_CONCURRENCY_LIMIT.set(round(self._limit[index], 2), key=index + 1)
+        LLM_KEY_IN_FLIGHT.set(self._in_flight[index], key=index + 1)
+
+    def _pick(self, exclude) -> int:
+        """
+        The first healthy key under its limit. Cooling keys are only considered once
+        every healthy key has been tried by this call, and then one probe call at a time.
+        """
+        now = time.monotonic()
+        candidates = [i for i in self.schedule() if i not in exclude]
+        healthy = [i for i in candidates if self._cooldown_until[i] <= now]
+        for i in healthy:
+            if self._in_flight[i] < max(1, int(self._limit[i])):
+                return i
+        if healthy:
+            return None
+        for i in candidates:
+            if self._in_flight[i] == 0:
+                return i
+        return None
+
+    async def acquire(self, exclude=(), deadline: float = None) -> int:
+        """
+        Reserves a slot on the best key not in `exclude` (in schedule() order) and returns
+        its index, waiting while every candidate is at its limit. Raises LLMOverloaded at
+        `deadline` (a time.monotonic() value).
+        """
+        while True:
+            index = self._pick(exclude)
+            if index is not None:
+                self._in_flight[index] += 1
+                self.mark_used(index)
+                self._publish(index)
+                return index
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise LLMOverloaded("Every Gemini key is at its concurrency limit; try again shortly.")
+            # Wake up on a release, when a cooling key recovers, or at the deadline
+            timeout = min(
+                [t - now for t in self._cooldown_until if t > now] + [deadline - now if deadline is not None else 1.0]
+            )
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), max(timeout, 0.01))
+            except TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self, index: int, outcome: str, seconds: float):
+        """
+        Frees the slot taken by acquire() and adapts the key's limit: "throttled" halves
+        it and starts the cool-down, "success" grows it unless latency is inflated, and
+        other errors leave it alone.
+        """
+        self._in_flight[index] -= 1
+        if outcome == "throttled":
+            self._limit[index] = max(1.0, self._limit[index] / 2)
+            self.mark_throttled(index)
+        elif outcome == "success":
+            self.mark_healthy(index)
+            ewma = self._latency_ewma[index]
+            ewma = seconds if ewma is None else (1 - LATENCY_EWMA_ALPHA) * ewma + LATENCY_EWMA_ALPHA * seconds
+            self._latency_ewma[index] = ewma
+            # The floor drifts up 1% per call so it follows a slower model or longer prompts
+            floor = self._latency_floor[index]
+            floor = self._latency_floor[index] = ewma if floor is None else min(floor * 1.01, ewma)
+            if ewma > LATENCY_TOLERANCE * floor:
+                self._limit[index] = max(1.0, self._limit[index] * 0.9)
+            else:
+                self._limit[index] = min(KEY_MAX_CONCURRENCY, self._limit[index] + 1 / self._limit[index])
+        self._publish(index)
+        # Waiters re-check for themselves; some may be excluded from this key
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+key_pool = KeyPool(API_KEYS)
+
+
+# --- Resilient LLM Invoker with Key Scheduling ---
+def _prompt_tokens(prompt_template, input_data) -> int:
+    try:
+        return estimate_tokens(prompt_template.format(**input_data))
+    except (KeyError, ValueError, TypeError):
+        return 0
+
+
+async def _admit(agent: str, tried: set, deadline: float) -> int:
+    started = time.perf_counter()
+    try:
+        return await key_pool.acquire(exclude=tried, deadline=deadline)
+    except LLMOverloaded:
+        LLM_ADMISSION_TIMEOUTS.inc(agent=agent)
+        raise
+    finally:
+        LLM_ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, agent=agent)
+
+
+async def _invoke_with_key_rotation(prompt_template, input_data, temperature: float, agent: str, call: dict):
+    deadline = time.monotonic() + QUEUE_TIMEOUT_SECONDS
+    tried = set()
+    for attempt in range(len(key_pool.keys)):
+        is_last = attempt == len(key_pool.keys) - 1
+        # Each retry goes to a key this call hasn't tried yet
+        i = await _admit(agent, tried, deadline)
+        tried.add(i)
+        call["attempts"] += 1
+        outcome, started = "error", time.monotonic()
+        try:
+            chain = key_pool.chain(prompt_template, i, temperature)
+            print(f"--- Attempting API call with Key #{i + 1} ---")
+            response = await chain.ainvoke(input_data)
+            print(f"--- Key #{i + 1} succeeded. ---")
+            outcome = "success"
+            record_key_attempt(agent, i, "success")
+            return response
+
+        except ResourceExhausted:
+            outcome = "throttled"
+            record_key_attempt(agent, i, "throttled")
+            print(f"Warning: API Key #{i + 1} is rate-limited or exhausted. Cooling it down for {key_pool.cooldown_seconds:.0f}s and trying next key...")
+            if is_last:
+                print("Error: All API keys are exhausted.")
+                raise
+        except Exception as e:
+            # Handle other potential errors (e.g., an invalid key format)
+            record_key_attempt(agent, i, "error")
+            print(f"An unexpected error occurred with Key #{i + 1}: {e}")
+            if is_last:
+                raise
+        finally:
+            key_pool.release(i, outcome, time.monotonic() - started)
+
+    # This line should ideally not be reached, but is a fallback.
+    raise Exception("All API keys failed to generate a response.")
+
+
+# Coalescing key -> the upstream call that identical concurrent requests share
+_in_flight_calls = {}
+
+
+class _SharedCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+def _coalescing_key(prompt_template, input_data, temperature: float) -> str:
+    return dumps_canonical([prompt_template.template, input_data, temperature])
+
+
+async def invoke_llm_with_retry(prompt_template, input_data, temperature: float = 0.7, agent: str = "unknown"):
+    """
+    Invokes `prompt_template | Gemini | StrOutputParser` using the pooled clients.
+    Keys are tried in the order chosen by the KeyPool; if a key is rate-limited
+    (ResourceExhausted) it is put into cool-down and the next key is tried.
+    `agent` labels the call's metrics and trace span.
+
+    Identical calls (same prompt, input and temperature) that overlap in time share
+    one upstream call. The shared call is only cancelled once every caller has gone.
+    """
+    key = _coalescing_key(prompt_template, input_data, temperature)
+    shared = _in_flight_calls.get(key)
+    if shared is None:
+        shared = _in_flight_calls[key] = _SharedCall(asyncio.ensure_future(
+            _invoke_llm(prompt_template, input_data, temperature, agent)
+        ))
+        shared.task.add_done_callback(
+            lambda _: _in_flight_calls.pop(key, None) if _in_flight_calls.get(key) is shared else None
+        )
+    else:
+        LLM_COALESCED.inc(agent=agent)
+    shared.waiters += 1
+    try:
+        return await asyncio.shield(shared.task)
+    finally:
+        shared.waiters -= 1
+        if shared.waiters == 0 and not shared.task.done():
+            shared.task.cancel()
+
+
+async def _invoke_llm(prompt_template, input_data, temperature: float, agent: str):
+    call = {"attempts": 0}
+    outcome, response = "error", None
+    started = time.perf_counter()
+    try:
+        if LLM_BACKEND == "fake":
+            call["attempts"] = 1
+            response = await fake_llm.ainvoke(prompt_template, input_data, temperature)
+        else:
+            response = await _invoke_with_key_rotation(prompt_template, input_data, temperature, agent, call)
+        outcome = "success"
+        return response
+    finally:
+        seconds = time.perf_counter() - started
+        add_span(f"llm-{agent}", seconds)
+        record_llm_call(
+            agent, seconds, outcome,
+            prompt_tokens=_prompt_tokens(prompt_template, input_data),
+            completion_tokens=estimate_tokens(response) if response else 0,
+            attempts=call["attempts"]
+        )
+
+
+async def _stream_with_key_rotation(prompt_template, input_data, temperature: float, agent: str, call: dict):
+    deadline = time.monotonic() + QUEUE_TIMEOUT_SECONDS
+    tried = set()
+    for attempt in range(len(key_pool.keys)):
+        is_last = attempt == len(key_pool.keys) - 1
+        i = await _admit(agent, tried, deadline)
+        tried.add(i)
+        call["attempts"] += 1
+        started = False
+        # A stream's latency signal is the time to its first chunk
+        outcome, requested, first_chunk_seconds = "error", time.monotonic(), None
+        try:
+            chain = key_pool.chain(prompt_template, i, temperature)
+            print(f"--- Attempting streaming API call with Key #{i + 1} ---")
+            async for chunk in chain.astream(input_data):
+                if not started:
+                    first_chunk_seconds = time.monotonic() - requested
+                started = True
+                yield chunk
+            print(f"--- Key #{i + 1} succeeded. ---")
+            outcome = "success"
+            record_key_attempt(agent, i, "success")
+            return
+
+        except ResourceExhausted:
+            outcome = "throttled"
+            record_key_attempt(agent, i, "throttled")
+            if started:
+                raise
+            print(f"Warning: API Key #{i + 1} is rate-limited or exhausted. Cooling it down for {key_pool.cooldown_seconds:.0f}s and trying next key...")
+            if is_last:
+                print("Error: All API keys are exhausted.")
+                raise
+        except Exception as e:
+            record_key_attempt(agent, i, "error")
+            if started:
+                raise
+            print(f"An unexpected error occurred with Key #{i + 1}: {e}")
+            if is_last:
+                raise
+        finally:
+            seconds = first_chunk_seconds if first_chunk_seconds is not None else time.monotonic() - requested
+            key_pool.release(i, outcome, seconds)
+
+    raise Exception("All API keys failed to generate a response.")
+
+
+async def stream_llm_with_retry(prompt_template, input_data, temperature: float = 0.7, agent: str = "unknown"):
+    """
+    Streaming counterpart of invoke_llm_with_retry: yields text chunks from `chain.astream`.
+    Keys are only switched before the first chunk arrives; a failure mid-stream is re-raised,
+    since the caller has already forwarded part of the answer.
+    """
+    call = {"attempts": 0}
+    outcome, completion_chars = "error", 0
+    started = time.perf_counter()
+    try:
+        if LLM_BACKEND == "fake":
+            call["attempts"] = 1
+            chunks = fake_llm.astream(prompt_template, input_data, temperature)
+        else:
+            chunks = _stream_with_key_rotation(prompt_template, input_data, temperature, agent, call)
+        async for chunk in chunks:
+            completion_chars += len(chunk)
+            yield chunk
+        outcome = "success"
+    finally:
+        seconds = time.perf_counter() - started
+        add_span(f"llm-{agent}", seconds)
+        record_llm_call(
+            agent, seconds, outcome,
+            prompt_tokens=_prompt_tokens(prompt_template, input_data),
+            completion_tokens=math.ceil(completion_chars / CHARS_PER_TOKEN),
+            attempts=call["attempts"]
+        )
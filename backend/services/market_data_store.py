@@ -0,0 +1,104 @@
+# backend/services/market_data_store.py
+# Process-wide, hot-reloadable cache of market_stats.json.
+
+import os
+import time
+import hashlib
+import threading
+from services.serialization import loads
+
+MARKET_STATS_PATH = os.getenv("MARKET_STATS_PATH", "market_stats.json")
+# How often (in seconds) get() is allowed to stat the file looking for a newer version.
+MARKET_STATS_POLL_SECONDS = float(os.getenv("MARKET_STATS_POLL_SECONDS", "5"))
+
+
+class MarketSnapshot:
+    """
+    One immutable version of market_stats.json.
+    `stats` is shared by every request that holds this snapshot and must be treated as read-only.
+    """
+    __slots__ = ("stats", "version", "source_path", "loaded_at")
+
+    def __init__(self, stats: dict, version: str, source_path: str):
+        self.stats = stats
+        self.version = version
+        self.source_path = source_path
+        self.loaded_at = time.time()
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "source_path": self.source_path,
+            "loaded_at": self.loaded_at,
+            "generated_on": self.stats.get("metadata", {}).get("generated_on"),
+        }
+
+
+class MarketDataStore:
+    """
+    Loads market_stats.json once and swaps in a new snapshot when the file changes on
+    disk (mtime polling) or when reload() is called.
+
+    Readers always get a complete snapshot: a new one is only published after the file has
+    been read and parsed successfully, and publishing is a single reference assignment.
+    """
+
+    def __init__(self, path: str = MARKET_STATS_PATH, poll_seconds: float = MARKET_STATS_POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self._snapshot = None
+        self._file_signature = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def reload(self, force: bool = True) -> MarketSnapshot:
+        """
+        Re-reads the file and publishes a new snapshot. If the file is missing or cannot be
+        parsed (e.g. it is being rewritten right now) the previous snapshot stays in place.
+        """
+        with self._reload_lock:
+            try:
+                signature = self._signature()
+                if not force and signature == self._file_signature and self._snapshot is not None:
+                    return self._snapshot
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                stats = loads(raw)
+            except (OSError, ValueError) as e:
+                if self._snapshot is None:
+                    raise
+                print(f"Warning: could not reload {self.path} ({e}). Keeping market data version {self._snapshot.version}.")
+                return self._snapshot
+
+            version = hashlib.sha256(raw).hexdigest()[:12]
+            if self._snapshot is None or version != self._snapshot.version:
+                self._snapshot = MarketSnapshot(stats, version, self.path)
+                print(f"Loaded market data from {self.path} (version {version}).")
+            self._file_signature = signature
+            self._last_check = time.monotonic()
+            return self._snapshot
+
+    def get(self) -> MarketSnapshot:
+        """
+        Returns the current snapshot, loading it on first use and checking the file's
+        mtime at most once every `poll_seconds`.
+        """
+        if self._snapshot is None:
+            return self.reload()
+        if time.monotonic() - self._last_check >= self.poll_seconds:
+            self._last_check = time.monotonic()
+            try:
+                changed = self._signature() != self._file_signature
+            except OSError:
+                changed = False
+            if changed:
+                return self.reload(force=False)
+        return self._snapshot
+
+
+# Shared by the whole process; main.py loads it at startup.
+market_data_store = MarketDataStore()
@@ -0,0 +1,142 @@
+# backend/services/monte_carlo.py
+# Monte Carlo goal probabilities: correlated multi-asset GBM paths for a plan's asset_allocation.
+
+import os
+import numpy as np
+from services.plan_engine import parse_percent, compute_financial_metrics, CASH_RETURN_PERCENT
+
+MONTE_CARLO_PATHS = int(os.getenv("MONTE_CARLO_PATHS", "10000"))
+MONTE_CARLO_MAX_PATHS = 50000
+# Paths are simulated in blocks so a 50k-path, 40-year run stays within a few hundred MB
+MONTE_CARLO_BLOCK_PATHS = 4096
+MAX_HORIZON_YEARS = 100
+
+
+def _nearest_correlation_cholesky(corr: np.ndarray) -> np.ndarray:
+    """
+    Cholesky factor of a correlation matrix. Rounded or hand-edited matrices can be
+    slightly indefinite, in which case negative eigenvalues are clipped first.
+    """
+    try:
+        return np.linalg.cholesky(corr)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(corr)
+        fixed = eigenvectors @ np.diag(np.clip(eigenvalues, 1e-8, None)) @ eigenvectors.T
+        scale = np.sqrt(np.diag(fixed))
+        fixed = fixed / np.outer(scale, scale)
+        return np.linalg.cholesky(fixed + np.eye(len(fixed)) * 1e-10)
+
+
+def asset_parameters(market_stats: dict, assets: list):
+    """
+    Annual expected return, annual volatility and the correlation matrix for `assets`,
+    taken from market_stats.json. Assets with no market data (e.g. cash) get the cash
+    rate, zero volatility and zero correlation.
+    """
+    asset_stats = market_stats.get('asset_stats', {})
+    correlations = market_stats.get('correlations', {})
+
+    mu = np.full(len(assets), CASH_RETURN_PERCENT / 100)
+    sigma = np.zeros(len(assets))
+    corr = np.eye(len(assets))
+    for i, asset in enumerate(assets):
+        stats = asset_stats.get(asset)
+        if stats and stats.get('avg_annual_return_percent') is not None:
+            mu[i] = stats['avg_annual_return_percent'] / 100
+            sigma[i] = (stats.get('annual_volatility_percent') or 0) / 100
+        for j, other in enumerate(assets):
+            value = correlations.get(asset, {}).get(other)
+            if i != j and value is not None:
+                corr[i, j] = value
+    # Only keep correlations where both assets are actually random
+    random_assets = sigma > 0
+    corr[~random_assets, :] = np.eye(len(assets))[~random_assets, :]
+    corr[:, ~random_assets] = np.eye(len(assets))[:, ~random_assets]
+    return mu, sigma, corr
+
+
+def simulate_goal_probabilities(
+    asset_allocation: dict,
+    market_stats: dict,
+    initial_investment: float,
+    monthly_contribution: float,
+    goals: list,
+    n_paths: int = MONTE_CARLO_PATHS,
+    seed=None,
+) -> dict:
+    """
+    Probability of reaching each goal's target_amount at any point within its timeline_years.
+
+    Monthly log-returns for every asset are drawn jointly as a (paths x months x assets)
+    array, correlated through the Cholesky factor of the market correlation matrix, and
+    combined into a portfolio that is rebalanced to `asset_allocation` every month with
+    `monthly_contribution` added at each month end.
+    """
+    assets = list(asset_allocation.keys())
+    weights = np.array([parse_percent(asset_allocation[a]) for a in assets])
+    if not assets or weights.sum() <= 0:
+        # Nothing allocated: treat the whole portfolio as cash
+        assets, weights = ['cash'], np.array([1.0])
+    weights = weights / weights.sum()
+
+    mu, sigma, corr = asset_parameters(market_stats, assets)
+    chol = _nearest_correlation_cholesky(corr).astype(np.float32)
+    # GBM with E[annual growth] = 1 + mu
+    monthly_drift = ((np.log1p(np.maximum(mu, -0.99)) - 0.5 * sigma ** 2) / 12).astype(np.float32)
+    monthly_vol = (sigma / np.sqrt(12)).astype(np.float32)
+
+    horizons = np.array([
+        min(max(int(round(goal['timeline_years'] * 12)), 1), MAX_HORIZON_YEARS * 12) for goal in goals
+    ], dtype=int)
+    targets = np.array([goal['target_amount'] for goal in goals], dtype=float)
+    hits = np.zeros(len(goals))
+    n_paths = max(1, min(int(n_paths), MONTE_CARLO_MAX_PATHS))
+
+    if len(goals):
+        rng = np.random.default_rng(seed)
+        n_months = int(horizons.max())
+        for start in range(0, n_paths, MONTE_CARLO_BLOCK_PATHS):
+            block = min(MONTE_CARLO_BLOCK_PATHS, n_paths - start)
+            shocks = rng.standard_normal((block, n_months, len(assets)), dtype=np.float32)
+            log_returns = monthly_drift + (shocks @ chol.T) * monthly_vol
+            portfolio_growth = np.exp(log_returns) @ weights.astype(np.float32)
+
+            # W_t = W_{t-1} * g_t + c  =>  W_t = G_t * (W_0 + c * sum_{s<=t} 1 / G_s)
+            growth_index = np.cumprod(portfolio_growth, axis=1, dtype=np.float64)
+            wealth = growth_index * (initial_investment + monthly_contribution * np.cumsum(1.0 / growth_index, axis=1))
+            peak_wealth = np.maximum.accumulate(wealth, axis=1)
+            hits += (peak_wealth[:, horizons - 1] >= targets).sum(axis=0)
+
+    probabilities = np.where(initial_investment >= targets, 1.0, hits / n_paths)
+    return {
+        goal['name']: round(float(p), 4)
+        for goal, p in zip(goals, probabilities)
+    }
+
+
+def simulate_plan_goal_probabilities(user_profile: dict, generated_plan: dict, market_stats: dict,
+                                     n_paths: int = MONTE_CARLO_PATHS, seed=None) -> dict:
+    """
+    Runs simulate_goal_probabilities for every sub-plan (sentinel_plan, voyager_plan, ...)
+    that has an asset_allocation, funding it with the user's investable assets and
+    monthly savings potential.
+    """
+    metrics = compute_financial_metrics(user_profile)
+    results = {}
+    for plan_name, sub_plan in generated_plan.items():
+        if not isinstance(sub_plan, dict) or not isinstance(sub_plan.get('asset_allocation'), dict):
+            continue
+        results[plan_name] = simulate_goal_probabilities(
+            asset_allocation=sub_plan['asset_allocation'],
+            market_stats=market_stats,
+            initial_investment=metrics['investable_assets'],
+            monthly_contribution=metrics['monthly_savings_potential'],
+            goals=user_profile['goals'],
+            n_paths=n_paths,
+            seed=seed,
+        )
+    return {
+        "goal_probabilities": results,
+        "n_paths": max(1, min(int(n_paths), MONTE_CARLO_MAX_PATHS)),
+        "seed": seed,
+    }
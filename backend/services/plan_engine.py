@@ -0,0 +1,223 @@
+# backend/services/plan_engine.py
+# Deterministic financial arithmetic for the planning agents: ratios, blended returns and goal timelines.
+
+import math
+import numpy as np
+
+# market_stats.json has no cash series; cash is assumed to earn the same risk-free
+# rate data_preprocessor uses for Sharpe ratios.
+CASH_RETURN_PERCENT = 3.5
+
+
+def project_goal_timeline(target_amount, initial_investment, monthly_contribution, annual_return_rate):
+    """
+    Calculates the number of years to reach a financial goal.
+    """
+    if monthly_contribution <= 0 and initial_investment < target_amount:
+        return float('inf')
+
+    if annual_return_rate <= 0:
+        if monthly_contribution <= 0:
+            return float('inf')
+        # Avoid division by zero if target is already met
+        if (target_amount - initial_investment) <= 0:
+            return 0.0
+        return (target_amount - initial_investment) / (monthly_contribution * 12)
+
+    monthly_rate = (1 + annual_return_rate) ** (1/12) - 1
+
+    if abs(monthly_rate) < 1e-9: # Handles cases where annual_return_rate is extremely small
+        if monthly_contribution <= 0:
+            return float('inf')
+        if (target_amount - initial_investment) <= 0:
+            return 0.0
+        return (target_amount - initial_investment) / (monthly_contribution * 12)
+
+    # Formula for number of periods (months) in an annuity
+    # n = log( (FV*r + PMT) / (P*r + PMT) ) / log(1+r)
+    try:
+        # We add a small epsilon to avoid log(0) if PMT is 0 and FV equals P
+        numerator = math.log((target_amount * monthly_rate + monthly_contribution + 1e-9))
+        denominator = math.log((initial_investment * monthly_rate + monthly_contribution + 1e-9))
+        log_1_plus_r = math.log(1 + monthly_rate)
+
+        if log_1_plus_r == 0: # Should be caught by earlier check, but as a safeguard
+             return float('inf')
+
+        months = (numerator - denominator) / log_1_plus_r
+    except (ValueError, ZeroDivisionError):
+        # Fallback to iteration if formula fails (e.g., due to negative logs)
+        current_value = float(initial_investment)
+        months = 0
+        while current_value < target_amount:
+            interest = current_value * monthly_rate
+            current_value += interest + monthly_contribution
+            months += 1
+            if months > 1200: # 100 years
+                return float('inf')
+        return round(months / 12, 1)
+
+    return round(months / 12, 1)
+
+
+def project_goal_timelines(targets, initials, contributions, rates, allow_negative_rates: bool = False):
+    """
+    Vectorized project_goal_timeline. The four arguments are broadcast against each
+    other (scalars, lists or NumPy arrays), so a whole grid of goals, contributions and
+    rates is solved in one pass. Returns a float array of years with np.inf where a goal
+    is never reached, matching the scalar function to within its 0.1-year rounding.
+
+    With allow_negative_rates, rates between -100% and 0 (e.g. real returns when
+    inflation outpaces the portfolio) use the same closed form instead of straight-line
+    saving: the balance then levels off at contribution / |monthly rate|, and goals
+    above that level are never reached.
+    """
+    targets, initials, contributions, rates = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (targets, initials, contributions, rates))
+    )
+    years = np.full(targets.shape, np.inf)
+
+    # No contributions and not there yet
+    never = (contributions <= 0) & (initials < targets)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        compounding = (rates > 0) | (allow_negative_rates & (rates < 0) & (rates > -1))
+        monthly_rates = np.where(compounding, (1 + np.where(compounding, rates, 0.0)) ** (1/12) - 1, 0.0)
+
+        # Zero, negative (unless allowed) and negligible rates: straight-line saving
+        linear = ~never & (~compounding | (np.abs(monthly_rates) < 1e-9))
+        gap = targets - initials
+        linear_years = np.where(gap <= 0, 0.0, gap / (contributions * 12))
+        linear_ok = linear & (contributions > 0)
+        years[linear_ok] = linear_years[linear_ok]
+
+        # Positive rates: closed-form annuity solution
+        compound = ~never & ~linear
+        numerator_arg = targets * monthly_rates + contributions + 1e-9
+        denominator_arg = initials * monthly_rates + contributions + 1e-9
+        solvable = compound & (numerator_arg > 0) & (denominator_arg > 0)
+        months = (np.log(numerator_arg) - np.log(denominator_arg)) / np.log(1 + monthly_rates)
+        years[solvable] = np.round(months[solvable] / 12, 1)
+
+    # Where the logs are undefined the balance can only shrink, so the goal is reached
+    # immediately or never (what the scalar function's month-by-month fallback finds).
+    unsolvable = compound & ~solvable
+    years[unsolvable] = np.where(initials[unsolvable] >= targets[unsolvable], 0.0, np.inf)
+    return years
+
+
+def format_timeline_years(years: float) -> str:
+    # The dashboard renders these as "<value> years"
+    return "More than 100" if math.isinf(years) else f"{years}"
+
+
+def parse_percent(value) -> float:
+    """
+    Parses an allocation value such as "30%", "30", 30 or "12.5 %" into a fraction (0.3).
+    Anything unparseable counts as 0.
+    """
+    if isinstance(value, (int, float)):
+        return float(value) / 100
+    try:
+        return float(str(value).replace('%', '').strip()) / 100
+    except ValueError:
+        return 0.0
+
+
+# --- Profile metrics (what the analyst used to calculate by hand) ---
+def compute_financial_metrics(user_profile: dict) -> dict:
+    income = float(user_profile['monthly_income'])
+    expenses = float(user_profile['monthly_expenses'])
+    emi = float(user_profile['liabilities']['loans_emi'])
+    assets = user_profile['assets']
+
+    monthly_savings = income - expenses - emi
+    savings_rate = (monthly_savings / income) * 100 if income > 0 else None
+    dti = (emi / income) * 100 if income > 0 else None
+    emergency_months = float(assets['cash_equivalents']) / expenses if expenses > 0 else None
+
+    return {
+        "monthly_savings_potential": round(monthly_savings, 2),
+        "savings_rate_percent": round(savings_rate, 2) if savings_rate is not None else None,
+        "debt_to_income_percent": round(dti, 2) if dti is not None else None,
+        "emergency_fund_coverage_months": round(emergency_months, 1) if emergency_months is not None else None,
+        "investable_assets": round(float(assets['equity_investments']) + float(assets.get('other_investments', 0)), 2),
+        "high_interest_debt": float(user_profile['liabilities']['high_interest_debt']),
+    }
+
+
+# --- Market returns ---
+def asset_class_returns(market_stats: dict) -> dict:
+    """
+    Expected annual return (as a fraction) per asset class, from avg_annual_return_percent.
+    """
+    returns = {
+        asset: stats['avg_annual_return_percent'] / 100
+        for asset, stats in market_stats.get('asset_stats', {}).items()
+        if stats.get('avg_annual_return_percent') is not None
+    }
+    returns.setdefault('cash', CASH_RETURN_PERCENT / 100)
+    return returns
+
+
+def blended_return(asset_allocation: dict, returns: dict) -> float:
+    """
+    Weighted annual return of an allocation like {"equities": "60%", "bonds": "40%"}.
+    Asset classes without market data are treated as cash.
+    """
+    cash_return = returns.get('cash', CASH_RETURN_PERCENT / 100)
+    return sum(
+        parse_percent(weight) * returns.get(asset, cash_return)
+        for asset, weight in asset_allocation.items()
+    )
+
+
+def project_plan_timelines(user_profile: dict, asset_allocation: dict, returns: dict) -> dict:
+    """
+    Years to reach each goal if all monthly savings go into `asset_allocation`.
+    """
+    metrics = compute_financial_metrics(user_profile)
+    rate = blended_return(asset_allocation, returns)
+    return {
+        goal['name']: format_timeline_years(project_goal_timeline(
+            target_amount=float(goal['target_amount']),
+            initial_investment=metrics['investable_assets'],
+            monthly_contribution=metrics['monthly_savings_potential'],
+            annual_return_rate=rate
+        ))
+        for goal in user_profile['goals']
+    }
+
+
+def apply_projected_timelines(plan: dict, user_profile: dict, market_stats: dict) -> dict:
+    """
+    Overwrites projected_goal_timeline_years in every sub-plan with values computed
+    from the sub-plan's own asset_allocation. The plan is modified in place and returned.
+    """
+    returns = asset_class_returns(market_stats)
+    for sub_plan in plan.values():
+        if isinstance(sub_plan, dict) and isinstance(sub_plan.get('asset_allocation'), dict):
+            sub_plan['projected_goal_timeline_years'] = project_plan_timelines(
+                user_profile, sub_plan['asset_allocation'], returns
+            )
+    return plan
+
+
+def format_metrics_for_prompt(metrics: dict, returns: dict) -> str:
+    """
+    Plain-text block of precomputed numbers for the analyst and writer prompts.
+    """
+    def fmt(value, suffix=""):
+        return "n/a" if value is None else f"{value}{suffix}"
+
+    lines = [
+        f"Monthly Savings Potential: {fmt(metrics['monthly_savings_potential'])}",
+        f"Savings Rate: {fmt(metrics['savings_rate_percent'], '%')}",
+        f"Debt-to-Income (DTI) Ratio: {fmt(metrics['debt_to_income_percent'], '%')}",
+        f"Emergency Fund Coverage: {fmt(metrics['emergency_fund_coverage_months'], ' months')}",
+        f"Investable Assets (equity + other investments): {fmt(metrics['investable_assets'])}",
+        "Expected Annual Return by Asset Class: " + ", ".join(
+            f"{asset} {round(rate * 100, 2)}%" for asset, rate in returns.items()
+        ),
+    ]
+    return "\n".join(lines)
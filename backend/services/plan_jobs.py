@@ -0,0 +1,463 @@
+# backend/services/plan_jobs.py
+# Asynchronous plan generation: submitted profiles become jobs that a bounded worker pool runs in the background.
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from services.response_cache import cache_key, normalize_profile
+from services.langchain_service import generate_plan_with_assembly_line, finalize_plan
+from services.instrumentation import registry
+from services.serialization import dumps, loads
+
+PLAN_JOB_STORE = os.getenv("PLAN_JOB_STORE", "memory")  # "memory" or "sqlite"
+PLAN_JOB_DATABASE_URL = os.getenv("PLAN_JOB_DATABASE_URL", "sqlite:///plan_jobs.sqlite3")
+PLAN_JOB_WORKERS = int(os.getenv("PLAN_JOB_WORKERS", "4"))
+# Jobs one tenant may have running at once; the rest wait while other tenants' jobs go ahead
+PLAN_JOB_TENANT_CONCURRENCY = int(os.getenv("PLAN_JOB_TENANT_CONCURRENCY", "2"))
+# Queued jobs beyond this are rejected instead of piling up
+PLAN_JOB_MAX_QUEUED = int(os.getenv("PLAN_JOB_MAX_QUEUED", "1000"))
+PLAN_JOB_TIMEOUT_SECONDS = float(os.getenv("PLAN_JOB_TIMEOUT_SECONDS", "300"))
+# How long finished jobs (and their results) are kept and reused for duplicate submissions
+PLAN_JOB_RETENTION_SECONDS = float(os.getenv("PLAN_JOB_RETENTION_SECONDS", "86400"))
+PLAN_JOB_PURGE_INTERVAL_SECONDS = 60.0
+# Unfinished jobs are leased to the process that queued them. It renews the lease while
+# it is alive; once a lease lapses (the process died) any process sharing the store
+# fails the job. The id must be unique among live processes (default: host:pid).
+PLAN_JOB_INSTANCE_ID = os.getenv("PLAN_JOB_INSTANCE_ID", "")
+PLAN_JOB_LEASE_SECONDS = float(os.getenv("PLAN_JOB_LEASE_SECONDS", "60"))
+PLAN_JOB_LEASE_RENEW_SECONDS = PLAN_JOB_LEASE_SECONDS / 4
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+ORPHANED_ERROR = "The job was interrupted by a server restart."
+
+PLAN_JOBS = registry.counter(
+    "finpilot_plan_jobs_total", "Plan job submissions and outcomes.", ("outcome",))
+PLAN_JOB_GAUGES = {
+    "queued": registry.gauge("finpilot_plan_jobs_queued", "Plan jobs waiting for a worker in this process."),
+    "running": registry.gauge("finpilot_plan_jobs_running", "Plan jobs running in this process."),
+    "workers": registry.gauge("finpilot_plan_job_workers", "Plan job workers in this process."),
+}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def dedup_key(tenant: str, user_profile: dict, idempotency_key: str = None) -> str:
+    """
+    Jobs with the same key share one run: the client's Idempotency-Key when given,
+    otherwise a hash of the normalized profile. Keys are scoped to the tenant.
+    """
+    if idempotency_key:
+        return f"{tenant}:key:{idempotency_key}"
+    return f"{tenant}:profile:{cache_key('plan-job', {'profile': normalize_profile(user_profile)})}"
+
+
+def _new_job(tenant: str, key: str, user_profile: dict, owner: str) -> dict:
+    now = time.time()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "tenant": tenant,
+        "dedup_key": key,
+        "status": QUEUED,
+        "user_profile": user_profile,
+        "result": None,
+        "error": None,
+        "owner": owner,
+        "lease_expires_at": now + PLAN_JOB_LEASE_SECONDS,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+# --- Stores ---
+class MemoryJobStore:
+    """
+    Jobs in a dict, with a dedup_key -> job_id index.
+    """
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: dict):
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+            self._by_key[job["dedup_key"]] = job["job_id"]
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def find_reusable(self, key: str):
+        """
+        The latest job for `key` unless it failed (a failed job may be retried).
+        """
+        with self._lock:
+            job = self._jobs.get(self._by_key.get(key))
+            if job is None or job["status"] == FAILED:
+                return None
+            return dict(job)
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def renew_leases(self, owner: str, expires_at: float):
+        with self._lock:
+            for job in self._jobs.values():
+                if job["owner"] == owner and job["status"] not in FINISHED_STATUSES:
+                    job["lease_expires_at"] = expires_at
+
+    def fail_orphaned(self, error: str, now: float, owner: str = None):
+        """
+        Fails unfinished jobs whose lease has lapsed, plus (after a restart) any still
+        held by `owner`.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] not in FINISHED_STATUSES and (
+                    job["owner"] == owner or job["lease_expires_at"] < now
+                ):
+                    job.update(status=FAILED, error=error, updated_at=time.time())
+
+    def purge(self, finished_before: float):
+        with self._lock:
+            for job_id in list(self._jobs):
+                job = self._jobs[job_id]
+                if job["status"] not in FINISHED_STATUSES or job["updated_at"] >= finished_before:
+                    continue
+                del self._jobs[job_id]
+                if self._by_key.get(job["dedup_key"]) == job_id:
+                    del self._by_key[job["dedup_key"]]
+
+
+class SQLAlchemyJobStore:
+    """
+    Jobs in a database table (SQLite by default), so results survive restarts and can be
+    polled through any worker process that shares the database. Each process runs only
+    the jobs it queued; leases tell live processes' jobs from orphaned ones.
+    """
+
+    def __init__(self, url: str = PLAN_JOB_DATABASE_URL):
+        # Imported here so the in-memory store works without SQLAlchemy installed
+        import sqlalchemy as sa
+
+        self.engine = sa.create_engine(url, future=True)
+        if self.engine.dialect.name == "sqlite":
+            # Status updates are small and frequent; WAL keeps them from waiting on fsync
+            @sa.event.listens_for(self.engine, "connect")
+            def _sqlite_pragmas(dbapi_connection, _):
+                dbapi_connection.execute("PRAGMA journal_mode=WAL")
+                dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+        metadata = sa.MetaData()
+        self.table = sa.Table(
+            "plan_jobs", metadata,
+            sa.Column("job_id", sa.String(32), primary_key=True),
+            sa.Column("tenant", sa.String(128), nullable=False),
+            sa.Column("dedup_key", sa.String(256), nullable=False, index=True),
+            sa.Column("status", sa.String(16), nullable=False),
+            sa.Column("user_profile", sa.Text, nullable=False),
+            sa.Column("result", sa.Text),
+            sa.Column("error", sa.Text),
+            sa.Column("owner", sa.String(256)),
+            sa.Column("lease_expires_at", sa.Float),
+            sa.Column("created_at", sa.Float, nullable=False),
+            sa.Column("updated_at", sa.Float, nullable=False, index=True),
+        )
+        metadata.create_all(self.engine)
+        # Tables created before jobs were leased lack the lease columns
+        existing = {column["name"] for column in sa.inspect(self.engine).get_columns("plan_jobs")}
+        with self.engine.begin() as conn:
+            for column in ("owner", "lease_expires_at"):
+                if column not in existing:
+                    column_type = self.table.c[column].type.compile(dialect=self.engine.dialect)
+                    conn.execute(sa.text(f"ALTER TABLE plan_jobs ADD COLUMN {column} {column_type}"))
+
+    @staticmethod
+    def _to_row(job: dict) -> dict:
+        row = dict(job)
+        for column in ("user_profile", "result"):
+            if column in row and row[column] is not None:
+                row[column] = dumps(row[column]).decode()
+        return row
+
+    @staticmethod
+    def _from_row(row) -> dict:
+        job = dict(row._mapping)
+        for column in ("user_profile", "result"):
+            if job[column] is not None:
+                job[column] = loads(job[column])
+        return job
+
+    def add(self, job: dict):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert().values(**self._to_row(job)))
+
+    def get(self, job_id: str):
+        with self.engine.connect() as conn:
+            row = conn.execute(self.table.select().where(self.table.c.job_id == job_id)).first()
+        return self._from_row(row) if row is not None else None
+
+    def find_reusable(self, key: str):
+        t = self.table
+        query = (
+            t.select()
+            .where(t.c.dedup_key == key, t.c.status != FAILED)
+            .order_by(t.c.created_at.desc())
+            .limit(1)
+        )
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+        return self._from_row(row) if row is not None else None
+
+    def update(self, job_id: str, **fields):
+        values = self._to_row({**fields, "updated_at": time.time()})
+        with self.engine.begin() as conn:
+            conn.execute(self.table.update().where(self.table.c.job_id == job_id).values(**values))
+
+    def renew_leases(self, owner: str, expires_at: float):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                t.update()
+                .where(t.c.owner == owner, t.c.status.notin_(FINISHED_STATUSES))
+                .values(lease_expires_at=expires_at)
+            )
+
+    def fail_orphaned(self, error: str, now: float, owner: str = None):
+        import sqlalchemy as sa
+
+        t = self.table
+        # Rows from before leases have no lease and count as orphaned
+        conditions = [t.c.lease_expires_at < now, t.c.lease_expires_at.is_(None)]
+        if owner is not None:
+            conditions.append(t.c.owner == owner)
+        orphaned = sa.or_(*conditions)
+        with self.engine.begin() as conn:
+            conn.execute(
+                t.update()
+                .where(t.c.status.notin_(FINISHED_STATUSES), orphaned)
+                .values(status=FAILED, error=error, updated_at=time.time())
+            )
+
+    def purge(self, finished_before: float):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(t.delete().where(t.c.status.in_(FINISHED_STATUSES), t.c.updated_at < finished_before))
+
+
+def build_job_store():
+    if PLAN_JOB_STORE == "sqlite":
+        return SQLAlchemyJobStore()
+    if PLAN_JOB_STORE != "memory":
+        raise ValueError(f"Unknown PLAN_JOB_STORE '{PLAN_JOB_STORE}'. Use 'memory' or 'sqlite'.")
+    return MemoryJobStore()
+
+
+# --- Queue and workers ---
+async def run_plan_job(user_profile: dict) -> dict:
+    plan_str = await generate_plan_with_assembly_line(user_profile)
+    return finalize_plan(plan_str, user_profile)
+
+
+class PlanJobQueue:
+    """
+    A fixed pool of asyncio workers fed from per-tenant FIFO queues. Workers take
+    tenants in round-robin order and skip any tenant already at its concurrency limit,
+    so one tenant's burst can't hold every worker.
+
+    Store calls run in a thread (asyncio.to_thread): the SQL store blocks on the
+    database and would otherwise stall every request on the event loop.
+    """
+
+    def __init__(self, store, workers: int = PLAN_JOB_WORKERS,
+                 tenant_concurrency: int = PLAN_JOB_TENANT_CONCURRENCY,
+                 max_queued: int = PLAN_JOB_MAX_QUEUED, runner=run_plan_job):
+        self.store = store
+        self.workers = workers
+        self.tenant_concurrency = tenant_concurrency
+        self.max_queued = max_queued
+        self.runner = runner
+        self._pending = OrderedDict()  # tenant -> deque of (job_id, user_profile)
+        self._queued = 0
+        self._running = {}  # tenant -> jobs running
+        self._condition = None
+        self._submit_lock = None
+        self._tasks = []
+        # job_id -> event set (and replaced) whenever the job changes, for subscribers
+        self._changed = {}
+        self._last_purge = 0.0
+        self.instance_id = None
+
+    # Lifecycle
+    async def start(self):
+        # Resolved here rather than at import, so forked worker processes get their own pid
+        self.instance_id = PLAN_JOB_INSTANCE_ID or f"{socket.gethostname()}:{os.getpid()}"
+        # Queued jobs live in the process that took them: this instance's jobs from before a
+        # restart and jobs of processes that stopped renewing their leases are lost
+        await asyncio.to_thread(self.store.fail_orphaned, ORPHANED_ERROR, time.time(), owner=self.instance_id)
+        self._pending.clear()
+        self._queued = 0
+        self._running.clear()
+        self._condition = asyncio.Condition()
+        self._submit_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain_leases()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _maintain_leases(self):
+        while True:
+            await asyncio.sleep(PLAN_JOB_LEASE_RENEW_SECONDS)
+            try:
+                now = time.time()
+                await asyncio.to_thread(self.store.renew_leases, self.instance_id, now + PLAN_JOB_LEASE_SECONDS)
+                await asyncio.to_thread(self.store.fail_orphaned, ORPHANED_ERROR, now)
+            except Exception as e:
+                print(f"Plan jobs: renewing leases failed: {e!r}")
+
+    # Submission
+    async def submit(self, user_profile: dict, tenant: str, idempotency_key: str = None):
+        """
+        Returns (job, deduplicated). A duplicate of a queued, running or recently
+        finished job returns that job instead of running the pipeline again.
+        """
+        await self._purge_expired()
+        key = dedup_key(tenant, user_profile, idempotency_key)
+        # The lookup and the insert must not interleave with another submission of the same job
+        async with self._submit_lock:
+            existing = await asyncio.to_thread(self.store.find_reusable, key)
+            if existing is not None:
+                PLAN_JOBS.inc(outcome="deduplicated")
+                return existing, True
+            if self._queued >= self.max_queued:
+                PLAN_JOBS.inc(outcome="rejected")
+                raise JobQueueFull(f"{self._queued} plan jobs are already queued.")
+
+            job = _new_job(tenant, key, user_profile, self.instance_id)
+            await asyncio.to_thread(self.store.add, job)
+        async with self._condition:
+            self._pending.setdefault(tenant, deque()).append((job["job_id"], user_profile))
+            self._queued += 1
+            self._condition.notify()
+        PLAN_JOBS.inc(outcome="submitted")
+        return job, False
+
+    async def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge >= PLAN_JOB_PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            await asyncio.to_thread(self.store.purge, now - PLAN_JOB_RETENTION_SECONDS)
+
+    # Workers
+    def _take_next(self):
+        for tenant, jobs in self._pending.items():
+            if self._running.get(tenant, 0) >= self.tenant_concurrency:
+                continue
+            job_id, user_profile = jobs.popleft()
+            if jobs:
+                # Rotate so the next pick starts with the following tenant
+                self._pending.move_to_end(tenant)
+            else:
+                del self._pending[tenant]
+            self._queued -= 1
+            self._running[tenant] = self._running.get(tenant, 0) + 1
+            return tenant, job_id, user_profile
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                picked = self._take_next()
+                while picked is None:
+                    await self._condition.wait()
+                    picked = self._take_next()
+            tenant, job_id, user_profile = picked
+            try:
+                await self._run(job_id, user_profile)
+            finally:
+                async with self._condition:
+                    self._running[tenant] -= 1
+                    if not self._running[tenant]:
+                        del self._running[tenant]
+                    # A tenant that was at its limit may have a job another worker can take
+                    self._condition.notify_all()
+
+    async def _run(self, job_id: str, user_profile: dict):
+        await self._set(job_id, status=RUNNING)
+        try:
+            async with asyncio.timeout(PLAN_JOB_TIMEOUT_SECONDS):
+                result = await self.runner(user_profile)
+        except asyncio.CancelledError:
+            await self._set(job_id, status=FAILED, error="The job was cancelled.")
+            raise
+        except Exception as e:
+            print(f"Plan job {job_id} failed: {e!r}")
+            error = f"Timed out after {PLAN_JOB_TIMEOUT_SECONDS:g}s." if isinstance(e, TimeoutError) else str(e)
+            await self._set(job_id, status=FAILED, error=error)
+            PLAN_JOBS.inc(outcome="failed")
+            return
+        await self._set(job_id, status=SUCCEEDED, result=result)
+        PLAN_JOBS.inc(outcome="succeeded")
+
+    # Status changes
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _set(self, job_id: str, **fields):
+        await asyncio.to_thread(self.store.update, job_id, **fields)
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_change(self, job_id: str, timeout: float):
+        """
+        Returns when this process updates the job or after `timeout` seconds (another
+        process sharing the store may have updated it, so callers re-read either way).
+        """
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except TimeoutError:
+            pass
+
+    def stats(self) -> dict:
+        return {"queued": self._queued, "running": sum(self._running.values()), "workers": self.workers}
+
+    def publish_metrics(self):
+        for name, value in self.stats().items():
+            PLAN_JOB_GAUGES[name].set(value)
+
+
+def public_job(job: dict) -> dict:
+    """
+    The client-facing view of a job: no profile or dedup key, and the result only once done.
+    """
+    view = {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["status"] == SUCCEEDED:
+        view["result"] = job["result"]
+    if job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+plan_jobs = PlanJobQueue(build_job_store())
@@ -0,0 +1,185 @@
+# backend/services/prompt_budget.py
+# Keeps agent prompts inside a token budget: compact JSON, chat-history windowing and per-agent limits.
+
+import os
+import math
+import hashlib
+from collections import OrderedDict
+from services.serialization import dumps_canonical
+
+# Gemini tokenizes English/JSON at roughly 4 characters per token. The estimate only has
+# to be good enough to keep prompts well inside the budget, so no tokenizer round-trip.
+CHARS_PER_TOKEN = 4
+
+# Per-agent prompt budgets in tokens (template + inputs), e.g. PROMPT_BUDGET_QA_TOKENS=3000
+DEFAULT_AGENT_BUDGETS = {
+    "analyst": 6000,
+    "writer": 6000,
+    "qa": 4000,
+    "evaluator": 4000,
+}
+AGENT_TOKEN_BUDGETS = {
+    agent: int(os.getenv(f"PROMPT_BUDGET_{agent.upper()}_TOKENS", str(default)))
+    for agent, default in DEFAULT_AGENT_BUDGETS.items()
+}
+
+# Chat turns sent verbatim; older turns are folded into the running summary
+CHAT_WINDOW_TURNS = int(os.getenv("PROMPT_CHAT_WINDOW_TURNS", "6"))
+SUMMARY_LINE_CHARS = 160
+SUMMARY_MAX_CHARS = 1500
+SUMMARY_CACHE_MAX_ENTRIES = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prompt_tokens(prompt_template, input_data: dict) -> int:
+    """
+    Estimated tokens of the prompt exactly as it will be sent.
+    """
+    return estimate_tokens(prompt_template.format(**input_data))
+
+
+def _compact(value, float_digits: int):
+    if isinstance(value, dict):
+        return {k: _compact(v, float_digits) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_compact(v, float_digits) for v in value]
+    if isinstance(value, float):
+        rounded = round(value, float_digits)
+        return int(rounded) if rounded.is_integer() else rounded
+    return value
+
+
+def compact_json(data, float_digits: int = 2) -> str:
+    """
+    JSON without whitespace, with floats rounded, null fields dropped and keys sorted
+    (the same data always produces the same prompt text).
+    """
+    return dumps_canonical(_compact(data, float_digits))
+
+
+def compact_market_stats(stats: dict, detail: str = "full") -> str:
+    """
+    market_stats.json for a prompt. "full" keeps everything but the metadata, "summary"
+    keeps only the latest value of each rolling metric and "core" drops the multi-horizon
+    section. Correlations are sent once per pair instead of as a full matrix.
+    """
+    correlations = stats.get('correlations', {})
+    assets = list(correlations)
+    compact = {
+        "asset_stats": stats.get('asset_stats', {}),
+        "correlations": {
+            f"{a}|{b}": correlations[a].get(b)
+            for i, a in enumerate(assets) for b in assets[i + 1:]
+        },
+    }
+    multi_horizon = stats.get('multi_horizon')
+    if multi_horizon and detail != "core":
+        if detail == "summary":
+            multi_horizon = {
+                "assets": {
+                    asset: {
+                        "cagr_percent": values.get("cagr_percent"),
+                        "rolling_volatility_percent": (values.get("rolling_volatility_percent") or {}).get("latest"),
+                        "rolling_sharpe_ratio": (values.get("rolling_sharpe_ratio") or {}).get("latest"),
+                        "drawdown": values.get("drawdown"),
+                    }
+                    for asset, values in multi_horizon.get("assets", {}).items()
+                },
+                "rolling_correlations": {
+                    pair: values.get("latest") for pair, values in multi_horizon.get("rolling_correlations", {}).items()
+                },
+            }
+        compact["multi_horizon"] = {k: v for k, v in multi_horizon.items() if k != "schema_version"}
+    return compact_json(compact)
+
+
+def fit_prompt(agent: str, prompt_template, candidates):
+    """
+    Returns the first input dict from `candidates` (ordered richest to leanest) whose
+    prompt fits the agent's budget. If none fits, the leanest one is used.
+    """
+    budget = AGENT_TOKEN_BUDGETS.get(agent)
+    input_data, tokens = None, 0
+    for input_data in candidates:
+        tokens = prompt_tokens(prompt_template, input_data)
+        if budget is None or tokens <= budget:
+            print(f"--- {agent} prompt: ~{tokens} tokens (budget {budget}) ---")
+            return input_data
+    print(f"Warning: {agent} prompt is ~{tokens} tokens, over its budget of {budget}; sending the most compact form.")
+    return input_data
+
+
+# --- Chat history ---
+def _summarize_turn(turn: dict) -> str:
+    # First sentence of each message, clipped: cheap and never calls the LLM
+    content = ' '.join(str(turn.get('content', '')).split())
+    first_sentence = content.split('. ')[0]
+    if len(first_sentence) > SUMMARY_LINE_CHARS:
+        first_sentence = first_sentence[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+    return f"{turn.get('role', 'user')}: {first_sentence}"
+
+
+class ChatHistoryCompactor:
+    """
+    Splits a chat history into a window of recent turns and a running summary of the
+    older ones. Summaries are cached by a digest chained over the turns, so when a
+    conversation grows by one turn only that turn is summarized and appended.
+    """
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+
+    def _remember(self, digest: str, summary: str):
+        self._summaries[digest] = summary
+        self._summaries.move_to_end(digest)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+    def summarize(self, turns: list) -> str:
+        digest, summary = "", ""
+        for turn in turns:
+            digest = hashlib.sha256(
+                (digest + dumps_canonical(turn)).encode('utf-8')
+            ).hexdigest()
+            cached = self._summaries.get(digest)
+            if cached is None:
+                cached = (summary + "\n" + _summarize_turn(turn)).strip()
+                if len(cached) > SUMMARY_MAX_CHARS:
+                    # Keep the newest lines; the oldest context matters least
+                    cached = "..." + cached[-(SUMMARY_MAX_CHARS - 3):].split("\n", 1)[-1]
+                self._remember(digest, cached)
+            else:
+                self._summaries.move_to_end(digest)
+            summary = cached
+        return summary
+
+    def compact(self, turns: list, window: int = CHAT_WINDOW_TURNS) -> dict:
+        """
+        {"summary": ..., "recent": [...]} with at most `window` verbatim turns.
+        """
+        window = max(window, 0)
+        older, recent = (turns[:-window], turns[-window:]) if window else (turns, [])
+        result = {"recent": recent}
+        if older:
+            result["summary"] = self.summarize(older)
+        return result
+
+
+chat_history_compactor = ChatHistoryCompactor()
+
+
+def chat_history_candidates(turns: list, window: int = CHAT_WINDOW_TURNS):
+    """
+    Compact chat-history strings from most to least context: the full window with the
+    summary, then halving the window, then the window alone without the summary.
+    """
+    while True:
+        yield compact_json(chat_history_compactor.compact(turns, window))
+        if window <= 1:
+            break
+        window //= 2
+    yield compact_json({"recent": turns[-1:]})
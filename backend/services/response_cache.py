@@ -0,0 +1,169 @@
+# backend/services/response_cache.py
+# Content-addressed cache for the outputs of the analyst/strategist/writer agents.
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from services.serialization import dumps_canonical
+
+PLAN_CACHE_BACKEND = os.getenv("PLAN_CACHE_BACKEND", "memory")  # "memory", "sqlite" or "off"
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", "3600"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1024"))
+PLAN_CACHE_SQLITE_PATH = os.getenv("PLAN_CACHE_SQLITE_PATH", "plan_cache.sqlite3")
+
+
+def _normalize_value(value):
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, float):
+        # 50000 and 50000.0 (or 0.1 + 0.2 and 0.3) should hash the same
+        return int(value) if value.is_integer() else round(value, 6)
+    return value
+
+
+def normalize_profile(user_profile: dict) -> dict:
+    """
+    Returns a canonical copy of a user profile: whitespace collapsed in strings and
+    integral floats turned into ints. List order is kept (the first goal is the primary one).
+    """
+    return _normalize_value(user_profile)
+
+
+def cache_key(stage: str, parts: dict) -> str:
+    """
+    Hashes everything a stage's output depends on into a stable key.
+    """
+    canonical = dumps_canonical({"stage": stage, **parts})
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# --- Backends ---
+class MemoryCacheBackend:
+    """
+    In-process LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_entries: int = PLAN_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk cache that survives restarts and can be shared by several workers on one host.
+    LRU order is tracked with a last_access column.
+    """
+
+    def __init__(self, path: str = PLAN_CACHE_SQLITE_PATH, max_entries: int = PLAN_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_last_access ON response_cache (last_access)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """
+    Thin front for a backend that applies the TTL and can be switched off.
+    """
+
+    def __init__(self, backend=None, ttl: float = PLAN_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, key: str):
+        if self.backend is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key: str, value: str):
+        if self.backend is None:
+            return
+        self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def build_response_cache() -> ResponseCache:
+    if PLAN_CACHE_BACKEND == "off":
+        return ResponseCache(None)
+    if PLAN_CACHE_BACKEND == "sqlite":
+        return ResponseCache(SQLiteCacheBackend())
+    if PLAN_CACHE_BACKEND != "memory":
+        raise ValueError(f"Unknown PLAN_CACHE_BACKEND '{PLAN_CACHE_BACKEND}'. Use 'memory', 'sqlite' or 'off'.")
+    return ResponseCache(MemoryCacheBackend())
+
+
+# Shared by the planning agents
+plan_cache = build_response_cache()
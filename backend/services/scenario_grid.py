@@ -0,0 +1,101 @@
+# backend/services/scenario_grid.py
+# What-if grid: real goal timelines over every combination of returns, inflation, equity weight and contribution.
+
+import os
+import math
+import numpy as np
+from services.plan_engine import compute_financial_metrics, project_goal_timelines
+
+SCENARIO_GRID_MAX_POINTS = int(os.getenv("SCENARIO_GRID_MAX_POINTS", "250000"))
+SCENARIO_GRID_MAX_STEPS = 101
+# Timelines beyond this are reported as never (null), like "More than 100" on the dashboard
+SCENARIO_GRID_MAX_YEARS = 100
+
+# Axis order of the result arrays (C order: the last axis varies fastest)
+GRID_AXES = ("equity_return", "bond_return", "inflation", "equity_weight", "monthly_contribution")
+
+# Annual percentages; the defaults bracket the forecaster's pessimistic..optimistic scenarios
+DEFAULT_GRID_RANGES = {
+    "equity_return": {"min": 2.0, "max": 18.0, "steps": 17},
+    "bond_return": {"min": 4.0, "max": 9.0, "steps": 6},
+    "inflation": {"min": 3.0, "max": 9.0, "steps": 7},
+    "equity_weight": {"min": 0.0, "max": 100.0, "steps": 11},
+}
+
+
+def axis_values(spec: dict) -> np.ndarray:
+    """
+    {"min", "max", "steps"} -> evenly spaced values (just `min` when steps is 1).
+    """
+    steps = int(spec.get("steps", 1))
+    if not 1 <= steps <= SCENARIO_GRID_MAX_STEPS:
+        raise ValueError(f"Grid axes take 1 to {SCENARIO_GRID_MAX_STEPS} steps, got {steps}.")
+    if steps == 1:
+        return np.array([float(spec["min"])])
+    if spec.get("max") is None:
+        raise ValueError("A grid axis with more than one step needs a max.")
+    return np.linspace(float(spec["min"]), float(spec["max"]), steps)
+
+
+def real_returns(equity_return, bond_return, inflation, equity_weight):
+    """
+    Inflation-adjusted annual return of an equity/bond blend (all inputs in percent,
+    broadcast against each other): (1 + nominal) / (1 + inflation) - 1, as a fraction.
+    """
+    weight = np.asarray(equity_weight, dtype=float) / 100
+    nominal = (weight * np.asarray(equity_return, dtype=float) + (1 - weight) * np.asarray(bond_return, dtype=float)) / 100
+    return (1 + nominal) / (1 + np.asarray(inflation, dtype=float) / 100) - 1
+
+
+def compute_scenario_grid(user_profile: dict, ranges: dict = None) -> dict:
+    """
+    Solves every goal's timeline in today's money at every point of the grid in one
+    vectorized pass. Missing axes use DEFAULT_GRID_RANGES; the contribution axis
+    defaults to the profile's monthly savings potential.
+
+    Returns the axis values plus, per goal, the timelines as one flat C-order list
+    (null where the goal isn't reached within SCENARIO_GRID_MAX_YEARS) and the share of
+    grid points that meet the goal's own timeline.
+    """
+    metrics = compute_financial_metrics(user_profile)
+    ranges = {**DEFAULT_GRID_RANGES, **{k: v for k, v in (ranges or {}).items() if v is not None}}
+    ranges.setdefault("monthly_contribution", {"min": max(metrics["monthly_savings_potential"], 0), "steps": 1})
+
+    axes = {name: axis_values(ranges[name]) for name in GRID_AXES}
+    shape = tuple(len(values) for values in axes.values())
+    points = math.prod(shape)
+    if points > SCENARIO_GRID_MAX_POINTS:
+        raise ValueError(f"The grid has {points} points; the limit is {SCENARIO_GRID_MAX_POINTS}.")
+
+    # Sparse open grids: each axis keeps its own dimension and broadcasting builds the grid
+    equity, bond, inflation, weight, contribution = np.meshgrid(*axes.values(), indexing='ij', sparse=True)
+    rates = real_returns(equity, bond, inflation, weight)
+
+    goals = user_profile.get('goals') or []
+    targets = np.array([float(g['target_amount']) for g in goals]).reshape((-1,) + (1,) * len(shape))
+    years = project_goal_timelines(
+        targets, metrics['investable_assets'], contribution, rates, allow_negative_rates=True
+    )
+    # Goals already met come out of the closed form as slightly negative
+    years = np.maximum(years, 0.0)
+    reached = years <= SCENARIO_GRID_MAX_YEARS
+
+    goal_results = []
+    for goal, goal_years, goal_reached in zip(goals, years, reached):
+        flat = np.where(goal_reached, goal_years, np.nan).ravel().tolist()
+        goal_results.append({
+            "name": goal['name'],
+            "target_amount": goal['target_amount'],
+            "timeline_years": goal['timeline_years'],
+            "years": [None if v != v else v for v in flat],
+            "on_track_share": round(float(np.mean(goal_years <= goal['timeline_years'])), 4),
+        })
+
+    return {
+        "axes": {name: [round(float(v), 4) for v in values] for name, values in axes.items()},
+        "axis_order": list(GRID_AXES),
+        "shape": list(shape),
+        "points": points,
+        "initial_investment": metrics['investable_assets'],
+        "goals": goal_results,
+    }
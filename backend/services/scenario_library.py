@@ -0,0 +1,155 @@
+# backend/services/scenario_library.py
+# Forecaster scenarios cached per goal: pre-warmed at startup, refreshed in the background, shared by every user.
+
+import os
+import re
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict
+from services.instrumentation import record_cache, registry
+
+# Goals generated at startup so their first request is served from the library (empty disables)
+SCENARIO_LIBRARY_PREWARM_GOALS = [
+    goal.strip() for goal in os.getenv(
+        "SCENARIO_LIBRARY_PREWARM_GOALS",
+        "Buy a House,Retirement,Child's Education,Emergency Fund,Buy a Car,Wedding,Travel,Start a Business"
+    ).split(',') if goal.strip()
+]
+# Entries older than this are regenerated in the background; until then the old one is served
+SCENARIO_LIBRARY_REFRESH_SECONDS = float(os.getenv("SCENARIO_LIBRARY_REFRESH_SECONDS", "43200"))
+SCENARIO_LIBRARY_MAX_GOALS = int(os.getenv("SCENARIO_LIBRARY_MAX_GOALS", "500"))
+# How often the background task looks for stale entries
+SCENARIO_LIBRARY_CHECK_SECONDS = 300.0
+
+SCENARIO_LIBRARY_GAUGES = {
+    "goals": registry.gauge("finpilot_scenario_library_goals", "Goals held in the scenario library."),
+    "generating": registry.gauge(
+        "finpilot_scenario_library_generating", "Scenario library entries being generated right now."),
+}
+
+
+def normalize_goal(goal_name: str) -> str:
+    """
+    "Buy a House!" and "  buy a house" share one library entry.
+    """
+    return ' '.join(re.sub(r"[^\w\s]", " ", str(goal_name).lower()).split())
+
+
+class ScenarioLibrary:
+    """
+    Holds the forecaster's scenarios (narratives plus return/inflation parameters) per
+    normalized goal. The scenarios don't depend on the user's finances, so one LLM call
+    serves every user with the same goal; callers project their own timelines locally.
+
+    `generate(goal_name)` is the LLM call. Concurrent misses for a goal share one call,
+    and a stale entry is served while its replacement is generated. The scheduled refresh
+    only regenerates the pre-warmed goals and entries read since they were generated, so
+    one-off goals aren't kept fresh for nobody.
+    """
+
+    def __init__(self, generate, refresh_seconds: float = SCENARIO_LIBRARY_REFRESH_SECONDS,
+                 max_goals: int = SCENARIO_LIBRARY_MAX_GOALS):
+        self.generate = generate
+        self.refresh_seconds = refresh_seconds
+        self.max_goals = max_goals
+        self._entries = OrderedDict()  # normalized goal -> {"goal", "scenarios", "generated_at", "last_used"}
+        self._pending = {}  # normalized goal -> task generating it
+        self._prewarm_keys = set()
+        self._task = None
+
+    async def get(self, goal_name: str) -> dict:
+        key = normalize_goal(goal_name)
+        entry = self._entries.get(key)
+        record_cache("forecaster", entry is not None)
+        if entry is None:
+            return await self._refresh(key, goal_name)
+        self._entries.move_to_end(key)
+        entry["last_used"] = time.time()
+        if entry["last_used"] - entry["generated_at"] >= self.refresh_seconds:
+            self._refresh_in_background(key, entry["goal"])
+        return entry["scenarios"]
+
+    def _refresh(self, key: str, goal_name: str) -> asyncio.Future:
+        task = self._pending.get(key)
+        if task is None:
+            # A fresh context keeps background generations off the caller's request trace
+            task = self._pending[key] = asyncio.get_running_loop().create_task(
+                self._generate(key, goal_name), context=contextvars.Context()
+            )
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return asyncio.shield(task)
+
+    def _refresh_in_background(self, key: str, goal_name: str):
+        task = self._refresh(key, goal_name)
+        # Failures are logged by _generate; the old entry keeps being served
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _generate(self, key: str, goal_name: str) -> dict:
+        try:
+            scenarios = await self.generate(goal_name)
+        except Exception as e:
+            print(f"Scenario library: generating scenarios for '{goal_name}' failed: {e!r}")
+            raise
+        self._entries[key] = {"goal": goal_name, "scenarios": scenarios, "generated_at": time.time(), "last_used": None}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_goals:
+            self._entries.popitem(last=False)
+        return scenarios
+
+    async def prewarm(self, goals):
+        self._prewarm_keys.update(normalize_goal(goal) for goal in goals)
+        for goal in goals:
+            if normalize_goal(goal) not in self._entries:
+                try:
+                    await self._refresh(normalize_goal(goal), goal)
+                except Exception:
+                    pass
+
+    async def refresh_stale(self):
+        """
+        Regenerates stale entries that are pre-warmed or were read since their last
+        generation. Other stale entries are only refreshed if get() asks for them again.
+        """
+        cutoff = time.time() - self.refresh_seconds
+        stale = [
+            (key, entry["goal"]) for key, entry in self._entries.items()
+            if entry["generated_at"] < cutoff and (
+                key in self._prewarm_keys
+                or (entry["last_used"] is not None and entry["last_used"] > entry["generated_at"])
+            )
+        ]
+        for key, goal in stale:
+            try:
+                await self._refresh(key, goal)
+            except Exception:
+                pass
+
+    async def _maintain(self, prewarm_goals):
+        await self.prewarm(prewarm_goals)
+        print(f"Scenario library: {len(self._entries)} goal(s) ready.")
+        while True:
+            await asyncio.sleep(SCENARIO_LIBRARY_CHECK_SECONDS)
+            await self.refresh_stale()
+
+    def start(self, prewarm_goals=SCENARIO_LIBRARY_PREWARM_GOALS):
+        """
+        Pre-warms the common goals and then refreshes stale entries that are pre-warmed
+        or were read since their last generation, in the background so startup isn't
+        held up by the LLM.
+        """
+        self._task = asyncio.create_task(self._maintain(prewarm_goals))
+
+    async def stop(self):
+        tasks = [t for t in [self._task, *self._pending.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {"goals": len(self._entries), "generating": len(self._pending)}
+
+    def publish_metrics(self):
+        for name, value in self.stats().items():
+            SCENARIO_LIBRARY_GAUGES[name].set(value)
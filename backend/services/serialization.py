@@ -0,0 +1,55 @@
+# backend/services/serialization.py
+# One JSON layer for the backend (orjson): API responses, prompt payloads, cache keys and data files.
+
+import orjson
+from starlette.responses import JSONResponse
+
+# NumPy scalars/arrays and int dict keys serialize as-is everywhere
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+# Sorted keys: the same data always gives the same text, so prompts and cache keys are stable
+_CANONICAL_OPTIONS = _OPTIONS | orjson.OPT_SORT_KEYS
+
+
+def _default(value):
+    # What orjson doesn't know natively: Pydantic models, sets, and anything else as str
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(data) -> bytes:
+    """
+    Compact UTF-8 JSON, keys in insertion order. NaN and infinity become null.
+    """
+    return orjson.dumps(data, default=_default, option=_OPTIONS)
+
+
+def dumps_canonical(data) -> str:
+    """
+    Compact JSON with sorted keys, for prompt payloads and cache keys.
+    Non-ASCII text is kept as-is (like json.dumps(..., ensure_ascii=False)).
+    """
+    return orjson.dumps(data, default=_default, option=_CANONICAL_OPTIONS).decode("utf-8")
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+def write_json_file(f, data, indent: bool = True):
+    """
+    Writes `data` to a file opened in binary mode, 2-space indented by default.
+    """
+    f.write(orjson.dumps(data, default=_default, option=_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)))
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    The app's default response class. Endpoints with large payloads return it directly,
+    which also skips FastAPI's jsonable_encoder pass over the returned dict.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
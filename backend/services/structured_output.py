@@ -0,0 +1,257 @@
+# backend/services/structured_output.py
+# Tolerant JSON extraction, output schemas for the JSON-producing agents, and targeted re-asks of a failing stage.
+
+import os
+import re
+import json
+from typing import Annotated, Any, Dict, List
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError
+from services.llm_gateway import invoke_llm_with_retry
+from services.instrumentation import record_parse_failure, record_reask
+
+# How often a stage is asked again after its output failed validation
+STRUCTURED_OUTPUT_MAX_REASKS = int(os.getenv("STRUCTURED_OUTPUT_MAX_REASKS", "1"))
+# The rejected response is quoted back to the agent, clipped to this many characters
+REASK_PREVIOUS_RESPONSE_CHARS = 6000
+# At most this many validation errors are reported back to the agent
+REASK_MAX_ERRORS = 8
+
+
+class StructuredOutputError(ValueError):
+    """
+    An agent response that could not be parsed or validated. `detail` is the part that
+    is sent back to the agent when it is re-asked.
+    """
+    def __init__(self, source: str, detail: str):
+        super().__init__(f"{source} returned invalid data ({detail}).")
+        self.detail = detail
+
+
+# --- Tolerant extraction ---
+_CODE_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def _outermost_object(text: str):
+    """
+    The first balanced {...} block, skipping braces inside strings. An unbalanced
+    (e.g. truncated) block falls back to the last closing brace.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    end = text.rfind('}')
+    return text[start:end + 1] if end > start else None
+
+
+def extract_json(text: str, source: str = "AI") -> dict:
+    """
+    Parses the JSON object out of an LLM response: prefers a ```json fenced block,
+    ignores prose around the object and drops trailing commas before } or ].
+    """
+    if not isinstance(text, str):
+        raise StructuredOutputError(source, "the response was not text")
+    detail = "no JSON object found"
+    for block in _CODE_FENCE.findall(text) + [text]:
+        candidate = _outermost_object(block)
+        if candidate is None:
+            continue
+        # The comma fix is only tried when the text as written doesn't parse
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                # Stdlib rather than services.serialization: its errors give the line and
+                # column quoted back to the model in the re-ask
+                value = json.loads(attempt)
+            except json.JSONDecodeError as e:
+                detail = f"invalid JSON: {e.msg} at line {e.lineno} column {e.colno}"
+                continue
+            if isinstance(value, dict):
+                return value
+            detail = "the JSON value is not an object"
+    raise StructuredOutputError(source, detail)
+
+
+# --- Output schemas ---
+def _to_number(value):
+    # 8, "8", "8/10", "18.5%" and " 7 " all become floats; booleans are not numbers
+    if isinstance(value, bool):
+        raise ValueError("expected a number")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return float(value.split('/')[0].replace('%', '').strip())
+    raise ValueError("expected a number")
+
+
+def _to_percent_string(value):
+    # Allocations stay "30%" strings, which is what the dashboard shows
+    number = _to_number(value)
+    if number < 0:
+        raise ValueError("allocation percentages cannot be negative")
+    return f"{number:g}%"
+
+
+Number = Annotated[float, BeforeValidator(_to_number)]
+Score = Annotated[float, BeforeValidator(_to_number), Field(ge=0, le=10)]
+AllocationPercent = Annotated[str, BeforeValidator(_to_percent_string)]
+
+
+class AgentOutput(BaseModel):
+    # Keys the schema doesn't know about are passed through untouched
+    model_config = ConfigDict(extra="allow")
+
+
+class SubPlan(AgentOutput):
+    summary: str = Field(..., min_length=1)
+    asset_allocation: Dict[str, AllocationPercent] = Field(..., min_length=1)
+    projected_goal_timeline_years: Dict[str, Any] = Field(default_factory=dict)
+    recommendations: List[str] = Field(..., min_length=1)
+
+
+class PlanOutput(AgentOutput):
+    sentinel_plan: SubPlan
+    voyager_plan: SubPlan
+
+
+class QualityScore(AgentOutput):
+    score: Score
+    reasoning: str = ""
+
+
+class QualityScores(AgentOutput):
+    personalization: QualityScore
+    actionability: QualityScore
+    clarity_and_tone: QualityScore
+
+
+class FinalVerdict(AgentOutput):
+    overall_score: Score
+    summary: str = ""
+
+
+class EvaluationOutput(AgentOutput):
+    golden_principle_reasoning: Dict[str, str] = Field(default_factory=dict)
+    quality_scores: QualityScores
+    final_verdict: FinalVerdict
+
+
+class ScenarioParameters(AgentOutput):
+    avg_equity_return: Number
+    avg_bond_return: Number
+    avg_inflation: Number
+
+
+class Scenario(AgentOutput):
+    name: str = Field(..., min_length=1)
+    narrative: str = ""
+    parameters: ScenarioParameters
+
+
+class ScenariosOutput(AgentOutput):
+    scenarios: List[Scenario] = Field(..., min_length=1)
+
+
+def _describe_validation_error(error: ValidationError) -> str:
+    problems = [
+        f"{'.'.join(str(part) for part in e['loc']) or 'response'}: {e['msg']}"
+        for e in error.errors()[:REASK_MAX_ERRORS]
+    ]
+    if error.error_count() > REASK_MAX_ERRORS:
+        problems.append(f"and {error.error_count() - REASK_MAX_ERRORS} more")
+    return "; ".join(problems)
+
+
+def parse_structured(text: str, schema, source: str = "AI") -> dict:
+    """
+    Extracts the JSON object from `text` and validates it against `schema`, returning
+    the normalized dict (numbers parsed, allocations as "X%").
+    """
+    data = extract_json(text, source)
+    try:
+        return schema.model_validate(data).model_dump()
+    except ValidationError as e:
+        raise StructuredOutputError(source, _describe_validation_error(e))
+
+
+def is_valid_output(text: str, schema) -> bool:
+    try:
+        parse_structured(text, schema)
+        return True
+    except StructuredOutputError:
+        return False
+
+
+# --- Targeted re-asks ---
+reask_suffix = """
+
+YOUR PREVIOUS RESPONSE COULD NOT BE USED:
+{validation_error}
+
+YOUR PREVIOUS RESPONSE WAS:
+{previous_response}
+
+Reply again with the corrected response: a single, valid JSON object with exactly the structure described above and no other text before or after it.
+"""
+
+# template text -> the same prompt with the correction section appended
+_reask_prompts = {}
+
+
+def reask_prompt(prompt_template) -> PromptTemplate:
+    prompt = _reask_prompts.get(prompt_template.template)
+    if prompt is None:
+        prompt = _reask_prompts[prompt_template.template] = PromptTemplate(
+            template=prompt_template.template + reask_suffix,
+            input_variables=[*prompt_template.input_variables, "validation_error", "previous_response"]
+        )
+    return prompt
+
+
+async def parse_with_reask(agent: str, prompt_template, input_data: dict, response: str, schema,
+                           source: str = "AI", temperature: float = 0.7):
+    """
+    Validates one agent's response. If it fails even after the local fixes in
+    extract_json, only this agent is asked again (same input plus the validation
+    error), up to STRUCTURED_OUTPUT_MAX_REASKS times; the stages before it are not rerun.
+
+    Returns (parsed output, the response text it was parsed from).
+    """
+    for attempt in range(STRUCTURED_OUTPUT_MAX_REASKS + 1):
+        try:
+            return parse_structured(response, schema, source), response
+        except StructuredOutputError as e:
+            record_parse_failure(agent)
+            if attempt == STRUCTURED_OUTPUT_MAX_REASKS:
+                raise
+            print(f"--- {source} output rejected ({e.detail}); asking the {agent} again ---")
+            record_reask(agent)
+            response = await invoke_llm_with_retry(
+                reask_prompt(prompt_template),
+                {
+                    **input_data,
+                    "validation_error": e.detail,
+                    "previous_response": str(response)[:REASK_PREVIOUS_RESPONSE_CHARS]
+                },
+                temperature=temperature,
+                agent=agent
+            )